@@ -1,21 +1,195 @@
+import asyncio
+import contextlib
+import os
+import secrets
+import time
 from typing import List, Optional
-from fastapi import FastAPI, HTTPException
+import orjson
+from fastapi import FastAPI, Header, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import JSONResponse, Response
+from pydantic import BaseModel, Field
+from coalescer import RequestCoalescer
+from engine_executor import EngineExecutor, EngineSaturated
+from user_store import MemoryUserStore, SQLiteUserStore
 # Assuming RecommendationEngine is in a separate module
 from recommendation_engine import RecommendationEngine
 
+def _optional_int(name):
+    value = os.environ.get(name)
+    return int(value) if value else None
+
+# Engine settings come from the environment so every uvicorn worker picks up
+# the same ones; CINDER_MMAP=1 with a product_store.py directory as metadata
+# lets all workers on a host share one copy of the index and metadata
+ENGINE_CONFIG = {
+    "faiss_index_path": os.environ.get("CINDER_INDEX_PATH", "image_vectors.index"),
+    "product_metadata_path": os.environ.get("CINDER_METADATA_PATH", "processed_data.json"),
+    "embeddings_path": os.environ.get("CINDER_EMBEDDINGS_PATH") or None,
+    "mmap": os.environ.get("CINDER_MMAP", "0") == "1",
+    "nprobe": _optional_int("CINDER_NPROBE"),
+    "ef_search": _optional_int("CINDER_EF_SEARCH"),
+    "diversity_lambda": (
+        float(os.environ["CINDER_MMR_LAMBDA"]) if os.environ.get("CINDER_MMR_LAMBDA") else None
+    ),
+    "max_per_title": _optional_int("CINDER_MAX_PER_TITLE"),
+    "interest_centroids": _optional_int("CINDER_INTEREST_CENTROIDS") or 0,
+    "result_cache_bytes": int(os.environ.get("CINDER_RESULT_CACHE_MB", "64")) * 2**20,
+    "result_cache_ttl": float(os.environ.get("CINDER_RESULT_CACHE_TTL", "60")),
+    "refine_factor": _optional_int("CINDER_REFINE_FACTOR"),
+}
+
+# User state: an LRU in this process, or with CINDER_USER_STORE set, written
+# through to sharded SQLite files that every worker on the host shares
+USER_STORE_CONFIG = {
+    "max_users": _optional_int("CINDER_MAX_CACHED_USERS") or 100000,
+    "max_idle": _optional_int("CINDER_USER_IDLE_SECONDS"),
+}
+
+def make_user_store():
+    directory = os.environ.get("CINDER_USER_STORE")
+    if not directory:
+        return MemoryUserStore(**USER_STORE_CONFIG)
+    return SQLiteUserStore(
+        directory,
+        shards=_optional_int("CINDER_USER_SHARDS") or 8,
+        **USER_STORE_CONFIG,
+    )
+
 # Initialize the recommendation engine
 try:
-    rec_engine = RecommendationEngine(
-        faiss_index_path='image_vectors.index',
-        product_metadata_path='processed_data.json'
-    )
+    rec_engine = RecommendationEngine(**ENGINE_CONFIG, user_store=make_user_store())
 except Exception as e:
     print(f"Error initializing recommendation engine: {e}")
     rec_engine = None
 
-app = FastAPI()
+# FAISS and NumPy calls block, so they run on their own bounded pool rather
+# than on the event loop; past threads + queue in flight, requests get a 503
+engine_executor = EngineExecutor(
+    threads=_optional_int("CINDER_ENGINE_THREADS") or os.cpu_count() or 4,
+    max_queue=_optional_int("CINDER_ENGINE_MAX_QUEUE") or 64,
+)
+
+async def _run_batch(queries):
+    return await engine_executor.run(rec_engine.get_recommendations_json, queries)
+
+# single-user requests arriving within a couple of milliseconds are answered
+# by one batched search; CINDER_COALESCE_MAX_BATCH=1 turns this off
+coalescer = RequestCoalescer(
+    _run_batch,
+    max_batch_size=_optional_int("CINDER_COALESCE_MAX_BATCH") or 64,
+    max_wait=float(os.environ.get("CINDER_COALESCE_WINDOW_MS", "2")) / 1000,
+    fail_together=(EngineSaturated,),
+)
+
+def _busy():
+    return HTTPException(
+        status_code=503,
+        detail="Recommendation engine is busy, try again shortly",
+        headers={"Retry-After": "1"},
+    )
+
+# Hot reload: POST /admin/reload (with X-Admin-Token) or, with
+# CINDER_RELOAD_POLL set, a change to the index or metadata files loads the new
+# version in the background, validates it and swaps it in. Requests already
+# running finish on the engine they started with; user state carries over.
+ADMIN_TOKEN = os.environ.get("CINDER_ADMIN_TOKEN")
+RELOAD_POLL_SECONDS = _optional_int("CINDER_RELOAD_POLL")
+
+reload_state = {
+    "status": "idle",
+    "catalog_id": rec_engine.catalog_id if rec_engine is not None else None,
+    "error": None,
+    "started_at": None,
+    "finished_at": None,
+}
+
+# the event loop only keeps weak references to tasks, so a running reload is
+# held here until it finishes
+reload_tasks = set()
+
+def _load_engine(config):
+    previous = rec_engine
+    user_store = previous.user_trackers if previous is not None else make_user_store()
+    engine = RecommendationEngine(**config, user_store=user_store)
+    try:
+        engine.validate()
+        if previous is not None:
+            engine.adopt(previous)
+    except Exception:
+        engine.close()
+        raise
+    return engine
+
+async def reload_engine(overrides=None):
+    global rec_engine
+
+    config = {**ENGINE_CONFIG, **(overrides or {})}
+    reload_state.update(status="loading", error=None, started_at=time.time(), finished_at=None)
+    try:
+        # the default executor, so loading never takes a search thread
+        engine = await asyncio.get_running_loop().run_in_executor(None, _load_engine, config)
+    except Exception as e:
+        reload_state.update(status="failed", error=str(e), finished_at=time.time())
+        return
+
+    previous, rec_engine = rec_engine, engine
+    ENGINE_CONFIG.update(config)
+    if previous is not None:
+        previous.close()
+    reload_state.update(status="ready", catalog_id=engine.catalog_id, finished_at=time.time())
+
+def _source_mtime(path):
+    if not path or not os.path.exists(path):
+        return None
+    if os.path.isdir(path):
+        # a product store directory is rewritten file by file, each through a
+        # hidden temporary that is renamed into place
+        return max(
+            (
+                entry.stat().st_mtime
+                for entry in os.scandir(path)
+                if not entry.name.startswith(".")
+            ),
+            default=None,
+        )
+    return os.stat(path).st_mtime
+
+def _source_mtimes():
+    keys = ("faiss_index_path", "product_metadata_path", "embeddings_path")
+    return tuple(_source_mtime(ENGINE_CONFIG[key]) for key in keys)
+
+async def watch_sources(interval):
+    loaded = _source_mtimes()
+    previous = loaded
+    while True:
+        await asyncio.sleep(interval)
+        current = _source_mtimes()
+        # only reload once the files have stopped changing for a whole poll,
+        # so a copy in progress is never picked up half-written
+        if current != loaded and current == previous and reload_state["status"] != "loading":
+            await reload_engine()
+            loaded = current
+        previous = current
+
+class FastJSONResponse(JSONResponse):
+    """
+    orjson instead of the stdlib encoder; NumPy scalars pass straight through
+    """
+
+    def render(self, content):
+        return orjson.dumps(content, option=orjson.OPT_SERIALIZE_NUMPY)
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    watcher = None
+    if RELOAD_POLL_SECONDS:
+        watcher = asyncio.create_task(watch_sources(RELOAD_POLL_SECONDS))
+    yield
+    if watcher is not None:
+        watcher.cancel()
+
+app = FastAPI(lifespan=lifespan, default_response_class=FastJSONResponse)
 
 # Add CORS middleware
 app.add_middleware(
@@ -26,11 +200,34 @@ app.add_middleware(
     allow_headers=["*"],  # Allows all headers
 )
 
+MAX_RECOMMENDATIONS = _optional_int("CINDER_MAX_RECOMMENDATIONS") or 200
+
+# what the frontend reads; send "fields": null for whole product records
+DEFAULT_FIELDS = ["id", "image_href", "affiliate_href", "title", "price", "similarity_score"]
+
 class RecommendationRequest(BaseModel):
     user_id: str
     colors: Optional[List[str]] = None
     categories: Optional[List[str]] = None
-    num_recommendations: int = 10
+    num_recommendations: int = Field(10, gt=0, le=MAX_RECOMMENDATIONS)
+    fields: Optional[List[str]] = DEFAULT_FIELDS
+
+    def as_query(self):
+        return {
+            "user_id": self.user_id,
+            "num_recommendations": self.num_recommendations,
+            "color_filter": self.colors,
+            "category_filter": self.categories,
+            "fields": self.fields,
+        }
+
+class BatchRecommendationRequest(BaseModel):
+    requests: List[RecommendationRequest]
+
+class ReloadRequest(BaseModel):
+    index_path: Optional[str] = None
+    metadata_path: Optional[str] = None
+    embeddings_path: Optional[str] = None
 
 class UserInteractionRequest(BaseModel):
     user_id: str
@@ -46,29 +243,44 @@ async def get_recommendations(request: RecommendationRequest):
         raise HTTPException(status_code=500, detail="Recommendation engine not initialized")
 
     try:
-        # Check if user is being tracked
-        user_tracker = rec_engine.user_trackers.get(request.user_id)
-
-        if user_tracker and user_tracker.compute_preference_vector() is not None:
-            # User has interactions, get personalized recommendations
-            recommendations = rec_engine.get_recommendations(
-                request.user_id,
-                num_recommendations=request.num_recommendations,
-                color_filter=request.colors,
-                category_filter=request.categories
-            )
-        else:
-            # No user interactions, get diverse recommendations
-            recommendations = rec_engine.get_recommendations(
-                request.user_id,
-                num_recommendations=request.num_recommendations,
-                color_filter=request.colors,
-                category_filter=request.categories
-            )
+        # the engine hands back the serialized array, it only needs wrapping
+        recommendations = await coalescer.submit(request.as_query())
 
-        return {
-            "recommendations": recommendations
-        }
+        return Response(
+            content=b'{"recommendations":' + recommendations + b"}",
+            media_type="application/json",
+        )
+    except EngineSaturated:
+        raise _busy()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/get-recommendations/batch")
+async def get_recommendations_batch(request: BatchRecommendationRequest):
+    """
+    Get recommendations for many users, with one index search per filter set
+    """
+    if rec_engine is None:
+        raise HTTPException(status_code=500, detail="Recommendation engine not initialized")
+
+    try:
+        results = await engine_executor.run(
+            rec_engine.get_recommendations_json,
+            [item.as_query() for item in request.requests],
+        )
+
+        return Response(
+            content=b'{"results":['
+            + b",".join(
+                b'{"user_id":' + orjson.dumps(item.user_id)
+                + b',"recommendations":' + recommendations + b"}"
+                for item, recommendations in zip(request.requests, results)
+            )
+            + b"]}",
+            media_type="application/json",
+        )
+    except EngineSaturated:
+        raise _busy()
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -82,16 +294,69 @@ async def record_user_interaction(request: UserInteractionRequest):
     try:
 
         # Record user interaction
-        rec_engine.record_user_interaction(
-            request.user_id, 
+        await engine_executor.run(
+            rec_engine.record_user_interaction,
+            request.user_id,
             request.product_id,
             request.reaction
         )
 
         return {"status": "Interaction recorded successfully"}
+    except EngineSaturated:
+        raise _busy()
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/metrics")
+async def metrics():
+    """
+    Batching, thread pool and result cache counters for tuning
+    """
+    return {
+        "coalescer": coalescer.stats(),
+        "engine_executor": engine_executor.stats(),
+        "result_cache": (
+            rec_engine.result_cache.stats()
+            if rec_engine is not None and rec_engine.result_cache is not None
+            else None
+        ),
+    }
+
+def _check_admin(token):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled")
+    if token is None or not secrets.compare_digest(token, ADMIN_TOKEN):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+@app.post("/admin/reload", status_code=202)
+async def reload(request: ReloadRequest, x_admin_token: Optional[str] = Header(None)):
+    """
+    Load a new index/metadata version in the background and swap it in
+    """
+    _check_admin(x_admin_token)
+    if reload_state["status"] == "loading":
+        raise HTTPException(status_code=409, detail="A reload is already in progress")
+
+    overrides = {
+        key: value
+        for key, value in (
+            ("faiss_index_path", request.index_path),
+            ("product_metadata_path", request.metadata_path),
+            ("embeddings_path", request.embeddings_path),
+        )
+        if value is not None
+    }
+    reload_state["status"] = "loading"
+    task = asyncio.create_task(reload_engine(overrides))
+    reload_tasks.add(task)
+    task.add_done_callback(reload_tasks.discard)
+    return reload_state
+
+@app.get("/admin/reload")
+async def reload_status(x_admin_token: Optional[str] = Header(None)):
+    _check_admin(x_admin_token)
+    return reload_state
+
 # For local testing
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,67 @@
+import json
+import os
+import time
+
+import faiss
+import numpy as np
+
+COLORS = ["black", "white", "navy blue", "green", "red", "beige", "pink", "maroon"]
+CATEGORIES = ["Below the Knee", "Above the Knee", "Maxi", "Midi", "Mini"]
+
+
+def make_synthetic_catalog(
+    out_dir, num_products, dimension=384, seed=0, variant_spread=None
+):
+    """
+    Write a random index + processed_data.json pair shaped like the real ones
+    and return their paths
+
+    With `variant_spread`, the three color variants sharing a title get
+    near-duplicate embeddings (a shared base plus noise of that scale), as
+    real variant photos do.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+
+    embeddings = rng.standard_normal((num_products, dimension), dtype=np.float32)
+    if variant_spread is not None:
+        bases = rng.standard_normal((num_products // 3 + 1, dimension), dtype=np.float32)
+        embeddings = bases[np.arange(num_products) // 3] + variant_spread * embeddings
+    index = faiss.IndexFlatL2(dimension)
+    index.add(embeddings)
+    index_path = os.path.join(out_dir, "image_vectors.index")
+    faiss.write_index(index, index_path)
+
+    metadata = {}
+    for i in range(num_products):
+        metadata[i + 1] = {
+            "id": f"product_{i + 1}",
+            "affiliate_href": f"https://amzn.to/{i + 1:07d}",
+            "category": CATEGORIES[rng.integers(len(CATEGORIES))],
+            "title": f"Synthetic dress {i // 3}",
+            "price": int(rng.integers(300, 3000)),
+            "product_information": [{"Material": "Cotton"}, {"Fit": "Regular"}],
+            "about_item": ["Machine wash", "Regular fit", "Made in India"],
+            "color": COLORS[rng.integers(len(COLORS))],
+            "image_href": f"https://m.media-amazon.com/images/I/{i + 1}.jpg",
+            "image_alt": f"Synthetic dress {i // 3}",
+        }
+    metadata_path = os.path.join(out_dir, "processed_data.json")
+    with open(metadata_path, "w") as f:
+        json.dump(metadata, f)
+
+    return index_path, metadata_path
+
+
+def percentiles_ms(samples):
+    samples = np.asarray(samples) * 1000
+    return float(np.percentile(samples, 50)), float(np.percentile(samples, 99))
+
+
+def time_calls(fn, repeats):
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
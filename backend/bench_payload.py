@@ -0,0 +1,76 @@
+"""
+Response size and serialization cost per request
+
+    python bench_payload.py --products 100000 --num-recommendations 20
+
+Compares what /get-recommendations used to send (every product field through
+FastAPI's default encoder) with the projected fields the frontend reads,
+serialized by the stdlib, by orjson, and joined from the engine's cached
+per-product fragments. Times cover the engine call plus serialization.
+"""
+
+import argparse
+import json
+import tempfile
+
+import orjson
+from fastapi.encoders import jsonable_encoder
+
+from bench_common import make_synthetic_catalog, percentiles_ms, time_calls
+from recommendation_engine import RecommendationEngine
+
+# api.DEFAULT_FIELDS; importing api would load the served catalog
+DEFAULT_FIELDS = ["id", "image_href", "affiliate_href", "title", "price", "similarity_score"]
+
+
+def run(num_products, num_recommendations, repeats):
+    with tempfile.TemporaryDirectory() as tmp:
+        index_path, metadata_path = make_synthetic_catalog(tmp, num_products)
+        engine = RecommendationEngine(index_path, metadata_path, cold_start=False)
+        for i in range(1, 6):
+            engine.record_user_interaction("bench", f"product_{i * 7}", "like")
+
+        def query(fields):
+            return {
+                "user_id": "bench",
+                "num_recommendations": num_recommendations,
+                "fields": fields,
+            }
+
+        def stdlib(fields):
+            items = engine.get_recommendations_batch([query(fields)])[0]
+            return json.dumps(
+                jsonable_encoder({"recommendations": items}), separators=(",", ":")
+            ).encode("utf-8")
+
+        def with_orjson(fields):
+            items = engine.get_recommendations_batch([query(fields)])[0]
+            return orjson.dumps({"recommendations": items})
+
+        def fragments(fields):
+            payload = engine.get_recommendations_json([query(fields)])[0]
+            return b'{"recommendations":' + payload + b"}"
+
+        variants = [
+            ("full, stdlib", stdlib, None),
+            ("projected, stdlib", stdlib, DEFAULT_FIELDS),
+            ("projected, orjson", with_orjson, DEFAULT_FIELDS),
+            ("projected, fragments", fragments, DEFAULT_FIELDS),
+        ]
+
+        print(f"{num_products} products, {num_recommendations} results")
+        print(f"{'payload':<22} {'bytes':>7} {'p50 ms':>8} {'p99 ms':>8}")
+        for name, serialize, fields in variants:
+            size = len(serialize(fields))
+            p50, p99 = percentiles_ms(time_calls(lambda: serialize(fields), repeats))
+            print(f"{name:<22} {size:>7} {p50:>8.2f} {p99:>8.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--products", type=int, default=100000)
+    parser.add_argument("--num-recommendations", type=int, default=20)
+    parser.add_argument("--repeats", type=int, default=200)
+    args = parser.parse_args()
+
+    run(args.products, args.num_recommendations, args.repeats)
@@ -0,0 +1,82 @@
+"""
+Latency and diversity of the re-ranking stage
+
+    python bench_rerank.py --products 100000 --lambdas 1.0 0.7 0.5 --max-per-title 1
+
+Same-title variants get near-duplicate embeddings here, as they do in the
+scraped catalog, so the plain nearest-neighbour feed is full of them. For each
+setting the table shows search latency, the mean pairwise cosine similarity
+inside a feed (lower is more varied) and how many results repeat a title
+already in the feed.
+"""
+
+import argparse
+import tempfile
+
+from bench_common import make_synthetic_catalog, percentiles_ms, time_calls
+from recommendation_engine import RecommendationEngine
+from rerank import normalize_rows
+
+
+def feed_diversity(engine, recommendations):
+    rows = engine.products.rows_of([item["id"] for item in recommendations])
+    vectors, _ = engine._vectors(engine.label_of_row[rows])
+    vectors = normalize_rows(vectors)
+    similarity = vectors @ vectors.T
+    count = len(vectors)
+    mean_similarity = (similarity.sum() - count) / max(count * (count - 1), 1)
+    titles = [item["title"] for item in recommendations]
+    return float(mean_similarity), len(titles) - len(set(titles))
+
+
+def run(num_products, lambdas, max_per_title, num_recommendations, repeats):
+    with tempfile.TemporaryDirectory() as tmp:
+        index_path, metadata_path = make_synthetic_catalog(
+            tmp, num_products, variant_spread=0.3
+        )
+        engine = RecommendationEngine(index_path, metadata_path, cold_start=False)
+
+        for i in range(1, 6):
+            engine.record_user_interaction("bench", f"product_{i * 7}", "like")
+
+        settings = [(None, None)] + [(value, max_per_title) for value in lambdas]
+
+        print(f"{num_products} products, {num_recommendations} results")
+        print(
+            f"{'lambda':>7} {'per title':>9} {'p50 ms':>8} {'p99 ms':>8} "
+            f"{'mean cos':>9} {'dup titles':>10}"
+        )
+        for diversity_lambda, cap in settings:
+            engine.diversity_lambda = diversity_lambda
+            engine.max_per_title = cap
+
+            def call():
+                return engine.get_recommendations(
+                    "bench", num_recommendations=num_recommendations
+                )
+
+            p50, p99 = percentiles_ms(time_calls(call, repeats))
+            similarity, duplicates = feed_diversity(engine, call())
+            label = "off" if diversity_lambda is None else f"{diversity_lambda:.2f}"
+            print(
+                f"{label:>7} {str(cap or '-'):>9} {p50:>8.2f} {p99:>8.2f} "
+                f"{similarity:>9.3f} {duplicates:>10}"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--products", type=int, default=100000)
+    parser.add_argument("--lambdas", type=float, nargs="+", default=[1.0, 0.7, 0.5])
+    parser.add_argument("--max-per-title", type=int, default=None)
+    parser.add_argument("--num-recommendations", type=int, default=20)
+    parser.add_argument("--repeats", type=int, default=100)
+    args = parser.parse_args()
+
+    run(
+        args.products,
+        args.lambdas,
+        args.max_per_title,
+        args.num_recommendations,
+        args.repeats,
+    )
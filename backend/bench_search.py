@@ -0,0 +1,52 @@
+"""
+Latency of get_recommendations against catalog size, bounded vs exhaustive search
+
+    python bench_search.py --sizes 1000 10000 100000 --repeats 200
+"""
+
+import argparse
+import tempfile
+
+from bench_common import make_synthetic_catalog, percentiles_ms, time_calls
+from recommendation_engine import RecommendationEngine
+
+SCENARIOS = {
+    "no filters": {},
+    "color": {"color_filter": ["navy blue"]},
+    "color+category": {"color_filter": ["green"], "category_filter": ["Maxi"]},
+}
+
+
+def run(sizes, repeats, num_recommendations):
+    print(f"{'products':>10} {'scenario':>16} {'mode':>11} {'p50 ms':>9} {'p99 ms':>9}")
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            index_path, metadata_path = make_synthetic_catalog(tmp, size)
+            engine = RecommendationEngine(index_path, metadata_path)
+
+            for i in range(1, 6):
+                engine.record_user_interaction("bench", f"product_{i}", "like")
+            engine.record_user_interaction("bench", "product_6", "dislike")
+
+            for name, filters in SCENARIOS.items():
+                for bounded in (True, False):
+                    engine.bounded_search = bounded
+                    samples = time_calls(
+                        lambda: engine.get_recommendations(
+                            "bench", num_recommendations=num_recommendations, **filters
+                        ),
+                        repeats,
+                    )
+                    p50, p99 = percentiles_ms(samples)
+                    mode = "bounded" if bounded else "exhaustive"
+                    print(f"{size:>10} {name:>16} {mode:>11} {p50:>9.2f} {p99:>9.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--repeats", type=int, default=100)
+    parser.add_argument("--num-recommendations", type=int, default=10)
+    args = parser.parse_args()
+
+    run(args.sizes, args.repeats, args.num_recommendations)
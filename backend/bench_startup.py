@@ -0,0 +1,104 @@
+"""
+Engine startup time and memory for N worker processes, private vs mmap loading
+
+    python bench_startup.py --products 200000 --workers 1 8
+
+Each worker builds a RecommendationEngine from the same index and saved
+product store, runs one full search so the index pages are actually touched,
+then idles while RSS and PSS are read from /proc. PSS splits shared pages
+between the processes mapping them, so its total is the real footprint.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
+
+from bench_common import make_synthetic_catalog
+from product_store import ProductStore
+
+WORKER = """
+import sys, time
+sys.path.insert(0, {here!r})
+import numpy as np
+from recommendation_engine import RecommendationEngine
+
+start = time.perf_counter()
+engine = RecommendationEngine({index!r}, {store!r}, mmap={mmap!r}, cold_start=False)
+ready = time.perf_counter() - start
+engine.index.search(np.zeros((1, engine.index.d), dtype="float32"), 10)
+print(ready, flush=True)
+sys.stdin.read()
+"""
+
+
+def memory_kib(pid):
+    usage = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            name, _, rest = line.partition(":")
+            if name in ("Rss", "Pss"):
+                usage[name] = int(rest.split()[0])
+    return usage
+
+
+def run_workers(count, index_path, store_path, mmap):
+    here = os.path.dirname(os.path.abspath(__file__))
+    code = WORKER.format(here=here, index=index_path, store=store_path, mmap=mmap)
+
+    workers = [
+        subprocess.Popen(
+            [sys.executable, "-c", code],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+        )
+        for _ in range(count)
+    ]
+    try:
+        ready = [float(worker.stdout.readline()) for worker in workers]
+        usage = [memory_kib(worker.pid) for worker in workers]
+    finally:
+        for worker in workers:
+            worker.stdin.close()
+            worker.wait()
+
+    rss = sum(u["Rss"] for u in usage) / 1024
+    pss = sum(u["Pss"] for u in usage) / 1024
+    return np.median(ready) * 1000, max(ready) * 1000, rss, pss
+
+
+def run(num_products, worker_counts):
+    with tempfile.TemporaryDirectory() as tmp:
+        index_path, metadata_path = make_synthetic_catalog(tmp, num_products)
+        store_path = os.path.join(tmp, "products")
+        ProductStore.from_json(metadata_path).save(store_path)
+
+        # warm the page cache so neither mode pays for the first disk read
+        run_workers(1, index_path, store_path, mmap=False)
+
+        print(f"{num_products} products")
+        print(
+            f"{'workers':>7} {'mode':>7} {'ready p50 ms':>13} {'ready max ms':>13} "
+            f"{'sum RSS MiB':>12} {'sum PSS MiB':>12}"
+        )
+        for count in worker_counts:
+            for mmap in (False, True):
+                p50, worst, rss, pss = run_workers(count, index_path, store_path, mmap)
+                mode = "mmap" if mmap else "private"
+                print(
+                    f"{count:>7} {mode:>7} {p50:>13.1f} {worst:>13.1f} "
+                    f"{rss:>12.1f} {pss:>12.1f}"
+                )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--products", type=int, default=200000)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 8])
+    args = parser.parse_args()
+
+    run(args.products, args.workers)
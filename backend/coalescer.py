@@ -0,0 +1,115 @@
+import asyncio
+import collections
+import time
+
+import numpy as np
+
+
+class RequestCoalescer:
+    """
+    Gathers recommendation queries that arrive within `max_wait` seconds of
+    each other (or until `max_batch_size` are waiting) and answers them with a
+    single `run_batch(queries)` call, so concurrent users share one FAISS
+    search per filter set instead of issuing one each.
+
+    `run_batch` is a coroutine function taking the list of queries and
+    returning one result per query. When it raises for a batch, each query is
+    run again on its own so one bad query only fails its own caller;
+    exceptions of the `fail_together` types (backpressure, say) go straight
+    to every caller of the batch instead.
+    """
+
+    def __init__(
+        self,
+        run_batch,
+        max_batch_size=64,
+        max_wait=0.002,
+        window=1024,
+        fail_together=(),
+    ):
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.fail_together = tuple(fail_together)
+
+        self._pending = []
+        self._flush_handle = None
+        # the event loop only keeps weak references to tasks
+        self._dispatches = set()
+
+        # recent samples for percentiles, running totals for rates
+        self.batch_sizes = collections.deque(maxlen=window)
+        self.queue_delays = collections.deque(maxlen=window)
+        self.batches = 0
+        self.requests = 0
+
+    async def submit(self, query):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((query, future, time.perf_counter()))
+
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.max_wait, self._flush)
+
+        return await future
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+
+        now = time.perf_counter()
+        self.batches += 1
+        self.requests += len(batch)
+        self.batch_sizes.append(len(batch))
+        self.queue_delays.extend(now - queued_at for _, _, queued_at in batch)
+
+        task = asyncio.ensure_future(self._dispatch(batch))
+        self._dispatches.add(task)
+        task.add_done_callback(self._dispatches.discard)
+
+    async def _dispatch(self, batch):
+        queries = [query for query, _, _ in batch]
+        try:
+            results = await self.run_batch(queries)
+        except Exception as e:
+            if len(batch) == 1 or isinstance(e, self.fail_together):
+                results = [e] * len(batch)
+            else:
+                results = await asyncio.gather(
+                    *(self._run_alone(query) for query in queries),
+                    return_exceptions=True,
+                )
+
+        for (_, future, _), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    async def _run_alone(self, query):
+        return (await self.run_batch([query]))[0]
+
+    def stats(self):
+        sizes = np.asarray(self.batch_sizes or [0])
+        delays = np.asarray(self.queue_delays or [0.0]) * 1000
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            "batches": self.batches,
+            "requests": self.requests,
+            "pending": len(self._pending),
+            "batch_size_mean": float(sizes.mean()),
+            "batch_size_p50": float(np.percentile(sizes, 50)),
+            "batch_size_p99": float(np.percentile(sizes, 99)),
+            "queue_delay_ms_p50": float(np.percentile(delays, 50)),
+            "queue_delay_ms_p99": float(np.percentile(delays, 99)),
+        }
@@ -0,0 +1,180 @@
+"""
+Precomputed picks for users without interactions
+
+Products are clustered once with k-means over their embeddings. For every
+facet cell (no filter, each color, each category, each color/category pair)
+a pool of `pool_size` labels is laid out round-robin across clusters, most
+popular first within each cluster. Any run of consecutive pool entries then
+spans different clusters, so serving is a random offset plus a k-long slice.
+
+Pools are re-ranked from the live popularity counts in a background thread,
+after `load_popularity` (if given) brings them up to date; filter
+combinations outside the precomputed cells are built on first use and cached
+until the next refresh.
+"""
+
+import threading
+
+import faiss
+import numpy as np
+
+
+class ColdStartPool:
+    def __init__(
+        self,
+        facets,
+        labels,
+        vectors_of,
+        popularity,
+        num_clusters=None,
+        pool_size=256,
+        max_cached_filters=256,
+        seed=0,
+        load_popularity=None,
+    ):
+        # facets: FacetIndex over labels; labels: every product's label;
+        # vectors_of(labels) -> (vectors, labels that had one); popularity:
+        # label-space counts, updated in place by the engine
+        self.facets = facets
+        self.labels = np.asarray(labels, dtype=np.int64)
+        self.vectors_of = vectors_of
+        self.popularity = popularity
+        self.load_popularity = load_popularity
+        self.num_clusters = num_clusters or min(64, max(1, int(len(labels) ** 0.5)))
+        self.pool_size = pool_size
+        self.max_cached_filters = max_cached_filters
+
+        self.rng = np.random.default_rng(seed)
+        self.seed = seed
+        self.assignments = None
+        self._pools = None
+        self._cached = {}
+        self._cache_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def ready(self):
+        return self._pools is not None
+
+    def cluster(self, chunk_size=8192):
+        """
+        K-means over (a sample of) the embeddings, then one cluster id per
+        label; -1 for labels without a vector
+        """
+        sample = self.rng.choice(
+            self.labels,
+            min(len(self.labels), self.num_clusters * 256),
+            replace=False,
+        )
+        vectors, _ = self.vectors_of(np.sort(sample))
+        kmeans = faiss.Kmeans(
+            vectors.shape[1],
+            min(self.num_clusters, len(vectors)),
+            niter=20,
+            seed=self.seed,
+        )
+        kmeans.train(np.ascontiguousarray(vectors, dtype=np.float32))
+
+        assignments = np.full(len(self.popularity), -1, dtype=np.int32)
+        for start in range(0, len(self.labels), chunk_size):
+            vectors, found = self.vectors_of(self.labels[start : start + chunk_size])
+            if len(found):
+                _, nearest = kmeans.index.search(
+                    np.ascontiguousarray(vectors, dtype=np.float32), 1
+                )
+                assignments[found] = nearest[:, 0]
+        self.assignments = assignments
+
+    def _rank(self, labels, score, cluster_order):
+        """
+        Up to pool_size of `labels`, round-robin over clusters, best score
+        first inside each cluster
+        """
+        clusters = self.assignments[labels]
+        order = np.lexsort((-score[labels], clusters))
+        labels, clusters = labels[order], clusters[order]
+
+        starts = np.flatnonzero(np.r_[True, clusters[1:] != clusters[:-1]])
+        rank = np.arange(len(labels)) - np.repeat(
+            starts, np.diff(np.r_[starts, len(labels)])
+        )
+        rounds = np.lexsort((cluster_order[clusters + 1], rank))
+        return labels[rounds[: self.pool_size]]
+
+    def refresh(self):
+        if self.load_popularity is not None:
+            self.load_popularity()
+        # counts dominate, the jitter only breaks ties so a fresh catalog
+        # with no interactions still gets varied pools
+        score = self.popularity.astype(np.float64) + self.rng.random(
+            len(self.popularity)
+        )
+        cluster_order = self.rng.permutation(self.num_clusters + 1)
+
+        in_catalog = np.zeros(len(self.popularity), dtype=bool)
+        in_catalog[self.labels] = True
+
+        def cell(mask):
+            return self._rank(np.flatnonzero(mask & in_catalog), score, cluster_order)
+
+        pools = {self.facets.key(None, None): cell(in_catalog)}
+        for color, color_mask in self.facets.color_masks.items():
+            pools[self.facets.key([color], None)] = cell(color_mask)
+        for category, category_mask in self.facets.category_masks.items():
+            pools[self.facets.key(None, [category])] = cell(category_mask)
+            for color, color_mask in self.facets.color_masks.items():
+                pools[self.facets.key([color], [category])] = cell(
+                    color_mask & category_mask
+                )
+
+        with self._cache_lock:
+            self._score = score
+            self._cluster_order = cluster_order
+            self._in_catalog = in_catalog
+            self._cached = {}
+        self._pools = pools
+
+    def pool(self, color_filter=None, category_filter=None):
+        key = self.facets.key(color_filter, category_filter)
+        pool = self._pools.get(key)
+        if pool is not None:
+            return pool
+
+        with self._cache_lock:
+            pool = self._cached.get(key)
+            if pool is None:
+                mask = self.facets.mask(color_filter, category_filter)
+                pool = self._rank(
+                    np.flatnonzero(mask & self._in_catalog),
+                    self._score,
+                    self._cluster_order,
+                )
+                if len(self._cached) >= self.max_cached_filters:
+                    self._cached.pop(next(iter(self._cached)))
+                self._cached[key] = pool
+        return pool
+
+    def sample(self, num, color_filter=None, category_filter=None):
+        """
+        `num` labels (fewer only if the filter matches fewer products) from a
+        random offset into the pool
+        """
+        pool = self.pool(color_filter, category_filter)
+        if len(pool) == 0:
+            return pool
+        offset = int(self.rng.integers(len(pool)))
+        return np.take(pool, np.arange(offset, offset + min(num, len(pool))), mode="wrap")
+
+    def start(self, refresh_interval=300.0):
+        def run():
+            self.cluster()
+            self.refresh()
+            while not self._stop.wait(refresh_interval):
+                self.refresh()
+
+        self._thread = threading.Thread(target=run, name="cold-start", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
@@ -0,0 +1,53 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+
+class EngineSaturated(Exception):
+    pass
+
+
+class EngineExecutor:
+    """
+    Runs blocking engine calls on a dedicated, bounded thread pool so the
+    event loop stays free; FAISS and NumPy release the GIL while they work.
+    Once `threads + max_queue` calls are in flight new ones are refused with
+    EngineSaturated instead of queueing without bound.
+    """
+
+    def __init__(self, threads, max_queue):
+        self.threads = threads
+        self.max_queue = max_queue
+        self.in_flight = 0
+        self.rejected = 0
+        self._executor = ThreadPoolExecutor(threads, thread_name_prefix="engine")
+
+    @property
+    def capacity(self):
+        return self.threads + self.max_queue
+
+    async def run(self, fn, *args, **kwargs):
+        # only touched from the event loop thread, so a plain counter is safe
+        if self.in_flight >= self.capacity:
+            self.rejected += 1
+            raise EngineSaturated()
+
+        self.in_flight += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self._executor, functools.partial(fn, *args, **kwargs)
+            )
+        finally:
+            self.in_flight -= 1
+
+    def stats(self):
+        return {
+            "threads": self.threads,
+            "max_queue": self.max_queue,
+            "in_flight": self.in_flight,
+            "rejected": self.rejected,
+        }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
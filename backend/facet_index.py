@@ -0,0 +1,91 @@
+import threading
+
+import faiss
+import numpy as np
+
+
+def normalize_facet(value):
+    return (value or "").strip().lower()
+
+
+class FacetIndex:
+    """
+    Boolean masks per normalized color and category, built once so a filter
+    becomes an OR of masks inside a facet and an AND across facets
+
+    Each facet is given as (vocabulary, codes): one code per position, -1
+    for positions without a value.
+    """
+
+    def __init__(self, colors, categories, max_cached_filters=256):
+        self.size = len(colors[1])
+        self.color_masks = self._build_masks(*colors)
+        self.category_masks = self._build_masks(*categories)
+
+        self.max_cached_filters = max_cached_filters
+        self._cache = {}
+        self._cache_lock = threading.Lock()
+
+    def _build_masks(self, vocabulary, codes):
+        masks = {}
+        for code, value in enumerate(vocabulary):
+            value = normalize_facet(value)
+            if value in masks:
+                masks[value] |= codes == code
+            else:
+                masks[value] = codes == code
+        return masks
+
+    def _union(self, masks, values):
+        mask = np.zeros(self.size, dtype=bool)
+        for value in values:
+            facet_mask = masks.get(value)
+            if facet_mask is not None:
+                mask |= facet_mask
+        return mask
+
+    def key(self, color_filter, category_filter):
+        colors = frozenset(map(normalize_facet, color_filter or ()))
+        categories = frozenset(map(normalize_facet, category_filter or ()))
+        return colors, categories
+
+    def lookup(self, color_filter=None, category_filter=None):
+        """
+        Return (mask, IDSelector) for the filters, or (None, None) when
+        nothing is filtered
+        """
+        key = self.key(color_filter, category_filter)
+        if not key[0] and not key[1]:
+            return None, None
+
+        cached = self._cache.get(key)
+        if cached is not None:
+            return cached
+
+        colors, categories = key
+        mask = np.ones(self.size, dtype=bool)
+        if colors:
+            mask &= self._union(self.color_masks, colors)
+        if categories:
+            mask &= self._union(self.category_masks, categories)
+
+        entry = (mask, self.selector(mask))
+        with self._cache_lock:
+            if len(self._cache) >= self.max_cached_filters:
+                self._cache.pop(next(iter(self._cache)))
+            self._cache[key] = entry
+        return entry
+
+    def mask(self, color_filter=None, category_filter=None):
+        return self.lookup(color_filter, category_filter)[0]
+
+    @staticmethod
+    def selector(mask):
+        # FAISS only sees a raw pointer to the bitmap, so keep it referenced
+        # from the selector for as long as that lives. Its size is in bytes:
+        # ids past the bitmap (vectors without metadata) are then rejected
+        # instead of read from whatever memory follows it
+        bitmap = np.packbits(mask, bitorder="little")
+        selector = faiss.IDSelectorBitmap(len(bitmap), faiss.swig_ptr(bitmap))
+        selector.referenced_objects = [bitmap]
+        return selector
@@ -0,0 +1,110 @@
+"""
+Closed-loop load test against a running API
+
+    uvicorn api:app --port 8000
+    python load_test.py --url http://localhost:8000 --concurrency 1 8 32 128
+
+Each client thread first swipes a few products so its user gets personalized
+recommendations, then asks for recommendations back to back for `--duration`
+seconds. Throughput, latency of successful calls and the share of 503s
+(engine pool saturated) are reported per concurrency level.
+"""
+
+import argparse
+import random
+import threading
+import time
+
+import numpy as np
+import requests
+
+from bench_common import CATEGORIES, COLORS, percentiles_ms
+
+
+def client(url, user_id, product_ids, duration, stats, lock):
+    session = requests.Session()
+    rng = random.Random(user_id)
+
+    for product_id in rng.sample(product_ids, min(5, len(product_ids))):
+        session.post(
+            f"{url}/record-interaction",
+            json={
+                "user_id": user_id,
+                "product_id": product_id,
+                "reaction": rng.choice(["like", "dislike"]),
+            },
+        )
+
+    latencies = []
+    statuses = {}
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        body = {"user_id": user_id, "num_recommendations": 10}
+        if rng.random() < 0.5:
+            body["colors"] = rng.sample(COLORS, 2)
+        if rng.random() < 0.5:
+            body["categories"] = [rng.choice(CATEGORIES)]
+
+        start = time.perf_counter()
+        response = session.post(f"{url}/get-recommendations", json=body)
+        elapsed = time.perf_counter() - start
+
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+        if response.status_code == 200:
+            latencies.append(elapsed)
+
+    with lock:
+        stats["latencies"].extend(latencies)
+        for status, count in statuses.items():
+            stats["statuses"][status] = stats["statuses"].get(status, 0) + count
+
+
+def run_level(url, concurrency, product_ids, duration):
+    stats = {"latencies": [], "statuses": {}}
+    lock = threading.Lock()
+    threads = [
+        threading.Thread(
+            target=client,
+            args=(url, f"load-{concurrency}-{i}", product_ids, duration, stats, lock),
+        )
+        for i in range(concurrency)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    total = sum(stats["statuses"].values())
+    ok = stats["statuses"].get(200, 0)
+    busy = stats["statuses"].get(503, 0)
+    p50, p99 = percentiles_ms(np.array(stats["latencies"] or [0.0]))
+    return ok / elapsed, p50, p99, busy / max(total, 1), total - ok - busy
+
+
+def run(url, concurrency_levels, duration, num_products):
+    # synthetic catalogs (bench_common) use product_<n> ids
+    product_ids = [f"product_{i}" for i in range(1, num_products + 1)]
+
+    print(
+        f"{'clients':>7} {'ok req/s':>9} {'p50 ms':>8} {'p99 ms':>8} "
+        f"{'503 %':>6} {'errors':>6}"
+    )
+    for concurrency in concurrency_levels:
+        rps, p50, p99, busy, errors = run_level(url, concurrency, product_ids, duration)
+        print(
+            f"{concurrency:>7} {rps:>9.1f} {p50:>8.2f} {p99:>8.2f} "
+            f"{busy * 100:>6.1f} {errors:>6}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32, 128])
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--products", type=int, default=1000)
+    args = parser.parse_args()
+
+    run(args.url, args.concurrency, args.duration, args.products)
@@ -0,0 +1,329 @@
+"""
+Columnar product metadata keyed by row
+
+Alongside the columns sits an int64 label per row: the running id the
+processed data is keyed by (or carries inline, in the JSONL catalog), which
+is also the FAISS label of indexes built with ids (model/reindex.py).
+
+Short ids are a fixed-width byte column (sortable, so id -> row lookups are a
+searchsorted), low-cardinality strings such as color and category are
+dictionary-encoded, other strings are UTF-8 blobs with Arrow-style offsets,
+prices are an int64 column and nested fields (about_item, product_information)
+are kept as JSON text that is only decoded for the rows actually returned.
+Every column, and the sorted id order, is a plain .npy file, so a saved store
+can be memory-mapped and shared between processes without rebuilding anything.
+
+    python product_store.py processed_data.jsonl products/
+"""
+
+import collections
+import json
+import os
+import sys
+import threading
+
+import numpy as np
+import orjson
+
+FIXED = "fixed"
+DICT = "dict"
+TEXT = "text"
+INT = "int"
+JSON = "json"
+
+PARTS = {
+    FIXED: ("values",),
+    DICT: ("codes", "vocabulary"),
+    TEXT: ("data", "offsets"),
+    INT: ("values",),
+    JSON: ("data", "offsets"),
+}
+
+MISSING_INT = -1
+
+
+def _infer_kind(name, values):
+    if name == "id":
+        return FIXED
+    present = [v for v in values if v is not None]
+    if all(isinstance(v, str) for v in present):
+        if len(set(present)) <= max(16, len(values) // 10):
+            return DICT
+        return TEXT
+    if all(isinstance(v, int) and not isinstance(v, bool) for v in present):
+        return INT
+    return JSON
+
+
+def _encode_text(values):
+    encoded = [(v or "").encode("utf-8") for v in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(v) for v in encoded], out=offsets[1:])
+    data = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+    return {"data": data, "offsets": offsets}
+
+
+def _encode_column(kind, values):
+    if kind == FIXED:
+        return {"values": np.array([(v or "").encode("utf-8") for v in values])}
+    if kind == DICT:
+        vocabulary, codes = np.unique(
+            [(v or "").encode("utf-8") for v in values], return_inverse=True
+        )
+        return {"codes": codes.astype(np.int32), "vocabulary": vocabulary}
+    if kind == INT:
+        return {
+            "values": np.array(
+                [MISSING_INT if v is None else v for v in values], dtype=np.int64
+            )
+        }
+    if kind == JSON:
+        return _encode_text([json.dumps(v, separators=(",", ":")) for v in values])
+    return _encode_text(values)
+
+
+class ProductStore:
+    def __init__(self, schema, arrays, labels=None, id_order=None, sorted_ids=None):
+        self.schema = dict(schema)
+        self.arrays = arrays
+
+        ids = arrays["id"]["values"]
+        self.ids = ids
+        if id_order is None:
+            id_order = np.argsort(ids, kind="stable")
+            sorted_ids = ids[id_order]
+        self._id_order = id_order
+        self._sorted_ids = sorted_ids
+
+        if labels is None:
+            labels = np.arange(len(ids), dtype=np.int64)
+        self.labels = labels
+
+    @classmethod
+    def from_records(cls, records, labels=None):
+        records = list(records)
+        names = []
+        for record in records:
+            names.extend(name for name in record if name not in names)
+
+        schema = []
+        arrays = {}
+        for name in names:
+            values = [record.get(name) for record in records]
+            kind = _infer_kind(name, values)
+            schema.append((name, kind))
+            arrays[name] = _encode_column(kind, values)
+
+        if labels is not None:
+            labels = np.asarray(labels, dtype=np.int64)
+        return cls(schema, arrays, labels)
+
+    @classmethod
+    def from_json(cls, path):
+        # processed_data.json is a dict keyed by running id
+        with open(path, "r") as f:
+            data = json.load(f)
+        return cls.from_records(data.values(), labels=[int(key) for key in data])
+
+    @classmethod
+    def from_jsonl(cls, path):
+        # scraper/process_data.py output: one record per line, label inline
+        records = []
+        labels = []
+        with open(path, "rb") as f:
+            for line in f:
+                if line.strip():
+                    record = orjson.loads(line)
+                    labels.append(record.pop("label"))
+                    records.append(record)
+        return cls.from_records(records, labels=labels)
+
+    @classmethod
+    def load(cls, directory, mmap_mode=None):
+        with open(os.path.join(directory, "schema.json"), "r") as f:
+            schema = [tuple(column) for column in json.load(f)]
+
+        def load(filename):
+            path = os.path.join(directory, filename)
+            if not os.path.exists(path):
+                return None
+            return np.load(path, mmap_mode=mmap_mode)
+
+        arrays = {
+            name: {part: load(f"{name}.{part}.npy") for part in PARTS[kind]}
+            for name, kind in schema
+        }
+        return cls(
+            schema,
+            arrays,
+            labels=load("labels.npy"),
+            id_order=load("id_order.npy"),
+            sorted_ids=load("id_sorted.npy"),
+        )
+
+    @classmethod
+    def open(cls, path, mmap_mode=None):
+        if os.path.isdir(path):
+            return cls.load(path, mmap_mode=mmap_mode)
+        if path.endswith(".jsonl"):
+            return cls.from_jsonl(path)
+        return cls.from_json(path)
+
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+
+        def save_array(filename, array):
+            # renamed into place: a running backend may have the old file
+            # mapped, and truncating it would crash that process with SIGBUS
+            path = os.path.join(directory, filename)
+            temporary = os.path.join(directory, f".{filename}.tmp.npy")
+            np.save(temporary, array)
+            os.replace(temporary, path)
+
+        for name, parts in self.arrays.items():
+            for part, array in parts.items():
+                save_array(f"{name}.{part}.npy", array)
+        save_array("labels.npy", self.labels)
+        save_array("id_order.npy", self._id_order)
+        save_array("id_sorted.npy", self._sorted_ids)
+
+        temporary = os.path.join(directory, ".schema.json.tmp")
+        with open(temporary, "w") as f:
+            json.dump(list(self.schema.items()), f)
+        os.replace(temporary, os.path.join(directory, "schema.json"))
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def fields(self):
+        return list(self.schema)
+
+    def rows_of(self, product_ids):
+        """
+        Map product ids to rows, -1 for ids that are not in the store
+        """
+        keys = np.array([product_id.encode("utf-8") for product_id in product_ids])
+        if not len(keys) or not len(self._sorted_ids):
+            return np.full(len(keys), -1, dtype=np.int64)
+
+        positions = np.searchsorted(self._sorted_ids, keys)
+        positions = np.minimum(positions, len(self._sorted_ids) - 1)
+        found = self._sorted_ids[positions] == keys
+        return np.where(found, self._id_order[positions], -1).astype(np.int64)
+
+    def row_of(self, product_id):
+        row = int(self.rows_of([product_id])[0])
+        return None if row < 0 else row
+
+    def product_id(self, row):
+        return self.ids[row].decode("utf-8")
+
+    def column(self, name, rows=None):
+        """
+        Decoded values of one column, for all rows or the given ones
+        """
+        if rows is None:
+            rows = np.arange(len(self))
+        return self._gather_column(name, np.asarray(rows, dtype=np.int64))
+
+    def codes(self, name):
+        """
+        (vocabulary, int codes per row) for a column, without decoding every
+        row when the column is dictionary-encoded
+        """
+        if self.schema[name] == DICT:
+            parts = self.arrays[name]
+            vocabulary = [value.decode("utf-8") for value in parts["vocabulary"]]
+            return vocabulary, np.asarray(parts["codes"])
+
+        vocabulary, codes = np.unique(self.column(name), return_inverse=True)
+        return list(vocabulary), codes.astype(np.int32)
+
+    def _gather_column(self, name, rows):
+        kind = self.schema[name]
+        parts = self.arrays[name]
+
+        if kind == FIXED:
+            return [value.decode("utf-8") for value in parts["values"][rows]]
+        if kind == DICT:
+            vocabulary = [value.decode("utf-8") for value in parts["vocabulary"]]
+            return [vocabulary[code] for code in parts["codes"][rows]]
+        if kind == INT:
+            return [
+                None if value == MISSING_INT else int(value)
+                for value in parts["values"][rows]
+            ]
+
+        data = parts["data"]
+        starts = parts["offsets"][rows]
+        ends = parts["offsets"][rows + 1]
+        values = [bytes(data[s:e]).decode("utf-8") for s, e in zip(starts, ends)]
+        if kind == JSON:
+            return [json.loads(value) for value in values]
+        return values
+
+    def gather(self, rows, fields=None):
+        """
+        Assemble one dict per row, restricted to `fields` when given
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        if fields is None:
+            fields = self.schema
+        names = [name for name in fields if name in self.schema]
+        if not names:
+            return [{} for _ in rows]
+
+        columns = [self._gather_column(name, rows) for name in names]
+        return [dict(zip(names, values)) for values in zip(*columns)]
+
+
+class FragmentCache:
+    """
+    Pre-serialized JSON members per product row and field projection, e.g.
+    b'"id":"B0...","title":"..."', so a response is assembled by joining
+    bytes instead of building and encoding a dict per product per request.
+    Least recently used fragments are dropped past `max_entries`.
+    """
+
+    def __init__(self, store, max_entries=200000):
+        self.store = store
+        self.max_entries = max_entries
+        self._fragments = collections.OrderedDict()  # (fields, row) -> bytes
+        self._lock = threading.Lock()
+
+    def get(self, rows, fields=None):
+        fields = None if fields is None else tuple(fields)
+        keys = [(fields, int(row)) for row in rows]
+
+        fragments = [None] * len(keys)
+        missing = []
+        with self._lock:
+            for i, key in enumerate(keys):
+                fragment = self._fragments.get(key)
+                if fragment is None:
+                    missing.append(i)
+                else:
+                    self._fragments.move_to_end(key)
+                    fragments[i] = fragment
+
+        if missing:
+            # the misses are decoded with one gather and encoded once
+            products = self.store.gather([keys[i][1] for i in missing], fields)
+            with self._lock:
+                for i, product in zip(missing, products):
+                    fragments[i] = orjson.dumps(product)[1:-1]
+                    self._fragments[keys[i]] = fragments[i]
+                while len(self._fragments) > self.max_entries:
+                    self._fragments.popitem(last=False)
+        return fragments
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("usage: python product_store.py <processed_data.json[l]> <output_dir>")
+        sys.exit(1)
+
+    store = ProductStore.open(sys.argv[1])
+    store.save(sys.argv[2])
+    print(f"Saved {len(store)} products to {sys.argv[2]}")
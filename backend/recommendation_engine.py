@@ -1,157 +1,1109 @@
+import hashlib
+import math
+import os
+import secrets
+import time
+
 import faiss
-import json
 import numpy as np
+import orjson
+
+from cold_start import ColdStartPool
+from facet_index import FacetIndex
+from product_store import FragmentCache, ProductStore
+from rerank import group_codes, mmr, normalize_rows
+from result_cache import ResultCache
+from user_store import MemoryUserStore
+
+
+def labels_in_bitset(bits, labels):
+    """
+    Boolean array: which of `labels` have their bit set in the packed
+    (little bit order) uint8 bitset `bits`; negative labels never do
+    """
+    labels = np.asarray(labels, dtype=np.int64)
+    inside = (labels >= 0) & (labels < len(bits) * 8)
+    found = np.zeros(labels.shape, dtype=bool)
+    hits = labels[inside]
+    found[inside] = (bits[hits >> 3] >> (hits & 7)) & 1 == 1
+    return found
+
+
+def absorb_into_centroids(centroids, weights, embedding, limit):
+    """
+    Online clustering with a hard cap: the embedding becomes a centroid of its
+    own, and past `limit` the two closest centroids are merged into their
+    weighted mean. Returns the new (centroids, weights).
+    """
+    centroids = np.vstack([centroids, embedding[None, :]]).astype(np.float32)
+    weights = np.append(weights, 1.0)
+    if len(centroids) <= limit:
+        return centroids, weights
+
+    squared = (centroids**2).sum(axis=1)
+    distances = squared[:, None] + squared[None, :] - 2 * centroids @ centroids.T
+    np.fill_diagonal(distances, np.inf)
+    a, b = np.unravel_index(np.argmin(distances), distances.shape)
+
+    total = weights[a] + weights[b]
+    centroids[a] = (weights[a] * centroids[a] + weights[b] * centroids[b]) / total
+    weights[a] = total
+    return np.delete(centroids, b, axis=0), np.delete(weights, b)
+
+
+def refined_search(
+    index, queries, k, factor, embeddings, row_of_label=None, params=None
+):
+    """
+    Two-stage search over a compressed index: factor * k candidates from its
+    codes, re-ranked by exact L2 against the float32 `embeddings`. Labels map
+    to embedding rows through `row_of_label` (-1 where a label has none), or
+    are the rows themselves. Returns (distances, labels) padded like
+    index.search.
+    """
+    coarse_k = min(index.ntotal, k * factor)
+    _, coarse = index.search(queries, k=coarse_k, params=params)
+
+    distances = np.full((len(queries), k), np.inf, dtype=np.float32)
+    labels = np.full((len(queries), k), -1, dtype=np.int64)
+    for j, query in enumerate(queries):
+        # one query at a time keeps the gathered vectors to coarse_k rows
+        candidates = coarse[j][coarse[j] >= 0]
+        rows = candidates if row_of_label is None else row_of_label[candidates]
+        candidates, rows = candidates[rows >= 0], rows[rows >= 0]
+        exact = ((np.asarray(embeddings[rows]) - query) ** 2).sum(axis=1)
+        order = np.argsort(exact, kind="stable")[:k]
+        distances[j, : len(order)] = exact[order]
+        labels[j, : len(order)] = candidates[order]
+    return distances, labels
 
 
 class UserInteractionTracker:
-    def __init__(self):
-        self.liked_products = set()
-        self.disliked_products = set()
-        self.interaction_embeddings = {"liked": [], "disliked": []}
+    # one of these lives per active user, so keep instances small
+    __slots__ = (
+        "seen",
+        "catalog",
+        "liked_mean",
+        "disliked_mean",
+        "liked_weight",
+        "disliked_weight",
+        "max_centroids",
+        "liked_centroids",
+        "liked_centroid_weights",
+        "disliked_centroids",
+        "disliked_centroid_weights",
+        "half_life",
+        "updated_at",
+        "created",
+        "version",
+        "_preference",
+    )
+
+    def __init__(self, dimension=384, half_life=None, max_centroids=0):
+        # FAISS labels already swiped, one bit each; grows with the highest
+        # label seen, so 100k products cost at most 12.5 KB per user
+        self.seen = np.zeros(0, dtype=np.uint8)
+        # catalog_id of the engine whose labels `seen` refers to
+        self.catalog = None
+
+        # running (optionally time-decayed) means instead of every embedding;
+        # a mean is unchanged by decay, only the weight behind it shrinks
+        self.liked_mean = np.zeros(dimension, dtype=np.float32)
+        self.disliked_mean = np.zeros(dimension, dtype=np.float32)
+        self.liked_weight = 0.0
+        self.disliked_weight = 0.0
+
+        # up to max_centroids interest centroids per reaction, so users who
+        # like two different styles are not reduced to a point between them;
+        # 0 keeps only the means above
+        self.max_centroids = max_centroids
+        self.liked_centroids = np.zeros((0, dimension), dtype=np.float32)
+        self.liked_centroid_weights = np.zeros(0)
+        self.disliked_centroids = np.zeros((0, dimension), dtype=np.float32)
+        self.disliked_centroid_weights = np.zeros(0)
+
+        # seconds after which an interaction counts half as much; None = never
+        self.half_life = half_life
+        self.updated_at = None
+
+        # random per tracker, so a user recreated after being evicted does
+        # not reuse cached results keyed by the old tracker's version
+        self.created = secrets.randbits(63)
+        self.version = 0
+        self._preference = None
+
+    def _decay(self, now):
+        if self.half_life and self.updated_at is not None and now > self.updated_at:
+            factor = 0.5 ** ((now - self.updated_at) / self.half_life)
+            self.liked_weight *= factor
+            self.disliked_weight *= factor
+            self.liked_centroid_weights = self.liked_centroid_weights * factor
+            self.disliked_centroid_weights = self.disliked_centroid_weights * factor
+        self.updated_at = now if self.updated_at is None else max(self.updated_at, now)
+
+    def mark_seen(self, label):
+        byte = label >> 3
+        if byte >= len(self.seen):
+            # 64-byte steps: stores copy trackers on every update anyway, so
+            # doubling would only add slack to what gets persisted
+            grown = np.zeros(-(-(byte + 1) // 64) * 64, dtype=np.uint8)
+            grown[: len(self.seen)] = self.seen
+            self.seen = grown
+        self.seen[byte] |= 1 << (label & 7)
+
+    def seen_labels(self):
+        return np.flatnonzero(np.unpackbits(self.seen, bitorder="little"))
+
+    def add_interaction(self, label, embedding, reaction, timestamp=None):
+        self._decay(time.time() if timestamp is None else timestamp)
+        self.mark_seen(label)
 
-    def add_interaction(self, product_id, embedding, reaction):
         if reaction == "like":
-            self.liked_products.add(product_id)
-            self.interaction_embeddings["liked"].append(embedding)
+            self.liked_weight += 1.0
+            self.liked_mean += (embedding - self.liked_mean) / self.liked_weight
+            if self.max_centroids:
+                self.liked_centroids, self.liked_centroid_weights = (
+                    absorb_into_centroids(
+                        self.liked_centroids,
+                        self.liked_centroid_weights,
+                        embedding,
+                        self.max_centroids,
+                    )
+                )
         else:
-            self.disliked_products.add(product_id)
-            self.interaction_embeddings["disliked"].append(embedding)
+            self.disliked_weight += 1.0
+            self.disliked_mean += (
+                embedding - self.disliked_mean
+            ) / self.disliked_weight
+            if self.max_centroids:
+                self.disliked_centroids, self.disliked_centroid_weights = (
+                    absorb_into_centroids(
+                        self.disliked_centroids,
+                        self.disliked_centroid_weights,
+                        embedding,
+                        self.max_centroids,
+                    )
+                )
+
+        self.version += 1
+        self._preference = None
+
+    def to_state(self):
+        """
+        Everything needed to rebuild this tracker, as plain values and arrays
+        """
+        return {
+            "seen": self.seen,
+            "catalog": self.catalog,
+            "liked_mean": self.liked_mean,
+            "disliked_mean": self.disliked_mean,
+            "liked_weight": self.liked_weight,
+            "disliked_weight": self.disliked_weight,
+            "max_centroids": self.max_centroids,
+            "liked_centroids": self.liked_centroids,
+            "liked_centroid_weights": self.liked_centroid_weights,
+            "disliked_centroids": self.disliked_centroids,
+            "disliked_centroid_weights": self.disliked_centroid_weights,
+            "half_life": self.half_life,
+            "updated_at": self.updated_at,
+            "created": self.created,
+            "version": self.version,
+        }
+
+    @classmethod
+    def from_state(cls, state):
+        tracker = cls(
+            len(state["liked_mean"]),
+            half_life=state["half_life"],
+            max_centroids=state["max_centroids"],
+        )
+        tracker.seen = np.array(state["seen"], dtype=np.uint8)
+        tracker.catalog = state["catalog"]
+        tracker.liked_mean = np.array(state["liked_mean"], dtype=np.float32)
+        tracker.disliked_mean = np.array(state["disliked_mean"], dtype=np.float32)
+        tracker.liked_weight = state["liked_weight"]
+        tracker.disliked_weight = state["disliked_weight"]
+        for name in (
+            "liked_centroids",
+            "liked_centroid_weights",
+            "disliked_centroids",
+            "disliked_centroid_weights",
+        ):
+            setattr(tracker, name, np.array(state[name]))
+        tracker.updated_at = state["updated_at"]
+        # states saved before trackers had a stamp keep the fresh one
+        tracker.created = state.get("created", tracker.created)
+        tracker.version = state["version"]
+        return tracker
 
     def compute_preference_vector(self):
-        liked_vector = (
-            np.mean(self.interaction_embeddings["liked"], axis=0)
-            if self.interaction_embeddings["liked"]
-            else None
+        if self._preference is None:
+            liked = self.liked_weight > 0
+            disliked = self.disliked_weight > 0
+
+            if liked and disliked:
+                self._preference = self.liked_mean - 0.5 * self.disliked_mean
+            elif liked:
+                self._preference = self.liked_mean.copy()
+            elif disliked:
+                self._preference = -self.disliked_mean
+        return self._preference
+
+
+class RecommendationEngine:
+    def __init__(
+        self,
+        faiss_index_path,
+        product_metadata_path,
+        bounded_search=True,
+        search_oversample=4,
+        min_search_k=64,
+        preference_half_life=None,
+        nprobe=None,
+        ef_search=None,
+        embeddings_path=None,
+        mmap=False,
+        user_store=None,
+        cold_start=True,
+        cold_start_clusters=None,
+        cold_start_refresh=300.0,
+        diversity_lambda=None,
+        max_per_title=None,
+        rerank_candidates=4,
+        interest_centroids=0,
+        dislike_penalty=0.5,
+        result_cache_bytes=0,
+        result_cache_ttl=60.0,
+        refine_factor=None,
+    ):
+        # with mmap the index codes and a saved product store are mapped
+        # read-only, so workers on one host share a single physical copy
+        io_flags = faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY if mmap else 0
+        self.index = faiss.read_index(faiss_index_path, io_flags)
+
+        # IVF indexes need a direct map for reconstruct() on interactions
+        ivf = faiss.try_extract_index_ivf(self.index)
+        if ivf is not None and ivf.direct_map.type == faiss.DirectMap.NoMap:
+            ivf.make_direct_map()
+
+        # runtime ANN knobs; None keeps whatever the index was saved with
+        self.nprobe = None
+        self.nlist = None
+        self.ef_search = None
+        self.configure_search(nprobe=nprobe, ef_search=ef_search)
+
+        # columnar metadata; either processed_data.json or a directory
+        # written by product_store.py (only the latter can be mapped)
+        self.products = ProductStore.open(
+            product_metadata_path, mmap_mode="r" if mmap else None
         )
-        disliked_vector = (
-            np.mean(self.interaction_embeddings["disliked"], axis=0)
-            if self.interaction_embeddings["disliked"]
-            else None
+        self.fragments = FragmentCache(self.products)
+
+        # indexes built with ids (model/reindex.py) are labelled by the
+        # products' running ids, older ones by metadata row
+        if self._index_has_ids():
+            self.label_of_row = np.asarray(self.products.labels, dtype=np.int64)
+        else:
+            self.label_of_row = np.arange(len(self.products), dtype=np.int64)
+        label_space = int(self.label_of_row.max()) + 1 if len(self.products) else 0
+        self.row_of_label = np.full(label_space, -1, dtype=np.int64)
+        self.row_of_label[self.label_of_row] = np.arange(len(self.products))
+
+        # identifies this label assignment; trackers remember it so their
+        # seen bitsets can be translated after a reload (see adopt)
+        fingerprint = hashlib.sha1(np.ascontiguousarray(self.label_of_row).tobytes())
+        fingerprint.update(np.ascontiguousarray(self.products.ids).tobytes())
+        self.catalog_id = fingerprint.hexdigest()[:16]
+        self.label_translations = {}
+
+        # exact float32 vectors, memory-mapped from the .npy written by the
+        # model stage; without them vectors are reconstructed from the index
+        self.embeddings = None
+        if embeddings_path is not None:
+            self._load_embeddings(embeddings_path)
+
+        # two-stage search for compressed indexes (model/build_index.py): the
+        # codes are scanned for refine_factor times as many candidates, which
+        # are then re-ranked by exact float32 distance to the embeddings
+        self.refine_factor = refine_factor
+        if refine_factor is not None and self.embeddings is None:
+            raise ValueError("refine_factor needs embeddings_path for the exact re-rank")
+        self.index_takes_selector = self._index_takes_selector()
+
+        # color/category masks over FAISS labels, so filters never touch the
+        # records per candidate and can be handed to FAISS directly
+        self.facets = FacetIndex(
+            self._codes_by_label("color"), self._codes_by_label("category")
         )
 
-        if liked_vector is not None and disliked_vector is not None:
-            return liked_vector - 0.5 * disliked_vector
-        elif liked_vector is not None:
-            return liked_vector
-        elif disliked_vector is not None:
-            return -disliked_vector
-        return None
+        # bounded search asks FAISS for a small k and only widens it until
+        # enough unseen, filter-passing candidates turn up
+        self.bounded_search = bounded_search
+        self.search_oversample = search_oversample
+        self.min_search_k = min_search_k
 
+        # optional re-ranking (rerank.py) of rerank_candidates times as many
+        # neighbours: MMR below lambda 1, and at most max_per_title variants
+        # of one title
+        self.diversity_lambda = diversity_lambda
+        self.max_per_title = max_per_title
+        self.rerank_candidates = rerank_candidates
 
-class RecommendationEngine:
-    def __init__(self, faiss_index_path, product_metadata_path):
-        self.index = faiss.read_index(faiss_index_path)
+        # None keeps plain means; seconds makes recent swipes outweigh old ones
+        self.preference_half_life = preference_half_life
 
-        with open(product_metadata_path, "r") as f:
-            self.product_metadata = json.load(f)
+        # above 1, trackers keep that many like/dislike centroids and users
+        # with several interests are searched by each (one FAISS call for all)
+        self.interest_centroids = interest_centroids
+        self.dislike_penalty = dislike_penalty
 
-        self.faiss_id_to_product_id = {
-            i: item["id"] for i, item in enumerate(self.product_metadata.keys())
-        }
-        self.product_id_to_faiss_id = {
-            v: k for k, v in self.faiss_id_to_product_id.items()
-        }
+        # repeated queries from users who have not swiped since are answered
+        # from here; cold-start picks are not cached, they are meant to vary
+        self.result_cache = None
+        if result_cache_bytes:
+            self.result_cache = ResultCache(result_cache_bytes, ttl=result_cache_ttl)
+
+        # user_id -> tracker; a store (user_store.py) rather than a dict so
+        # state can be bounded, persisted and shared between workers
+        self.user_trackers = MemoryUserStore() if user_store is None else user_store
+        self.user_trackers.tracker_from_state = UserInteractionTracker.from_state
+
+        # likes per label, read by the cold-start pools on every refresh;
+        # unlocked increments can drop the odd count, which ranking tolerates.
+        # The store keeps the counts by product id, so they are seeded from
+        # it here and re-read before each refresh to pick up other workers
+        self.popularity = np.zeros(len(self.row_of_label), dtype=np.int64)
+        self._load_popularity()
+
+        # users without interactions get picks from pools clustered and
+        # ranked in the background; until the first build they get a stride
+        self.cold_start = None
+        if cold_start and len(self.products):
+            self.cold_start = ColdStartPool(
+                self.facets,
+                self.label_of_row,
+                self._vectors,
+                self.popularity,
+                num_clusters=cold_start_clusters,
+                load_popularity=self._load_popularity,
+            )
+            self.cold_start.start(cold_start_refresh)
+
+    def validate(self, sample=16):
+        """
+        Cheap checks before a freshly loaded engine takes traffic; raises
+        ValueError naming the first problem found
+        """
+        if self.index.ntotal == 0:
+            raise ValueError("index is empty")
+        if not len(self.products):
+            raise ValueError("product metadata is empty")
+
+        vectors, _ = self._vectors(self.label_of_row[:sample])
+        if not len(vectors):
+            raise ValueError("none of the first products are in the index")
+        _, labels = self.index.search(np.ascontiguousarray(vectors, dtype="float32"), 1)
+        if (self._rows_of_labels(labels) < 0).any():
+            raise ValueError("index returns labels missing from the product metadata")
+
+    def close(self):
+        if self.cold_start is not None:
+            self.cold_start.stop()
+
+    def label_translation(self, previous):
+        """
+        previous engine's label -> this engine's label (-1 where the product
+        is gone), matched by product id since labels can change between builds
+        """
+        translation = np.full(len(previous.row_of_label), -1, dtype=np.int64)
+        rows = self.products.rows_of(previous.products.column("id"))
+        found = rows >= 0
+        translation[previous.label_of_row[found]] = self.label_of_row[rows[found]]
+        return translation
 
-        self.user_trackers = {}
+    def adopt(self, previous, keep_catalogs=4):
+        """
+        Take over user state from the engine this one replaces: the same user
+        store (and the like counts in it), and label translations so trackers
+        written against the previous catalog (or the few before it) are
+        remapped when they are next read
+        """
+        if previous.index.d != self.index.d:
+            raise ValueError(
+                f"embedding dimension changed ({previous.index.d} -> {self.index.d}); "
+                "existing user profiles would not fit this index"
+            )
+
+        self.user_trackers = previous.user_trackers
+        self._load_popularity()
+        if previous.catalog_id == self.catalog_id:
+            self.label_translations = dict(previous.label_translations)
+            return
+
+        translation = self.label_translation(previous)
+        self.label_translations = {previous.catalog_id: translation}
+        for catalog, older in list(previous.label_translations.items())[
+            -(keep_catalogs - 1) :
+        ]:
+            self.label_translations[catalog] = np.where(
+                older >= 0, translation[np.maximum(older, 0)], -1
+            )
+
+    def _load_popularity(self):
+        counts = self.user_trackers.like_counts()
+        rows = self.products.rows_of(list(counts))
+        found = rows >= 0
+        popularity = np.zeros_like(self.popularity)
+        popularity[self.label_of_row[rows[found]]] = np.fromiter(
+            counts.values(), dtype=np.int64, count=len(counts)
+        )[found]
+        # in place: the cold-start pools hold this array
+        self.popularity[:] = popularity
+
+    def _current(self, tracker):
+        """
+        `tracker` with its seen labels in this engine's catalog, translated
+        on a copy if it was written against an earlier one
+        """
+        if tracker is None or tracker.catalog in (None, self.catalog_id):
+            return tracker
+        tracker = UserInteractionTracker.from_state(tracker.to_state())
+        self._translate_seen(tracker)
+        return tracker
+
+    def _translate_seen(self, tracker):
+        if tracker.catalog == self.catalog_id:
+            return
+        translation = self.label_translations.get(tracker.catalog)
+        tracker.catalog = self.catalog_id
+        if translation is None:
+            # a catalog this process never loaded (written before a restart,
+            # or by a worker that reloaded at another time); labels from the
+            # id registry are stable across builds, so keep them, but row
+            # numbers shift with the metadata and would hide other products
+            if not self._index_has_ids():
+                tracker.seen = np.zeros(0, dtype=np.uint8)
+            return
+
+        seen = tracker.seen_labels()
+        tracker.seen = np.zeros(0, dtype=np.uint8)
+        labels = translation[seen[seen < len(translation)]]
+        labels = labels[labels >= 0]
+        if len(labels):
+            bits = np.zeros(-(-(int(labels.max()) + 1) // 512) * 512, dtype=bool)
+            bits[labels] = True
+            tracker.seen = np.packbits(bits, bitorder="little")
+
+    def configure_search(self, nprobe=None, ef_search=None):
+        """
+        Set how much of an IVF (nprobe) or HNSW (efSearch) index each query
+        visits; ignored for index types that do not have the knob
+        """
+        ivf = faiss.try_extract_index_ivf(self.index)
+        if ivf is not None:
+            if nprobe is not None:
+                ivf.nprobe = nprobe
+            self.nprobe = ivf.nprobe
+            self.nlist = ivf.nlist
+
+        hnsw = self._hnsw_index()
+        if hnsw is not None:
+            if ef_search is not None:
+                hnsw.hnsw.efSearch = ef_search
+            self.ef_search = hnsw.hnsw.efSearch
+
+    def _base_index(self):
+        # the index under any id map and PCA wrappers (model/build_index.py)
+        index = faiss.downcast_index(self.index)
+        while isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2, faiss.IndexPreTransform)):
+            index = faiss.downcast_index(index.index)
+        return index
+
+    def _hnsw_index(self):
+        index = self._base_index()
+        return index if isinstance(index, faiss.IndexHNSW) else None
+
+    def _index_takes_selector(self):
+        # binary-code (LSH) indexes reject search parameters, so filters are
+        # applied to their candidates instead
+        return not isinstance(self._base_index(), faiss.IndexLSH)
+
+    def _index_has_ids(self):
+        if isinstance(self.index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+            return True
+        ivf = faiss.try_extract_index_ivf(self.index)
+        return ivf is not None and ivf.direct_map.type == faiss.DirectMap.Hashtable
+
+    def _load_embeddings(self, path):
+        self.embeddings = np.load(path, mmap_mode="r")
+        ids = np.load(os.path.splitext(path)[0] + ".ids.npy", mmap_mode="r")
+        if not self._index_has_ids():
+            ids = np.arange(len(self.embeddings))
+
+        self.embedding_row_of_label = np.full(
+            max(len(self.row_of_label), int(ids.max()) + 1 if len(ids) else 0),
+            -1,
+            dtype=np.int64,
+        )
+        self.embedding_row_of_label[ids] = np.arange(len(ids))
+
+    def _vector(self, label):
+        if self.embeddings is None:
+            return self.index.reconstruct(label)
+
+        # the map covers every metadata label, so only a miss needs checking
+        row = self.embedding_row_of_label[label]
+        if row < 0:
+            raise KeyError(label)
+        return np.array(self.embeddings[row])
+
+    def _vectors(self, labels):
+        """
+        (vectors, labels) for those of `labels` that have a vector
+        """
+        labels = np.asarray(labels, dtype=np.int64)
+        if self.embeddings is not None:
+            rows = self.embedding_row_of_label[labels]
+            return np.asarray(self.embeddings[rows[rows >= 0]]), labels[rows >= 0]
+
+        try:
+            return self.index.reconstruct_batch(labels), labels
+        except RuntimeError:
+            # some label is not in the index; fall back to one at a time
+            vectors, found = [], []
+            for label in labels:
+                try:
+                    vectors.append(self.index.reconstruct(int(label)))
+                    found.append(label)
+                except RuntimeError:
+                    pass
+            vectors = np.array(vectors, dtype=np.float32).reshape(-1, self.index.d)
+            return vectors, np.array(found, dtype=np.int64)
+
+    def _codes_by_label(self, column):
+        vocabulary, codes = self.products.codes(column)
+        by_label = np.full(len(self.row_of_label), -1, dtype=np.int32)
+        by_label[self.label_of_row] = codes
+        return vocabulary, by_label
+
+    def _rows_of_labels(self, labels):
+        # -1 for padding and for vectors without metadata
+        rows = np.full(labels.shape, -1, dtype=np.int64)
+        valid = (labels >= 0) & (labels < len(self.row_of_label))
+        rows[valid] = self.row_of_label[labels[valid]]
+        return rows
+
+    def _scan_width(self, scale):
+        """
+        (nprobe, efSearch) visiting `scale` times as much of an IVF or HNSW
+        index as configured; None for knobs the index does not have
+        """
+        nprobe = ef_search = None
+        if self.nprobe is not None:
+            nprobe = min(self.nlist, math.ceil(self.nprobe * scale))
+        if self.ef_search is not None:
+            ef_search = math.ceil(self.ef_search * scale)
+        return nprobe, ef_search
+
+    def _search_parameters(self, selector, scale=1):
+        """
+        Search parameters with the filter's selector, at _scan_width(scale)
+        """
+        nprobe, ef_search = self._scan_width(scale)
+        # IVF indexes reject parameters that are not SearchParametersIVF
+        if nprobe is not None:
+            return faiss.SearchParametersIVF(sel=selector, nprobe=nprobe)
+        if ef_search is not None:
+            return faiss.SearchParametersHNSW(sel=selector, efSearch=ef_search)
+        if selector is None:
+            return None
+        return faiss.SearchParameters(sel=selector)
+
+    def _scan_is_exhaustive(self, scale):
+        # every vector is compared: flat and code-scanning indexes, or IVF
+        # probing all of its lists
+        nprobe, ef_search = self._scan_width(scale)
+        if nprobe is not None:
+            return nprobe >= self.nlist
+        return ef_search is None
 
     def record_user_interaction(self, user_id, product_id, reaction="like"):
-        if user_id not in self.user_trackers:
-            self.user_trackers[user_id] = UserInteractionTracker()
+        embedding = None
+        row = self.products.row_of(product_id)
+        if row is not None:
+            label = int(self.label_of_row[row])
+            try:
+                embedding = self._vector(label)
+            except (RuntimeError, KeyError):
+                # product whose image never made it into the index
+                pass
 
-        faiss_idx = self.product_id_to_faiss_id.get(product_id)
-        if faiss_idx is not None:
-            embedding = self.index.reconstruct(faiss_idx)
+        if embedding is None and user_id in self.user_trackers:
+            return
 
-            # Record interaction
-            self.user_trackers[user_id].add_interaction(product_id, embedding, reaction)
+        if embedding is not None and reaction == "like":
+            self.popularity[label] += 1
+            self.user_trackers.add_like(product_id)
+
+        def apply(tracker):
+            self._translate_seen(tracker)
+            if embedding is not None:
+                # Record interaction
+                tracker.add_interaction(label, embedding, reaction)
+
+        self.user_trackers.update(
+            user_id,
+            apply,
+            create=lambda: UserInteractionTracker(
+                self.index.d,
+                half_life=self.preference_half_life,
+                max_centroids=self.interest_centroids,
+            ),
+        )
 
     def get_recommendations(
-        self, user_id, num_recommendations=10, color_filter=None, category_filter=None
+        self,
+        user_id,
+        num_recommendations=10,
+        color_filter=None,
+        category_filter=None,
+        fields=None,
     ):
-        user_tracker = self.user_trackers.get(user_id, UserInteractionTracker())
+        return self.get_recommendations_batch(
+            [
+                {
+                    "user_id": user_id,
+                    "num_recommendations": num_recommendations,
+                    "color_filter": color_filter,
+                    "category_filter": category_filter,
+                    "fields": fields,
+                }
+            ]
+        )[0]
 
-        user_preference = user_tracker.compute_preference_vector()
+    def get_recommendations_batch(self, queries):
+        """
+        Answer many users at once. Each query is a dict of get_recommendations
+        keyword arguments; users sharing a filter set share one index.search.
+        Items carry every product field, or only the query's "fields"
+        """
+        found = self._recommend(queries)
+        results = [None] * len(queries)
 
-        if user_preference is None:
-            return self._get_diverse_recommendations(
-                num_recommendations, color_filter, category_filter
+        # one gather per distinct projection, split back per query afterwards
+        by_fields = {}
+        for i, query in enumerate(queries):
+            fields = query.get("fields")
+            by_fields.setdefault(None if fields is None else tuple(fields), []).append(i)
+
+        for fields, positions in by_fields.items():
+            store_fields, with_score, with_id = self._projection(fields)
+            all_rows = np.concatenate(
+                [found[i][0] for i in positions] + [np.empty(0, dtype=np.int64)]
             )
+            products = iter(self.products.gather(all_rows, store_fields))
+            for i in positions:
+                rows, scores = found[i]
+                results[i] = []
+                for j, row in enumerate(rows):
+                    item = {}
+                    if scores is not None and with_score:
+                        item["similarity_score"] = float(scores[j])
+                    if scores is None and with_id:
+                        item["product_id"] = self.products.product_id(row)
+                    item.update(next(products))
+                    results[i].append(item)
 
-        distances, indices = self.index.search(
-            np.array([user_preference]), k=self.index.ntotal  # Search entire index
-        )
+        return results
+
+    def get_recommendations_json(self, queries):
+        """
+        get_recommendations_batch, but each result is its JSON array as bytes,
+        joined from per-product fragments that are serialized only once
+        """
+        payloads = []
+        for query, (rows, scores) in zip(queries, self._recommend(queries)):
+            store_fields, with_score, with_id = self._projection(query.get("fields"))
+            fragments = self.fragments.get(rows, store_fields)
 
-        indices = indices[0]
-        distances = distances[0]
+            items = []
+            for j, fragment in enumerate(fragments):
+                members = []
+                if scores is not None and with_score:
+                    members.append(b'"similarity_score":' + orjson.dumps(float(scores[j])))
+                if scores is None and with_id:
+                    members.append(
+                        b'"product_id":' + orjson.dumps(self.products.product_id(rows[j]))
+                    )
+                if fragment:
+                    members.append(fragment)
+                items.append(b"{" + b",".join(members) + b"}")
+            payloads.append(b"[" + b",".join(items) + b"]")
+        return payloads
 
-        filtered_recommendations = []
-        for i, idx in enumerate(indices):
-            if idx >= len(self.product_metadata):
+    def _projection(self, fields):
+        """
+        (store columns to gather, include similarity_score, include
+        product_id) for a field list; None means everything
+        """
+        if fields is None:
+            return None, True, True
+        store_fields = [field for field in fields if field in self.products.schema]
+        return store_fields, "similarity_score" in fields, "product_id" in fields
+
+    def _recommend(self, queries):
+        """
+        (rows, similarity scores) per query; scores are None for users served
+        from the cold-start picks
+        """
+        found = [None] * len(queries)
+        groups = {}
+
+        for i, query in enumerate(queries):
+            num_recommendations = query.get("num_recommendations", 10)
+            color_filter = query.get("color_filter")
+            category_filter = query.get("category_filter")
+
+            # stores never mutate a tracker once handed out, so a concurrent
+            # swipe cannot change this one halfway through the search
+            user_tracker = self._current(self.user_trackers.get(query["user_id"]))
+            user_preference = None
+            if user_tracker is not None:
+                user_preference = user_tracker.compute_preference_vector()
+
+            if user_preference is None:
+                found[i] = (
+                    self._diverse_rows(
+                        num_recommendations, color_filter, category_filter
+                    ),
+                    None,
+                )
                 continue
 
-            product_id = self.faiss_id_to_product_id[idx]
+            # the tracker version moves with every swipe, so an unchanged
+            # version of the same tracker means the same preference and seen
+            # set as last time
+            key = self.facets.key(color_filter, category_filter)
+            cache_key = (
+                query["user_id"],
+                user_tracker.catalog,
+                user_tracker.created,
+                user_tracker.version,
+                key,
+                num_recommendations,
+            )
+            if self.result_cache is not None:
+                cached = self.result_cache.get(cache_key)
+                if cached is not None:
+                    found[i] = cached
+                    continue
+
+            # users with several interests query by each centroid, and their
+            # dislikes become a penalty instead of being subtracted
+            interests, weights, dislikes = user_preference[None, :], None, None
+            if len(user_tracker.liked_centroids) > 1:
+                interests = user_tracker.liked_centroids
+                weights = user_tracker.liked_centroid_weights
+                if len(user_tracker.disliked_centroids):
+                    dislikes = user_tracker.disliked_centroids
 
-            if (
-                product_id in user_tracker.liked_products
-                or product_id in user_tracker.disliked_products
+            group = groups.setdefault(
+                key, {"filters": (color_filter, category_filter), "members": []}
+            )
+            group["members"].append(
+                (i, interests, weights, dislikes, user_tracker.seen, num_recommendations)
+            )
+            group.setdefault("cache_keys", []).append(cache_key)
+
+        for group in groups.values():
+            members = group["members"]
+            group_results = self._search_group(members, *group["filters"])
+            for member, cache_key, result in zip(
+                members, group["cache_keys"], group_results
             ):
-                continue
+                found[member[0]] = result
+                if self.result_cache is not None:
+                    self.result_cache.put(cache_key, *result)
 
-            # product_info = next(
-            #     item for item in self.product_metadata if item["id"] == product_id
-            # )
-            product_info = self.product_metadata[i]
+        return found
 
-            # apply filters
-            color_match = not color_filter or product_info.get("color", "").lower() in [
-                c.lower() for c in color_filter
-            ]
-            category_match = not category_filter or product_info.get(
-                "category", ""
-            ).lower() in [c.lower() for c in category_filter]
-
-            if color_match and category_match:
-                filtered_recommendations.append(
-                    {
-                        "similarity_score": 1
-                        / (1 + distances[i]),
-                        **product_info,
-                    }
+    def _search_group(self, members, color_filter, category_filter):
+        """
+        (rows, similarity scores) arrays per member; members are (position,
+        interest vectors, interest weights, disliked centroids, seen bitset,
+        num_recommendations) per user
+        """
+        num_recommendations = np.array([member[5] for member in members])
+        reranking = self.diversity_lambda is not None or self.max_per_title is not None
+        wanted = num_recommendations
+        if reranking:
+            wanted = num_recommendations * self.rerank_candidates
+
+        # every interest vector of every user goes into one search
+        counts = [len(member[1]) for member in members]
+        offsets = np.concatenate([[0], np.cumsum(counts)])
+        owners = np.repeat(np.arange(len(members)), counts)
+        rows, scores = self._search_rows(
+            np.concatenate([member[1] for member in members]).astype("float32"),
+            [members[owner][4] for owner in owners],
+            wanted[owners],
+            color_filter,
+            category_filter,
+        )
+
+        results = []
+        for u, member in enumerate(members):
+            start, end = offsets[u], offsets[u + 1]
+            if end - start > 1:
+                picked_rows, picked_scores = self._merge_interests(
+                    rows[start:end], scores[start:end], member[2], member[3], wanted[u]
                 )
+            else:
+                picked_rows, picked_scores = rows[start], scores[start]
 
-                if len(filtered_recommendations) >= num_recommendations:
-                    break
+            if reranking:
+                picks = self._rerank(
+                    picked_rows, picked_scores, num_recommendations[u]
+                )
+                picked_rows = [picked_rows[i] for i in picks]
+                picked_scores = [picked_scores[i] for i in picks]
 
-        filtered_recommendations.sort(key=lambda x: x["similarity_score"], reverse=True)
+            results.append(
+                (
+                    np.asarray(picked_rows, dtype=np.int64),
+                    np.asarray(picked_scores, dtype=np.float32),
+                )
+            )
+        return results
 
-        return filtered_recommendations[:num_recommendations]
+    def _search_rows(self, queries, seen, wanted, color_filter, category_filter):
+        """
+        Up to wanted[j] unseen, filter-passing (rows, similarities) per query
+        """
+        mask, selector = self.facets.lookup(color_filter, category_filter)
+        post_filter = mask is not None and not self.index_takes_selector
+        refining = self.refine_factor is not None
 
-    def _get_diverse_recommendations(
-        self, num_recommendations, color_filter=None, category_filter=None
-    ):
-        total_vectors = self.index.ntotal
+        rows = [[] for _ in seen]
+        scores = [[] for _ in seen]
 
-        step = max(1, total_vectors // (num_recommendations * 2))
+        # filtered-out products are never scored: the facet mask is handed to
+        # FAISS as an IDSelector, which also caps how far k can usefully grow
+        limit = self.index.ntotal
+        if mask is not None and not post_filter:
+            limit = min(limit, int(np.count_nonzero(mask)))
+        if limit == 0 or (post_filter and not mask.any()):
+            return rows, scores
 
-        recommendations = []
-        for i in range(0, total_vectors, step):
-            product_id = self.faiss_id_to_product_id[i]
-            product_info = self.product_metadata[i]
+        if self.bounded_search:
+            k = min(
+                limit,
+                max(int(wanted.max()) * self.search_oversample, self.min_search_k),
+            )
+        else:
+            k = limit  # Search entire index
 
-            color_match = not color_filter or product_info.get("color", "").lower() in [
-                c.lower() for c in color_filter
-            ]
-            category_match = not category_filter or product_info.get(
-                "category", ""
-            ).lower() in [c.lower() for c in category_filter]
+        first_k = k
+        pending = np.arange(len(seen))
+        exact = []
+        searched = 0
+        previous_width = None
+        while True:
+            # a larger k alone cannot reach past the lists (nprobe) or graph
+            # neighbourhood (efSearch) an ANN index visits, so those grow with it
+            scale = k / first_k
+            search_params = None
+            if not post_filter:
+                search_params = self._search_parameters(selector, scale)
+            distances, indices = self._search(queries[pending], k, search_params)
+
+            # FAISS returns the same ranking prefix for a larger k, so only the
+            # newly exposed tail needs to be looked at after widening. A wider
+            # scan finds closer items in lists or nodes it had not visited, and
+            # an exact re-rank of more candidates reorders them, so after
+            # either the whole ranking is read again
+            width = self._scan_width(scale)
+            rescanned = refining or width != previous_width
+            previous_width = width
+            start = 0 if rescanned else searched
+            candidates = indices[:, start:]
+            candidate_rows = self._rows_of_labels(candidates)
+            keep = candidate_rows >= 0
+            if post_filter:
+                keep &= mask[np.where(keep, candidates, 0)]
+            for j, position in enumerate(pending):
+                # seen items are a direct bit test per candidate label
+                keep[j] &= ~labels_in_bitset(seen[position], candidates[j])
+            similarities = 1 / (1 + distances[:, start:])
+
+            found = np.empty(len(pending), dtype=np.int64)
+            for j, position in enumerate(pending):
+                if rescanned:
+                    rows[position], scores[position] = [], []
+                needed = wanted[position] - len(rows[position])
+                rows[position].extend(candidate_rows[j][keep[j]][:needed])
+                scores[position].extend(similarities[j][keep[j]][:needed])
+                found[j] = len(rows[position])
+
+            unfinished = found < wanted[pending]
+
+            # a list padded with -1 is everything the scan reached: after an
+            # exhaustive scan there is nothing more to find, and a filtered
+            # ANN query gets an exact pass over the masked rows instead
+            reached_all = indices[:, -1] < 0
+            if self._scan_is_exhaustive(scale):
+                unfinished &= ~reached_all
+            elif mask is not None:
+                short = unfinished & (reached_all | (k >= limit))
+                exact.extend(pending[short])
+                unfinished &= ~short
+
+            if k >= limit or not unfinished.any():
+                break
+
+            searched = k
+            k = max(
+                self._widen_search_k(k, searched, found[j], wanted[position], limit)
+                for j, position in enumerate(pending)
+                if unfinished[j]
+            )
+            pending = pending[unfinished]
+
+        if exact:
+            self._exact_rows(queries, seen, wanted, mask, exact, rows, scores)
+        return rows, scores
+
+    def _exact_rows(self, queries, seen, wanted, mask, positions, rows, scores):
+        """
+        Replace the results of the queries at `positions` with an exact L2
+        ranking of every unseen masked product
+        """
+        vectors, labels = self._vectors(np.flatnonzero(mask))
+        candidate_rows = self._rows_of_labels(labels)
+        for position in positions:
+            distances = ((vectors - queries[position]) ** 2).sum(axis=1)
+            unseen = np.flatnonzero(~labels_in_bitset(seen[position], labels))
+            order = unseen[np.argsort(distances[unseen], kind="stable")]
+            order = order[: wanted[position]]
+            rows[position] = list(candidate_rows[order])
+            scores[position] = list(1 / (1 + distances[order]))
+
+    def _search(self, queries, k, params):
+        """
+        index.search, or with refine_factor a wider scan of the compressed
+        codes whose candidates are re-ranked by exact float32 L2
+        """
+        if self.refine_factor is None:
+            return self.index.search(queries, k=k, params=params)
+        return refined_search(
+            self.index,
+            queries,
+            k,
+            self.refine_factor,
+            self.embeddings,
+            self.embedding_row_of_label,
+            params,
+        )
+
+    def _merge_interests(self, rows, scores, weights, dislikes, wanted):
+        """
+        Merge the candidate lists of one user's interest centroids into one
+        list of up to `wanted`. Each interest gets a share proportional to its
+        weight, ranked by similarity minus a penalty for resembling a
+        disliked centroid; unused shares are filled by the best of the rest.
+        """
+        source = np.repeat(np.arange(len(rows)), [len(r) for r in rows])
+        rows = np.concatenate([np.asarray(r, dtype=np.int64) for r in rows])
+        scores = np.concatenate([np.asarray(s, dtype=np.float64) for s in scores])
+        if len(rows) == 0:
+            return [], []
 
-            if color_match and category_match:
-                recommendations.append({"product_id": product_id, **product_info})
+        # similarities are rescaled so the penalty (a cosine) is comparable
+        spread = scores.max() - scores.min()
+        ranking = (scores - scores.min()) / (spread if spread > 0 else 1.0)
+        if dislikes is not None and self.dislike_penalty:
+            labels = self.label_of_row[rows]
+            vectors, found = self._vectors(labels)
+            has_vector = np.isin(labels, found)
+            resemblance = normalize_rows(vectors) @ normalize_rows(dislikes).T
+            ranking[has_vector] -= self.dislike_penalty * np.maximum(
+                resemblance.max(axis=1), 0
+            )
 
-                if len(recommendations) >= num_recommendations:
+        shares = np.asarray(weights, dtype=np.float64)
+        quotas = np.floor(wanted * shares / shares.sum()).astype(np.int64)
+        quotas[np.argsort(-shares)[: wanted - quotas.sum()]] += 1
+
+        picked, taken = [], set()
+        taken_per_source = np.zeros(len(quotas), dtype=np.int64)
+        order = np.argsort(-ranking, kind="stable")
+        for capped in (True, False):
+            for i in order:
+                if len(picked) >= wanted:
                     break
+                if rows[i] in taken or (
+                    capped and taken_per_source[source[i]] >= quotas[source[i]]
+                ):
+                    continue
+                picked.append(i)
+                taken.add(rows[i])
+                taken_per_source[source[i]] += 1
+
+        picked = sorted(picked, key=lambda i: -ranking[i])
+        return [rows[i] for i in picked], [scores[i] for i in picked]
+
+    def _rerank(self, rows, scores, num):
+        """
+        Positions into `rows` to keep, in order
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        labels = self.label_of_row[rows]
+        vectors, found = self._vectors(labels)
+        candidates = np.flatnonzero(np.isin(labels, found))
+
+        groups = None
+        if self.max_per_title is not None:
+            groups = group_codes(self.products.column("title", rows[candidates]))
+
+        picks = mmr(
+            np.asarray(scores)[candidates],
+            vectors,
+            num,
+            diversity_lambda=(
+                1.0 if self.diversity_lambda is None else self.diversity_lambda
+            ),
+            groups=groups,
+            max_per_group=self.max_per_title,
+        )
+        return candidates[picks]
+
+    def _widen_search_k(self, k, searched, found, wanted, limit):
+        # grow at least geometrically, and jump straight to the size the
+        # observed pass rate says we need when many candidates were already seen
+        next_k = k * 2
+        if found:
+            pass_rate = found / searched
+            next_k = max(next_k, int(searched + 1.5 * (wanted - found) / pass_rate))
+        return min(limit, next_k)
+
+    def _diverse_rows(
+        self, num_recommendations, color_filter=None, category_filter=None
+    ):
+        if self.cold_start is not None and self.cold_start.ready:
+            labels = self.cold_start.sample(
+                num_recommendations, color_filter, category_filter
+            )
+            return self.row_of_label[labels]
+
+        mask = self.facets.mask(color_filter, category_filter)
+        if mask is None:
+            candidates = np.arange(len(self.products))
+        else:
+            candidates = self.row_of_label[np.flatnonzero(mask)]
+            candidates = candidates[candidates >= 0]
 
-        return recommendations
+        step = max(1, len(candidates) // max(1, num_recommendations * 2))
+        return candidates[::step][:num_recommendations]
 
 
 def main():
@@ -0,0 +1,81 @@
+"""
+Diversity re-ranking of a bounded candidate list
+
+Maximal marginal relevance picks, one at a time, the candidate maximising
+
+    lambda * relevance(c) - (1 - lambda) * max cos(c, already picked)
+
+where relevance is the search score rescaled to [0, 1] over the candidates,
+so lambda=1 keeps the plain nearest-neighbour order and smaller values trade
+relevance for variety. An optional per-group cap (e.g. per title, since every
+color variant of a dress is its own product) is applied during the same pass.
+
+Candidates are capped by the caller (a few times the number of results), so
+the pairwise similarity matrix is small and every step is one vectorized
+update over it.
+"""
+
+import numpy as np
+
+
+def normalize_rows(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def mmr(relevance, vectors, num, diversity_lambda=0.7, groups=None, max_per_group=None):
+    """
+    Indices into `vectors` in pick order, at most `num` of them
+
+    relevance: search score per candidate, higher is better.
+    groups: optional int code per candidate; no more than `max_per_group`
+    candidates of one code are picked.
+    """
+    count = len(vectors)
+    num = min(num, count)
+    if num == 0:
+        return np.empty(0, dtype=np.int64)
+
+    relevance = np.asarray(relevance, dtype=np.float32)
+    spread = relevance.max() - relevance.min()
+    relevance = (relevance - relevance.min()) / (spread if spread > 0 else 1.0)
+
+    vectors = normalize_rows(vectors)
+    similarity = vectors @ vectors.T
+
+    available = np.ones(count, dtype=bool)
+    redundancy = np.full(count, -np.inf, dtype=np.float32)
+    if groups is not None and max_per_group is not None:
+        groups = np.asarray(groups)
+        group_counts = np.zeros(int(groups.max()) + 1, dtype=np.int64)
+
+    picks = []
+    for _ in range(num):
+        if picks:
+            scores = diversity_lambda * relevance - (1 - diversity_lambda) * redundancy
+        else:
+            scores = relevance.copy()
+        scores[~available] = -np.inf
+
+        pick = int(np.argmax(scores))
+        if not available[pick]:
+            break  # every remaining candidate is capped out
+        picks.append(pick)
+        available[pick] = False
+        np.maximum(redundancy, similarity[pick], out=redundancy)
+
+        if groups is not None and max_per_group is not None:
+            group_counts[groups[pick]] += 1
+            if group_counts[groups[pick]] >= max_per_group:
+                available &= groups != groups[pick]
+
+    return np.asarray(picks, dtype=np.int64)
+
+
+def group_codes(values):
+    """
+    Int code per value, equal values sharing a code
+    """
+    _, codes = np.unique(np.asarray(values, dtype=object).astype(str), return_inverse=True)
+    return codes
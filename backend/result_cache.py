@@ -0,0 +1,93 @@
+import collections
+import sys
+import threading
+import time
+
+import numpy as np
+
+# what an OrderedDict entry and the (rows, scores, expires) tuple cost beyond
+# the objects they point to: a hash table slot, a linked-list node, the tuple
+# and the float
+ENTRY_OVERHEAD = 200
+
+
+def object_bytes(value):
+    """
+    Approximate memory held by a cache key or value: containers are walked,
+    arrays count their header and their buffer
+    """
+    if isinstance(value, (tuple, list, frozenset, set)):
+        return sys.getsizeof(value) + sum(object_bytes(item) for item in value)
+    size = sys.getsizeof(value)
+    if isinstance(value, np.ndarray) and value.base is not None:
+        # a view's getsizeof leaves out the buffer it shares
+        size += value.nbytes
+    return size
+
+
+class ResultCache:
+    """
+    LRU of search results with a time-to-live, bounded by an estimate of the
+    memory each entry holds: its key, its (rows, scores) NumPy arrays and the
+    bookkeeping around them. Product fields are gathered again on a hit.
+    """
+
+    def __init__(self, max_bytes, ttl=60.0):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._entries = collections.OrderedDict()  # key -> (rows, scores, expires, size)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] < now:
+                self._drop(key)
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry[0], entry[1]
+
+    def put(self, key, rows, scores):
+        size = object_bytes(key) + object_bytes(rows) + object_bytes(scores)
+        size += ENTRY_OVERHEAD
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (rows, scores, time.monotonic() + self.ttl, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _drop(self, key):
+        self.bytes -= self._entries.pop(key)[3]
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,67 @@
+import asyncio
+
+import pytest
+
+from coalescer import RequestCoalescer
+
+
+class Busy(Exception):
+    pass
+
+
+def make_run_batch(calls, failure=ValueError):
+    async def run_batch(queries):
+        calls.append(list(queries))
+        await asyncio.sleep(0)
+        if any(query < 0 for query in queries):
+            raise failure(f"bad query in {queries}")
+        return [query * 10 for query in queries]
+
+    return run_batch
+
+
+def submit_all(coalescer, queries):
+    async def main():
+        return await asyncio.gather(
+            *(coalescer.submit(query) for query in queries), return_exceptions=True
+        )
+
+    return asyncio.run(main())
+
+
+def test_concurrent_queries_share_one_batch():
+    calls = []
+    coalescer = RequestCoalescer(make_run_batch(calls), max_wait=0.01)
+    assert submit_all(coalescer, [1, 2, 3]) == [10, 20, 30]
+    assert calls == [[1, 2, 3]]
+    assert coalescer.stats()["batches"] == 1
+    assert not coalescer._dispatches
+
+
+def test_full_batches_are_flushed_without_waiting():
+    calls = []
+    coalescer = RequestCoalescer(make_run_batch(calls), max_batch_size=2, max_wait=10)
+    assert submit_all(coalescer, [1, 2, 3, 4]) == [10, 20, 30, 40]
+    assert calls == [[1, 2], [3, 4]]
+
+
+def test_one_failing_query_only_fails_its_caller():
+    calls = []
+    coalescer = RequestCoalescer(make_run_batch(calls), max_wait=0.01)
+    first, bad, last = submit_all(coalescer, [1, -1, 3])
+    assert (first, last) == (10, 30)
+    assert isinstance(bad, ValueError)
+    # the batch, then each query alone
+    assert calls[0] == [1, -1, 3]
+    assert sorted(calls[1:]) == [[-1], [1], [3]]
+
+
+@pytest.mark.parametrize("size", [1, 3])
+def test_fail_together_errors_reach_every_caller_once(size):
+    calls = []
+    coalescer = RequestCoalescer(
+        make_run_batch(calls, failure=Busy), max_wait=0.01, fail_together=(Busy,)
+    )
+    results = submit_all(coalescer, [-1] + list(range(1, size)))
+    assert all(isinstance(result, Busy) for result in results)
+    assert len(calls) == 1
@@ -0,0 +1,33 @@
+import faiss
+import numpy as np
+
+from facet_index import FacetIndex
+
+
+def test_selector_rejects_ids_past_the_mask():
+    mask = np.zeros(16, dtype=bool)
+    mask[[1, 5, 12]] = True
+    selector = FacetIndex.selector(mask)
+
+    members = [id for id in range(128) if selector.is_member(id)]
+    assert members == [1, 5, 12]
+
+
+def test_filtered_search_only_returns_masked_labels():
+    colors = (["red", "Red ", "blue"], np.array([0, 1, 2, -1, 0, 2], dtype=np.int32))
+    categories = (["Mini"], np.zeros(6, dtype=np.int32))
+    facets = FacetIndex(colors, categories)
+
+    mask, selector = facets.lookup(color_filter=["red"])
+    assert np.flatnonzero(mask).tolist() == [0, 1, 4]
+
+    # the index holds more vectors than the facets know about
+    rng = np.random.default_rng(0)
+    index = faiss.IndexIDMap2(faiss.IndexFlatL2(8))
+    index.add_with_ids(rng.standard_normal((64, 8)).astype(np.float32), np.arange(64))
+    _, labels = index.search(
+        rng.standard_normal((4, 8)).astype(np.float32),
+        10,
+        params=faiss.SearchParameters(sel=selector),
+    )
+    assert set(labels[labels >= 0].tolist()) == {0, 1, 4}
@@ -0,0 +1,28 @@
+import numpy as np
+
+from product_store import ProductStore
+
+
+def records(count, color):
+    return [
+        {"id": f"product_{i}", "title": f"Dress {i}", "color": color, "price": 100 + i}
+        for i in range(count)
+    ]
+
+
+def test_save_over_a_mapped_store_leaves_the_old_mapping_readable(tmp_path):
+    directory = str(tmp_path / "products")
+    ProductStore.from_records(records(1000, "red")).save(directory)
+    mapped = ProductStore.load(directory, mmap_mode="r")
+
+    # a smaller rebuild; truncating the mapped files would SIGBUS below
+    ProductStore.from_records(records(10, "blue")).save(directory)
+
+    assert len(mapped) == 1000
+    assert mapped.product_id(999) == "product_999"
+    assert mapped.gather(np.array([999]), ["color", "price"]) == [
+        {"color": "red", "price": 1099}
+    ]
+    assert len(ProductStore.load(directory, mmap_mode="r")) == 10
+    # the temporaries are renamed away, nothing hidden is left behind
+    assert not [path for path in (tmp_path / "products").iterdir() if path.name[0] == "."]
@@ -0,0 +1,265 @@
+import json
+
+import faiss
+import numpy as np
+import pytest
+
+from recommendation_engine import RecommendationEngine
+from user_store import MemoryUserStore, SQLiteUserStore
+
+DIMENSION = 16
+
+
+def write_catalog(directory, labels, vectors, factory="Flat", ids=True):
+    """
+    A labelled index and its processed_data.json, as reindex.py writes them
+    (or, without `ids`, one numbered by metadata row as build_index.py does)
+    """
+    index = faiss.index_factory(DIMENSION, factory)
+    if ids:
+        index = faiss.IndexIDMap2(index)
+    index.train(vectors)
+    if ids:
+        index.add_with_ids(vectors, np.asarray(labels, dtype=np.int64))
+    else:
+        index.add(vectors)
+    index_path = str(directory / "image_vectors.index")
+    faiss.write_index(index, index_path)
+
+    metadata = {
+        str(label): {
+            "id": f"product_{label}",
+            "title": f"Dress {label}",
+            "color": "red" if label % 2 else "blue",
+            "category": "Mini",
+            "image_href": f"https://example.com/{label}.jpg",
+        }
+        for label in labels
+    }
+    metadata_path = str(directory / "processed_data.json")
+    with open(metadata_path, "w") as file:
+        json.dump(metadata, file)
+    return index_path, metadata_path
+
+
+@pytest.fixture
+def vectors():
+    rng = np.random.default_rng(0)
+    return rng.standard_normal((60, DIMENSION)).astype(np.float32)
+
+
+def test_seen_items_survive_restart_on_rebuilt_catalog(tmp_path, vectors):
+    labels = list(range(60))
+    first = tmp_path / "first"
+    first.mkdir()
+    engine = RecommendationEngine(
+        *write_catalog(first, labels, vectors),
+        user_store=SQLiteUserStore(str(tmp_path / "users")),
+        cold_start=False,
+    )
+    liked = [f"product_{label}" for label in range(0, 30)]
+    for product_id in liked:
+        engine.record_user_interaction("user", product_id, "like")
+    engine.user_trackers.close()
+    engine.close()
+
+    # the rebuild drops one product and keeps every other label; the new
+    # process never saw the old catalog, so it has no translation for it
+    second = tmp_path / "second"
+    second.mkdir()
+    engine = RecommendationEngine(
+        *write_catalog(second, labels[:-1], vectors[:-1]),
+        user_store=SQLiteUserStore(str(tmp_path / "users")),
+        cold_start=False,
+    )
+    assert not engine.label_translations
+
+    # a swipe writes the tracker back under the new catalog
+    engine.record_user_interaction("user", "product_40", "dislike")
+    results = engine.get_recommendations("user", num_recommendations=10)
+    shown = {item["id"] for item in results}
+    assert len(results) == 10
+    assert not shown & set(liked + ["product_40"])
+    engine.user_trackers.close()
+    engine.close()
+
+
+def test_seen_rows_are_dropped_on_unknown_row_numbered_catalog(tmp_path, vectors):
+    first = tmp_path / "first"
+    first.mkdir()
+    engine = RecommendationEngine(
+        *write_catalog(first, range(60), vectors, ids=False),
+        user_store=SQLiteUserStore(str(tmp_path / "users")),
+        cold_start=False,
+    )
+    for label in range(30):
+        engine.record_user_interaction("user", f"product_{label}", "like")
+    engine.user_trackers.close()
+    engine.close()
+
+    # dropping the first product shifts every row down by one, so the old
+    # seen rows would now point at products 1..30
+    second = tmp_path / "second"
+    second.mkdir()
+    engine = RecommendationEngine(
+        *write_catalog(second, range(1, 60), vectors[1:], ids=False),
+        user_store=SQLiteUserStore(str(tmp_path / "users")),
+        cold_start=False,
+    )
+    tracker = engine._current(engine.user_trackers.get("user"))
+    assert not len(tracker.seen_labels())
+
+    results = engine.get_recommendations("user", num_recommendations=59)
+    assert len(results) == 59
+    engine.user_trackers.close()
+    engine.close()
+
+
+def test_evicted_user_does_not_get_cached_results(tmp_path, vectors):
+    engine = RecommendationEngine(
+        *write_catalog(tmp_path, range(60), vectors),
+        user_store=MemoryUserStore(max_users=1),
+        cold_start=False,
+        result_cache_bytes=1 << 20,
+    )
+    engine.record_user_interaction("user", "product_0", "like")
+    first = engine.get_recommendations("user", num_recommendations=59)
+    assert "product_5" in {item["id"] for item in first}
+
+    # another user evicts the first, whose next swipe starts a new tracker
+    # at the same version
+    engine.record_user_interaction("other", "product_1", "like")
+    engine.record_user_interaction("user", "product_5", "like")
+    results = engine.get_recommendations("user", num_recommendations=59)
+    assert "product_5" not in {item["id"] for item in results}
+    engine.close()
+
+
+def test_popularity_is_shared_and_survives_restart(tmp_path, vectors):
+    first = tmp_path / "first"
+    first.mkdir()
+    catalog = write_catalog(first, range(60), vectors, ids=False)
+    store = lambda: SQLiteUserStore(str(tmp_path / "users"))
+    worker = RecommendationEngine(*catalog, user_store=store(), cold_start=False)
+    other = RecommendationEngine(*catalog, user_store=store(), cold_start=False)
+    for user in ("a", "b", "c"):
+        worker.record_user_interaction(user, "product_3", "like")
+    other.record_user_interaction("d", "product_3", "like")
+    other.record_user_interaction("d", "product_4", "dislike")
+
+    # the other worker sees this one's likes once it re-reads the store
+    other._load_popularity()
+    assert other.popularity[3] == 4
+    assert other.popularity.sum() == 4
+
+    # a restart on a rebuild that renumbers the rows keeps the counts by
+    # product: product_3 is now row 2
+    second = tmp_path / "second"
+    second.mkdir()
+    rebuilt = write_catalog(second, range(1, 60), vectors[1:], ids=False)
+    restarted = RecommendationEngine(*rebuilt, user_store=store(), cold_start=False)
+    assert restarted.popularity[2] == 4
+    assert restarted.popularity.sum() == 4
+
+    # a reload in the same process does not count them twice
+    reloaded = RecommendationEngine(
+        *rebuilt, user_store=restarted.user_trackers, cold_start=False
+    )
+    reloaded.adopt(worker)
+    assert reloaded.popularity[2] == 4
+    assert reloaded.popularity.sum() == 4
+    for engine in (worker, other, restarted):
+        engine.user_trackers.close()
+        engine.close()
+
+
+def test_refined_search_reranks_compressed_codes_exactly(tmp_path):
+    vectors = clustered_vectors(2000)
+    labels = np.arange(2000, dtype=np.int64)
+    embeddings_path = str(tmp_path / "image_embeddings.npy")
+    np.save(embeddings_path, vectors)
+    np.save(str(tmp_path / "image_embeddings.ids.npy"), labels)
+    engine = RecommendationEngine(
+        *write_catalog(tmp_path, labels, vectors, factory="SQ4"),
+        embeddings_path=embeddings_path,
+        refine_factor=4,
+        cold_start=False,
+    )
+
+    queries = vectors[:20] + 0.1
+    distances, found = engine._search(queries, 10, None)
+    exact = ((vectors[None, :, :] - queries[:, None, :]) ** 2).sum(axis=2)
+    np.testing.assert_array_equal(found, np.argsort(exact, axis=1)[:, :10])
+    np.testing.assert_allclose(
+        distances, np.sort(exact, axis=1)[:, :10], rtol=1e-4, atol=1e-4
+    )
+    engine.close()
+
+
+def test_ef_search_reaches_hnsw_under_pca(tmp_path, vectors):
+    engine = RecommendationEngine(
+        *write_catalog(tmp_path, range(60), vectors, factory="PCA8,HNSW16"),
+        ef_search=77,
+        cold_start=False,
+    )
+    assert engine.ef_search == 77
+    assert engine._hnsw_index().hnsw.efSearch == 77
+    engine.close()
+
+
+def clustered_vectors(count, clusters=40, seed=1):
+    rng = np.random.default_rng(seed)
+    centers = 4 * rng.standard_normal((clusters, DIMENSION))
+    vectors = centers[rng.integers(clusters, size=count)]
+    return (vectors + rng.standard_normal((count, DIMENSION))).astype(np.float32)
+
+
+@pytest.mark.parametrize(
+    "factory, knobs",
+    [("IVF32,Flat", {"nprobe": 1}), ("HNSW8", {"ef_search": 4})],
+)
+def test_filtered_ann_search_is_not_cut_short(tmp_path, factory, knobs):
+    rng = np.random.default_rng(1)
+    vectors = rng.standard_normal((1200, DIMENSION)).astype(np.float32)
+    engine = RecommendationEngine(
+        *write_catalog(tmp_path, range(1200), vectors, factory=factory),
+        cold_start=False,
+        **knobs,
+    )
+    engine.record_user_interaction("user", "product_0", "like")
+    results = engine.get_recommendations(
+        "user", num_recommendations=40, color_filter=["red"]
+    )
+
+    red = np.arange(1, 1200, 2)
+    exact = red[np.argsort(((vectors[red] - vectors[0]) ** 2).sum(axis=1))[:40]]
+    assert [item["id"] for item in results] == [f"product_{label}" for label in exact]
+    engine.close()
+
+
+@pytest.mark.parametrize("color_filter", [None, ["red"]])
+@pytest.mark.parametrize(
+    "factory, knobs", [("IVF128,Flat", {"nprobe": 1}), ("HNSW8", {"ef_search": 4})]
+)
+def test_widened_ann_search_has_no_duplicates(tmp_path, factory, knobs, color_filter):
+    vectors = clustered_vectors(5000)
+    engine = RecommendationEngine(
+        *write_catalog(tmp_path, range(5000), vectors, factory=factory),
+        cold_start=False,
+        **knobs,
+    )
+    # swiping the nearest items makes every pass widen the search
+    nearest = np.argsort(((vectors - vectors[0]) ** 2).sum(axis=1))[:150]
+    for label in nearest:
+        engine.record_user_interaction("user", f"product_{label}", "like")
+
+    results = engine.get_recommendations(
+        "user", num_recommendations=40, color_filter=color_filter
+    )
+    shown = [item["id"] for item in results]
+    assert len(shown) == 40
+    assert len(set(shown)) == 40
+    assert not set(shown) & {f"product_{label}" for label in nearest}
+    if color_filter:
+        assert all(item["color"] == "red" for item in results)
+    engine.close()
@@ -0,0 +1,43 @@
+import tracemalloc
+
+import numpy as np
+
+from result_cache import ResultCache
+
+
+def cache_key(user):
+    return (f"user_{user}", "0123456789abcdef", 3, (frozenset(["red"]), frozenset()), 10)
+
+
+def test_accounted_bytes_cover_what_entries_allocate():
+    cache = ResultCache(2**40)
+    tracemalloc.start()
+    try:
+        for user in range(5000):
+            cache.put(
+                cache_key(user),
+                np.arange(10, dtype=np.int64),
+                np.ones(10, dtype=np.float32),
+            )
+        allocated, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert cache.bytes >= allocated
+
+
+def test_eviction_keeps_the_bound_and_drops_the_oldest():
+    rows, scores = np.arange(10, dtype=np.int64), np.ones(10, dtype=np.float32)
+    cache = ResultCache(10**9)
+    cache.put(cache_key(0), rows, scores)
+    entry_bytes = cache.bytes
+
+    cache = ResultCache(3 * entry_bytes)
+    for user in range(5):
+        cache.put(cache_key(user), rows, scores)
+    assert cache.bytes <= cache.max_bytes
+    assert len(cache) == 3
+    assert cache.get(cache_key(0)) is None
+    assert cache.get(cache_key(4)) is not None
+
+    cache.put(cache_key(4), rows, scores)
+    assert cache.bytes == 3 * entry_bytes
@@ -0,0 +1,130 @@
+import threading
+
+import numpy as np
+import pytest
+
+import user_store
+from recommendation_engine import UserInteractionTracker
+from user_store import MemoryUserStore, SQLiteUserStore, decode_state, encode_state
+
+DIMENSION = 8
+
+
+def swiped_tracker(count, seed=0):
+    rng = np.random.default_rng(seed)
+    tracker = UserInteractionTracker(DIMENSION, half_life=3600.0, max_centroids=2)
+    for label in range(count):
+        reaction = "like" if label % 3 else "dislike"
+        embedding = rng.standard_normal(DIMENSION).astype(np.float32)
+        tracker.add_interaction(
+            label * 7, embedding, reaction, timestamp=1000.0 + label
+        )
+    tracker.catalog = "0123456789abcdef"
+    return tracker
+
+
+def swipe(label):
+    def apply(tracker):
+        tracker.add_interaction(label, np.ones(DIMENSION, dtype=np.float32), "like")
+
+    return apply
+
+
+def new_tracker():
+    return UserInteractionTracker(DIMENSION)
+
+
+def test_state_round_trips_through_bytes():
+    state = swiped_tracker(20).to_state()
+    decoded = decode_state(encode_state(state))
+
+    assert decoded.keys() == state.keys()
+    for name, value in state.items():
+        if isinstance(value, np.ndarray):
+            assert decoded[name].dtype == value.dtype
+            np.testing.assert_array_equal(decoded[name], value)
+        else:
+            assert decoded[name] == value
+
+    tracker = UserInteractionTracker.from_state(decoded)
+    np.testing.assert_array_equal(tracker.seen_labels(), np.arange(20) * 7)
+    np.testing.assert_allclose(
+        tracker.compute_preference_vector(),
+        swiped_tracker(20).compute_preference_vector(),
+    )
+
+
+def test_memory_store_evicts_least_recently_used_past_max_users():
+    store = MemoryUserStore(max_users=2)
+    store.tracker_from_state = UserInteractionTracker.from_state
+    for user in ("a", "b"):
+        store.update(user, swipe(1), new_tracker)
+    store.get("a")
+    store.update("c", swipe(1), new_tracker)
+
+    assert len(store) == 2
+    assert "a" in store and "c" in store
+    assert store.get("b") is None
+
+
+def test_memory_store_evicts_idle_users(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(user_store.time, "monotonic", lambda: now[0])
+    store = MemoryUserStore(max_idle=60)
+    store.tracker_from_state = UserInteractionTracker.from_state
+    store.update("idle", swipe(1), new_tracker)
+    now[0] += 30
+    store.update("active", swipe(1), new_tracker)
+    now[0] += 40
+    store.update("new", swipe(1), new_tracker)
+
+    assert store.get("idle") is None
+    assert store.get("active") is not None
+    assert len(store) == 2
+
+
+def test_evicted_users_reload_from_sqlite(tmp_path):
+    store = SQLiteUserStore(str(tmp_path), shards=2, max_users=1)
+    store.tracker_from_state = UserInteractionTracker.from_state
+    store.update("a", swipe(3), new_tracker)
+    store.update("b", swipe(4), new_tracker)
+
+    tracker = store.get("a")
+    assert tracker.version == 1
+    np.testing.assert_array_equal(tracker.seen_labels(), [3])
+    store.close()
+
+
+@pytest.mark.parametrize("shards", [1, 4])
+def test_two_stores_do_not_lose_each_others_swipes(tmp_path, shards):
+    stores = [SQLiteUserStore(str(tmp_path), shards=shards) for _ in range(2)]
+    for store in stores:
+        store.tracker_from_state = UserInteractionTracker.from_state
+
+    swipes = 50
+    start = threading.Barrier(4)
+
+    def run(store, offset):
+        start.wait()
+        for label in range(offset, 4 * swipes, 4):
+            store.update("user", swipe(label), new_tracker)
+            store.add_like(f"product_{label % 3}")
+
+    threads = [
+        threading.Thread(target=run, args=(store, offset))
+        for offset, store in enumerate(stores * 2)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for store in stores:
+        tracker = store.get("user")
+        assert tracker.version == 4 * swipes
+        assert tracker.liked_weight == 4 * swipes
+        np.testing.assert_array_equal(tracker.seen_labels(), np.arange(4 * swipes))
+        counts = store.like_counts()
+        assert sum(counts.values()) == 4 * swipes
+        assert set(counts) == {"product_0", "product_1", "product_2"}
+        store.close()
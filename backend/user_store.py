@@ -0,0 +1,271 @@
+"""
+Where user trackers live between requests
+
+MemoryUserStore keeps them in an LRU tier bounded by count and idle time.
+SQLiteUserStore adds write-through persistence to hash-sharded SQLite files
+in WAL mode, so state survives restarts and is shared by every uvicorn
+worker pointed at the same directory. Only compact aggregates are stored per
+user (tracker.to_state()), never the embeddings behind them. Stores also
+keep the like count per product id that ranks the cold-start pools, so the
+counts survive restarts and reloads and are shared like the trackers.
+
+Trackers handed out by a store are never mutated afterwards: update() applies
+a change to a copy and publishes the copy, so readers on other threads can
+use what they got without locking.
+"""
+
+import collections
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+import numpy as np
+
+
+def encode_state(state):
+    """
+    Pack a tracker state into bytes: a JSON header for the scalars and array
+    layout, followed by the raw array buffers
+    """
+    header = {"fields": {}, "arrays": []}
+    buffers = []
+    for name, value in state.items():
+        if isinstance(value, np.ndarray):
+            header["arrays"].append((name, value.dtype.str, value.shape))
+            buffers.append(np.ascontiguousarray(value).tobytes())
+        else:
+            header["fields"][name] = value
+
+    header = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    return len(header).to_bytes(4, "little") + header + b"".join(buffers)
+
+
+def decode_state(blob):
+    blob = memoryview(blob)
+    size = int.from_bytes(blob[:4], "little")
+    header = json.loads(bytes(blob[4 : 4 + size]))
+
+    state = dict(header["fields"])
+    offset = 4 + size
+    for name, dtype, shape in header["arrays"]:
+        dtype = np.dtype(dtype)
+        count = int(np.prod(shape))
+        state[name] = (
+            np.frombuffer(blob, dtype=dtype, count=count, offset=offset)
+            .reshape(shape)
+            .copy()
+        )
+        offset += count * dtype.itemsize
+    return state
+
+
+class MemoryUserStore:
+    """
+    In-process LRU of trackers. Past `max_users`, or once a user has been idle
+    for `max_idle` seconds, the least recently used trackers are dropped; here
+    that forgets them, persistent subclasses reload them on the next access.
+
+    `tracker_from_state` rebuilds a tracker from tracker.to_state(); the
+    engine that owns the store sets it.
+    """
+
+    def __init__(self, max_users=100000, max_idle=None):
+        self.max_users = max_users
+        self.max_idle = max_idle
+        self.tracker_from_state = None
+
+        self._trackers = collections.OrderedDict()  # user_id -> (tracker, last used)
+        self._likes = collections.Counter()  # product_id -> likes
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._trackers)
+
+    def __contains__(self, user_id):
+        return self.get(user_id) is not None
+
+    def _cached(self, user_id):
+        with self._lock:
+            entry = self._trackers.get(user_id)
+            if entry is None:
+                return None
+            self._trackers[user_id] = (entry[0], time.monotonic())
+            self._trackers.move_to_end(user_id)
+            return entry[0]
+
+    def _cache(self, user_id, tracker):
+        now = time.monotonic()
+        with self._lock:
+            self._trackers[user_id] = (tracker, now)
+            self._trackers.move_to_end(user_id)
+
+            # oldest access sits at the front, so eviction stops at the first
+            # entry that is neither over the count nor idle
+            while self._trackers:
+                oldest_id, (_, last_used) = next(iter(self._trackers.items()))
+                idle = self.max_idle is not None and now - last_used > self.max_idle
+                if len(self._trackers) <= self.max_users and not idle:
+                    break
+                self._trackers.popitem(last=False)
+
+    def get(self, user_id, default=None):
+        tracker = self._cached(user_id)
+        return default if tracker is None else tracker
+
+    def _copy(self, tracker):
+        return self.tracker_from_state(tracker.to_state())
+
+    def update(self, user_id, apply, create):
+        """
+        Apply `apply(tracker)` to the user's tracker, starting from `create()`
+        for unknown users, and publish the result
+        """
+        with self._lock:
+            current = self._cached(user_id)
+            tracker = create() if current is None else self._copy(current)
+            apply(tracker)
+            self._cache(user_id, tracker)
+            return tracker
+
+    def add_like(self, product_id):
+        with self._lock:
+            self._likes[product_id] += 1
+
+    def like_counts(self):
+        """
+        product_id -> likes, over every user and every catalog so far
+        """
+        with self._lock:
+            return dict(self._likes)
+
+    def close(self):
+        pass
+
+
+class SQLiteUserStore(MemoryUserStore):
+    """
+    MemoryUserStore writing through to `shards` SQLite files under
+    `directory`. Users are assigned to shards by a stable hash of their id.
+
+    Updates are read-modify-write inside one IMMEDIATE transaction, so two
+    workers swiping for the same user do not lose each other's interactions.
+    Reads of a cached tracker check the stored version first, and reload it
+    if another worker has written since. Like counts are sharded by product
+    id the same way.
+    """
+
+    def __init__(self, directory, shards=8, max_users=100000, max_idle=None):
+        super().__init__(max_users=max_users, max_idle=max_idle)
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.shards = [
+            self._connect(os.path.join(directory, f"users-{shard:02d}.sqlite"))
+            for shard in range(shards)
+        ]
+        self._shard_locks = [threading.Lock() for _ in range(shards)]
+
+    @staticmethod
+    def _connect(path):
+        connection = sqlite3.connect(
+            path, timeout=30, isolation_level=None, check_same_thread=False
+        )
+        connection.execute("PRAGMA journal_mode=WAL")
+        # WAL with NORMAL only syncs at checkpoints; a crash can lose the
+        # last few swipes but never corrupts the file
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS users ("
+            "user_id TEXT PRIMARY KEY, version INTEGER NOT NULL, "
+            "updated_at REAL, state BLOB NOT NULL)"
+        )
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS likes ("
+            "product_id TEXT PRIMARY KEY, count INTEGER NOT NULL)"
+        )
+        return connection
+
+    def _shard(self, key):
+        # crc32 rather than hash(): it has to agree across processes
+        shard = zlib.crc32(key.encode("utf-8")) % len(self.shards)
+        return self.shards[shard], self._shard_locks[shard]
+
+    def _load(self, connection, user_id):
+        row = connection.execute(
+            "SELECT state FROM users WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        return self.tracker_from_state(decode_state(row[0]))
+
+    def __len__(self):
+        total = 0
+        for connection, lock in zip(self.shards, self._shard_locks):
+            with lock:
+                total += connection.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+        return total
+
+    def get(self, user_id, default=None):
+        connection, lock = self._shard(user_id)
+        cached = self._cached(user_id)
+
+        with lock:
+            row = connection.execute(
+                "SELECT version FROM users WHERE user_id = ?", (user_id,)
+            ).fetchone()
+            if row is None:
+                return default
+            if cached is not None and cached.version == row[0]:
+                return cached
+            tracker = self._load(connection, user_id)
+
+        self._cache(user_id, tracker)
+        return tracker
+
+    def update(self, user_id, apply, create):
+        connection, lock = self._shard(user_id)
+        with lock:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                tracker = self._load(connection, user_id) or create()
+                apply(tracker)
+                connection.execute(
+                    "INSERT OR REPLACE INTO users (user_id, version, updated_at, state) "
+                    "VALUES (?, ?, ?, ?)",
+                    (
+                        user_id,
+                        tracker.version,
+                        tracker.updated_at,
+                        encode_state(tracker.to_state()),
+                    ),
+                )
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+
+        self._cache(user_id, tracker)
+        return tracker
+
+    def add_like(self, product_id):
+        connection, lock = self._shard(product_id)
+        with lock:
+            connection.execute(
+                "INSERT INTO likes (product_id, count) VALUES (?, 1) "
+                "ON CONFLICT (product_id) DO UPDATE SET count = count + 1",
+                (product_id,),
+            )
+
+    def like_counts(self):
+        counts = {}
+        for connection, lock in zip(self.shards, self._shard_locks):
+            with lock:
+                counts.update(connection.execute("SELECT product_id, count FROM likes"))
+        return counts
+
+    def close(self):
+        for connection, lock in zip(self.shards, self._shard_locks):
+            with lock:
+                connection.close()
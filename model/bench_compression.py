@@ -0,0 +1,112 @@
+"""
+Memory, QPS and agreement with the float32 baseline for the compression modes
+
+    python bench_compression.py --embeddings image_embeddings.npy
+    python bench_compression.py --synthetic 200000 --k 20 --refine 2 4 8
+
+Each compressed index is searched alone and through the backend's two-stage
+search (recommendation_engine.refined_search, used for refine_factor): refine
+* k candidates from the codes, re-ranked by exact L2 against the float32
+embeddings. The memory column is what the index
+keeps resident, per million items; the embeddings used by the re-rank stay
+memory-mapped and only the candidates' rows are read. Agreement is recall@k
+against an exact flat search, and how often the top result is the same.
+"""
+
+import argparse
+import os
+import sys
+
+import faiss
+import numpy as np
+
+from bench_index import measure, recall_at_k, synthetic_embeddings
+from build_index import build_index, index_description, index_memory_bytes, load_embeddings
+
+# the refined rows time the search the backend serves with, not a copy of it;
+# appended, so nothing in this directory is shadowed
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(HERE, "..", "backend"))
+from recommendation_engine import refined_search
+
+# build options per mode; every one is also run with each refine factor
+MODES = [
+    {"index_type": "flat"},
+    {"index_type": "flat", "compression": "fp16"},
+    {"index_type": "flat", "compression": "sq8"},
+    {"index_type": "flat", "compression": "binary"},
+    {"index_type": "flat", "pca_dim": 128},
+    {"index_type": "flat", "pca_dim": 128, "compression": "sq8"},
+    {"index_type": "flat", "pca_dim": 64, "compression": "sq8"},
+    {"index_type": "ivf-flat", "compression": "sq8"},
+]
+
+
+class Refined:
+    # lets measure() time the two-stage search like a plain index
+    def __init__(self, index, embeddings, factor):
+        self.index = index
+        self.embeddings = embeddings
+        self.factor = factor
+
+    def search(self, queries, k):
+        return refined_search(self.index, queries, k, self.factor, self.embeddings)
+
+
+def top1_agreement(found, truth):
+    return float(np.mean(found[:, 0] == truth[:, 0]))
+
+
+def run(embeddings, num_queries, k, refine_factors, single_query, seed):
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    rng = np.random.default_rng(seed)
+    queries = embeddings[rng.choice(len(embeddings), num_queries, replace=False)]
+    # perturb so a query is not trivially its own nearest neighbour
+    queries = queries + 0.05 * rng.standard_normal(queries.shape).astype(np.float32)
+
+    flat = faiss.IndexFlatL2(embeddings.shape[1])
+    flat.add(embeddings)
+    truth = flat.search(queries, k)[1]
+
+    print(
+        f"{len(embeddings)} vectors of {embeddings.shape[1]} dims, {num_queries} queries, "
+        f"k={k}, {'single-query' if single_query else 'batched'} search"
+    )
+    print(
+        f"{'index':>24} {'refine':>6} {'MiB/1M':>8} {'recall':>7} {'top-1':>6} {'QPS':>9}"
+    )
+    for options in MODES:
+        index = build_index(embeddings, seed=seed, **options)
+        per_million = index_memory_bytes(index) / index.ntotal * 1e6 / 2**20
+        label = index_description(options)
+
+        searches = [(None, index)] + [
+            (factor, Refined(index, embeddings, factor)) for factor in refine_factors
+        ]
+        for factor, searcher in searches:
+            found, qps = measure(searcher, queries, k, single_query)
+            print(
+                f"{label:>24} {factor or '-':>6} {per_million:>8.1f} "
+                f"{recall_at_k(found, truth):>7.3f} {top1_agreement(found, truth):>6.3f} "
+                f"{qps:>9.0f}"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--embeddings")
+    source.add_argument("--synthetic", type=int)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--k", type=int, default=20)
+    parser.add_argument("--refine", type=int, nargs="*", default=[2, 4, 8])
+    parser.add_argument("--single-query", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.embeddings:
+        embeddings = load_embeddings(args.embeddings, mmap=False)[0]
+    else:
+        embeddings = synthetic_embeddings(args.synthetic, seed=args.seed)
+
+    run(embeddings, args.queries, args.k, args.refine, args.single_query, args.seed)
@@ -0,0 +1,92 @@
+"""
+Load time and peak RSS of the JSON embeddings vs the binary .npy format
+
+    python bench_embeddings_io.py --num 50000
+
+Each load runs in a fresh interpreter so peak RSS is not polluted by the
+others, and is reported above an interpreter that only imported the loader.
+"npy (mmap)" touches every vector so it is compared on equal terms; its pages
+are file-backed and shared, unlike the others.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
+
+from build_index import save_embeddings
+
+LOADERS = {
+    "json": "embeddings, _ = load_embeddings(PATH)",
+    "npy": "embeddings, _ = load_embeddings(PATH, mmap=False)",
+    "npy (mmap)": "embeddings, _ = load_embeddings(PATH); embeddings.sum()",
+}
+
+# VmHWM rather than ru_maxrss: the latter can carry the parent's peak over
+PROBE = """
+import sys, time
+sys.path.insert(0, HERE)
+from build_index import load_embeddings
+start = time.perf_counter()
+{loader}
+elapsed = time.perf_counter() - start
+with open("/proc/self/status") as f:
+    peak = next(line.split()[1] for line in f if line.startswith("VmHWM"))
+print(elapsed, peak)
+"""
+
+
+def write_json(path, embeddings):
+    # the shape model.py used to write: metadata plus a float list per product
+    entries = [
+        {"faiss-id": i, "id": f"product_{i + 1}", "embedding": vector.tolist()}
+        for i, vector in enumerate(embeddings)
+    ]
+    with open(path, "w") as f:
+        json.dump(entries, f)
+
+
+def measure(loader, path):
+    code = PROBE.format(loader=loader.replace("PATH", repr(path))).replace(
+        "HERE", repr(os.path.dirname(os.path.abspath(__file__)))
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", code], check=True, capture_output=True, text=True
+    ).stdout.split()
+    return float(output[0]), int(output[1]) / 1024
+
+
+def run(num, dimension):
+    rng = np.random.default_rng(0)
+    embeddings = rng.standard_normal((num, dimension), dtype=np.float32)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = {
+            "json": os.path.join(tmp, "image_embeddings.json"),
+            "npy": os.path.join(tmp, "image_embeddings.npy"),
+        }
+        write_json(paths["json"], embeddings)
+        save_embeddings(paths["npy"], embeddings, np.arange(1, num + 1))
+
+        baseline = measure("", paths["npy"])[1]
+
+        print(f"{num} x {dimension} float32 embeddings")
+        print(f"{'format':>12} {'file MiB':>9} {'load s':>8} {'peak RSS MiB':>13}")
+        for name, loader in LOADERS.items():
+            path = paths["json" if name == "json" else "npy"]
+            seconds, peak = measure(loader, path)
+            size = os.path.getsize(path) / 2**20
+            print(f"{name:>12} {size:>9.1f} {seconds:>8.3f} {peak - baseline:>13.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num", type=int, default=50000)
+    parser.add_argument("--dimension", type=int, default=384)
+    args = parser.parse_args()
+
+    run(args.num, args.dimension)
@@ -0,0 +1,117 @@
+"""
+Recall@k against the flat index, QPS and memory for a sweep of ANN settings
+
+    python bench_index.py --embeddings image_embeddings.npy
+    python bench_index.py --synthetic 200000 --k 10 --queries 1000
+"""
+
+import argparse
+import time
+
+import faiss
+import numpy as np
+
+from build_index import build_index, index_memory_bytes, load_embeddings
+
+# (label, build options, search knobs to sweep)
+SWEEP = [
+    ("flat", {"index_type": "flat"}, [{}]),
+    (
+        "ivf-flat",
+        {"index_type": "ivf-flat"},
+        [{"nprobe": n} for n in (1, 4, 16, 64)],
+    ),
+    (
+        "ivf-pq m=48",
+        {"index_type": "ivf-pq", "pq_m": 48},
+        [{"nprobe": n} for n in (4, 16, 64)],
+    ),
+    (
+        "hnsw M=32",
+        {"index_type": "hnsw", "hnsw_m": 32},
+        [{"ef_search": ef} for ef in (16, 64, 256)],
+    ),
+]
+
+
+def synthetic_embeddings(num_vectors, dimension=384, seed=0):
+    # clustered rather than uniform noise, closer to how image embeddings sit
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((max(1, num_vectors // 100), dimension))
+    assignment = rng.integers(len(centers), size=num_vectors)
+    noise = 0.3 * rng.standard_normal((num_vectors, dimension))
+    return np.ascontiguousarray(centers[assignment] + noise, dtype=np.float32)
+
+
+def apply_knobs(index, nprobe=None, ef_search=None):
+    if nprobe is not None:
+        faiss.extract_index_ivf(index).nprobe = nprobe
+    if ef_search is not None:
+        faiss.downcast_index(index).hnsw.efSearch = ef_search
+
+
+def recall_at_k(found, truth):
+    k = truth.shape[1]
+    hits = sum(len(np.intersect1d(f[f >= 0], t)) for f, t in zip(found, truth))
+    return hits / (len(truth) * k)
+
+
+def measure(index, queries, k, single_query):
+    start = time.perf_counter()
+    if single_query:
+        found = np.vstack([index.search(q[None, :], k)[1] for q in queries])
+    else:
+        found = index.search(queries, k)[1]
+    return found, len(queries) / (time.perf_counter() - start)
+
+
+def run(embeddings, num_queries, k, single_query, seed):
+    rng = np.random.default_rng(seed)
+    queries = embeddings[rng.choice(len(embeddings), num_queries, replace=False)]
+    # perturb so a query is not trivially its own nearest neighbour
+    queries = queries + 0.05 * rng.standard_normal(queries.shape).astype(np.float32)
+
+    flat = faiss.IndexFlatL2(embeddings.shape[1])
+    flat.add(embeddings)
+    truth = flat.search(queries, k)[1]
+
+    print(
+        f"{len(embeddings)} vectors, {num_queries} queries, k={k}, "
+        f"{'single-query' if single_query else 'batched'} search"
+    )
+    print(
+        f"{'index':>14} {'knobs':>14} {'build s':>8} {'recall':>7} {'QPS':>9} {'MiB':>8}"
+    )
+    for label, options, knob_sweep in SWEEP:
+        start = time.perf_counter()
+        index = build_index(embeddings, seed=seed, **options)
+        build_seconds = time.perf_counter() - start
+        memory = index_memory_bytes(index) / 2**20
+
+        for knobs in knob_sweep:
+            apply_knobs(index, **knobs)
+            found, qps = measure(index, queries, k, single_query)
+            knob_text = ",".join(f"{name}={value}" for name, value in knobs.items())
+            print(
+                f"{label:>14} {knob_text or '-':>14} {build_seconds:>8.1f} "
+                f"{recall_at_k(found, truth):>7.3f} {qps:>9.0f} {memory:>8.1f}"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--embeddings")
+    source.add_argument("--synthetic", type=int)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--single-query", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.embeddings:
+        embeddings = load_embeddings(args.embeddings)[0]
+    else:
+        embeddings = synthetic_embeddings(args.synthetic, seed=args.seed)
+
+    run(embeddings, args.queries, args.k, args.single_query, args.seed)
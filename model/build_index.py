@@ -0,0 +1,319 @@
+"""
+Build the FAISS index the backend serves from the embeddings written by model.py
+
+    python build_index.py image_embeddings.npy image_vectors.index --type flat
+    python build_index.py image_embeddings.npy image_vectors.index --type ivf-flat --nlist 1024 --nprobe 16
+    python build_index.py image_embeddings.npy image_vectors.index --type ivf-pq --nlist 1024 --pq-m 48
+    python build_index.py image_embeddings.npy image_vectors.index --type hnsw --hnsw-m 32 --ef-search 64
+    python build_index.py image_embeddings.npy image_vectors.index --pca-dim 128 --compression sq8
+
+An optional compression stage shrinks what the index scans: PCA down to
+--pca-dim (queries are projected by the index itself), and/or codes instead
+of float32 vectors: sq8 (1 byte per dimension), fp16 (2) or binary (1 bit,
+sign of the centred value). The backend then scans the codes and re-ranks the
+best candidates exactly against the float32 embeddings (refine_factor).
+
+Embeddings are a float32 .npy matrix with an aligned int64 label array next to
+it (image_embeddings.ids.npy); the older image_embeddings.json is still read.
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import faiss
+import numpy as np
+
+INDEX_TYPES = ("flat", "ivf-flat", "ivf-pq", "hnsw")
+COMPRESSION = ("sq8", "fp16", "binary")
+
+SCALAR_QUANTIZERS = {
+    "sq8": faiss.ScalarQuantizer.QT_8bit,
+    "fp16": faiss.ScalarQuantizer.QT_fp16,
+}
+
+
+def ids_path(path):
+    return os.path.splitext(path)[0] + ".ids.npy"
+
+
+def replace_atomically(path, write):
+    """
+    Call write(temporary_path) and rename the result over `path`. A running
+    backend memory-maps these files; truncating them in place would crash it
+    with SIGBUS, a rename leaves it on the old inode until it reloads.
+    """
+    directory, name = os.path.split(os.path.abspath(path))
+    fd, temporary = tempfile.mkstemp(
+        dir=directory, prefix=f".{name}.", suffix=os.path.splitext(name)[1]
+    )
+    os.close(fd)
+    try:
+        write(temporary)
+        os.replace(temporary, path)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.unlink(temporary)
+        raise
+
+
+def save_index(index, path):
+    replace_atomically(path, lambda temporary: faiss.write_index(index, temporary))
+
+
+def save_embeddings(path, embeddings, ids):
+    """
+    Write embeddings as float32 .npy plus the aligned FAISS labels
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    ids = np.asarray(ids, dtype=np.int64)
+    if len(ids) != len(embeddings):
+        raise ValueError(f"{len(ids)} ids for {len(embeddings)} embeddings")
+    replace_atomically(path, lambda temporary: np.save(temporary, embeddings))
+    replace_atomically(ids_path(path), lambda temporary: np.save(temporary, ids))
+
+
+def load_embeddings(path, mmap=True):
+    """
+    (embeddings, ids) from a .npy written by save_embeddings, memory-mapped
+    so nothing is copied until FAISS reads it; ids is None for the legacy
+    JSON format, whose rows are the FAISS ids
+    """
+    if path.endswith(".npy"):
+        mmap_mode = "r" if mmap else None
+        embeddings = np.load(path, mmap_mode=mmap_mode)
+        ids = np.load(ids_path(path), mmap_mode=mmap_mode)
+        return embeddings, ids
+
+    with open(path, "r") as f:
+        entries = json.load(f)
+    if isinstance(entries, dict):
+        entries = entries.values()
+    embeddings = np.ascontiguousarray(
+        [entry["embedding"] for entry in entries], dtype=np.float32
+    )
+    return embeddings, None
+
+
+def default_nlist(num_vectors):
+    # the usual sqrt rule, kept small enough that every list gets trained
+    return max(1, min(int(4 * np.sqrt(num_vectors)), num_vectors // 39))
+
+
+def build_index(
+    embeddings,
+    index_type="flat",
+    nlist=None,
+    pq_m=48,
+    pq_nbits=8,
+    hnsw_m=32,
+    ef_construction=40,
+    nprobe=None,
+    ef_search=None,
+    train_size=None,
+    seed=0,
+    ids=None,
+    pca_dim=None,
+    compression=None,
+    binary_bits=None,
+):
+    """
+    Build an index over `embeddings`. With `ids`, FAISS labels are those ids
+    (stable product ids) instead of row numbers, and flat/IVF indexes support
+    remove_ids for incremental updates.
+
+    pca_dim: project to this many dimensions first (an IndexPreTransform, so
+    callers keep searching with full vectors). compression: store sq8/fp16
+    codes (flat, ivf-flat or hnsw) or binary codes of `binary_bits` bits
+    (flat only) instead of float32 vectors.
+    """
+    num_vectors, dimension = embeddings.shape
+    if compression is not None and compression not in COMPRESSION:
+        raise ValueError(f"Unknown compression {compression}, expected one of {COMPRESSION}")
+    if compression == "binary" and index_type != "flat":
+        raise ValueError("binary codes are only supported with a flat index")
+    if compression is not None and index_type == "ivf-pq":
+        raise ValueError("ivf-pq already stores compressed codes")
+
+    coded = pca_dim or dimension
+    if pca_dim is not None and not 0 < pca_dim <= dimension:
+        raise ValueError(f"pca_dim={pca_dim} must be within 1..{dimension}")
+    quantizer_type = SCALAR_QUANTIZERS.get(compression)
+
+    if index_type == "flat":
+        if compression == "binary":
+            bits = binary_bits or coded
+            # thresholds are trained per dimension, so each bit splits the
+            # catalog in half; a random rotation spreads other bit counts
+            index = faiss.IndexLSH(coded, bits, bits != coded, True)
+        elif quantizer_type is not None:
+            index = faiss.IndexScalarQuantizer(coded, quantizer_type, faiss.METRIC_L2)
+        else:
+            index = faiss.IndexFlatL2(coded)
+
+    elif index_type in ("ivf-flat", "ivf-pq"):
+        nlist = nlist or default_nlist(num_vectors)
+        quantizer = faiss.IndexFlatL2(coded)
+        if index_type == "ivf-flat" and quantizer_type is not None:
+            index = faiss.IndexIVFScalarQuantizer(
+                quantizer, coded, nlist, quantizer_type, faiss.METRIC_L2
+            )
+        elif index_type == "ivf-flat":
+            index = faiss.IndexIVFFlat(quantizer, coded, nlist)
+        else:
+            if coded % pq_m:
+                raise ValueError(f"pq_m={pq_m} must divide the dimension {coded}")
+            index = faiss.IndexIVFPQ(quantizer, coded, nlist, pq_m, pq_nbits)
+        index.nprobe = nprobe or min(nlist, 8)
+
+    elif index_type == "hnsw":
+        if quantizer_type is not None:
+            index = faiss.IndexHNSWSQ(coded, quantizer_type, hnsw_m)
+        else:
+            index = faiss.IndexHNSWFlat(coded, hnsw_m)
+        index.hnsw.efConstruction = ef_construction
+        if ef_search is not None:
+            index.hnsw.efSearch = ef_search
+
+    else:
+        raise ValueError(
+            f"Unknown index type {index_type}, expected one of {INDEX_TYPES}"
+        )
+
+    is_ivf = index_type in ("ivf-flat", "ivf-pq")
+    if pca_dim is not None:
+        index = faiss.IndexPreTransform(faiss.PCAMatrix(dimension, pca_dim), index)
+
+    if not index.is_trained:
+        # training on a sample is plenty for k-means, PCA and quantizer
+        # ranges, and much faster
+        default_size = 256 * nlist if is_ivf else 65536
+        train_size = min(num_vectors, train_size or default_size)
+        rng = np.random.default_rng(seed)
+        sample = embeddings[rng.choice(num_vectors, train_size, replace=False)]
+        index.train(np.ascontiguousarray(sample, dtype=np.float32))
+
+    if ids is None:
+        index.add(embeddings)
+        # the backend reconstructs liked/disliked vectors by row
+        if is_ivf:
+            faiss.extract_index_ivf(index).make_direct_map()
+        return index
+
+    ids = np.ascontiguousarray(ids, dtype=np.int64)
+    if is_ivf:
+        # IVF stores ids natively; a hashtable direct map keeps reconstruct()
+        # and remove_ids() working for arbitrary ids
+        faiss.extract_index_ivf(index).set_direct_map_type(faiss.DirectMap.Hashtable)
+    else:
+        index = faiss.IndexIDMap2(index)
+    index.add_with_ids(embeddings, ids)
+    return index
+
+
+def index_ids(index):
+    """
+    Labels held by an index built with `ids`, or None for a row-numbered one
+    """
+    if isinstance(index, faiss.IndexIDMap2):
+        return faiss.vector_to_array(index.id_map)
+
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None and ivf.direct_map.type == faiss.DirectMap.Hashtable:
+        invlists = ivf.invlists
+        return np.concatenate(
+            [
+                faiss.rev_swig_ptr(invlists.get_ids(i), invlists.list_size(i)).copy()
+                for i in range(invlists.nlist)
+            ]
+            + [np.empty(0, dtype=np.int64)]
+        )
+    return None
+
+
+def supports_remove(index):
+    # HNSW graphs cannot drop nodes, so those are rebuilt instead
+    if isinstance(index, faiss.IndexIDMap2):
+        inner = faiss.downcast_index(index.index)
+        if isinstance(inner, faiss.IndexPreTransform):
+            inner = faiss.downcast_index(inner.index)
+        return isinstance(inner, faiss.IndexFlatCodes)
+    ivf = faiss.try_extract_index_ivf(index)
+    return ivf is not None and ivf.direct_map.type == faiss.DirectMap.Hashtable
+
+
+def index_description(options):
+    """
+    e.g. "flat" or "ivf-flat+pca128+sq8"; an index can only be patched in
+    place by a build with the same description
+    """
+    parts = [options["index_type"]]
+    if options.get("pca_dim"):
+        parts.append(f"pca{options['pca_dim']}")
+    if options.get("compression"):
+        parts.append(options["compression"])
+        if options["compression"] == "binary" and options.get("binary_bits"):
+            parts[-1] += str(options["binary_bits"])
+    return "+".join(parts)
+
+
+def index_memory_bytes(index):
+    return int(faiss.serialize_index(index).nbytes)
+
+
+def add_index_arguments(parser):
+    parser.add_argument(
+        "--type", dest="index_type", choices=INDEX_TYPES, default="flat"
+    )
+    parser.add_argument("--nlist", type=int, default=None)
+    parser.add_argument("--nprobe", type=int, default=None)
+    parser.add_argument("--pq-m", type=int, default=48)
+    parser.add_argument("--pq-nbits", type=int, default=8)
+    parser.add_argument("--hnsw-m", type=int, default=32)
+    parser.add_argument("--ef-construction", type=int, default=40)
+    parser.add_argument("--ef-search", type=int, default=None)
+    parser.add_argument("--train-size", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--pca-dim", type=int, default=None)
+    parser.add_argument("--compression", choices=COMPRESSION, default=None)
+    parser.add_argument("--binary-bits", type=int, default=None)
+
+
+def index_options(args):
+    return {
+        "index_type": args.index_type,
+        "nlist": args.nlist,
+        "pq_m": args.pq_m,
+        "pq_nbits": args.pq_nbits,
+        "hnsw_m": args.hnsw_m,
+        "ef_construction": args.ef_construction,
+        "nprobe": args.nprobe,
+        "ef_search": args.ef_search,
+        "train_size": args.train_size,
+        "seed": args.seed,
+        "pca_dim": args.pca_dim,
+        "compression": args.compression,
+        "binary_bits": args.binary_bits,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("embeddings")
+    parser.add_argument("output")
+    add_index_arguments(parser)
+    args = parser.parse_args()
+
+    embeddings, ids = load_embeddings(args.embeddings)
+
+    start = time.perf_counter()
+    index = build_index(embeddings, ids=ids, **index_options(args))
+    elapsed = time.perf_counter() - start
+
+    save_index(index, args.output)
+    print(
+        f"Built {index_description(index_options(args))} index over {index.ntotal} vectors in {elapsed:.1f}s "
+        f"({index_memory_bytes(index) / 2**20:.1f} MiB) -> {args.output}"
+    )
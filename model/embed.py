@@ -0,0 +1,187 @@
+"""
+Streaming image embedding pipeline
+
+Images are downloaded concurrently over one pooled HTTP session, decoded and
+preprocessed in a worker pool, and fed to the model in mini-batches. Only a
+bounded window of images is in flight at any time, so the whole catalog is
+never held in memory.
+"""
+
+import io
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+import torch
+from PIL import Image
+from requests.adapters import HTTPAdapter
+from torchvision import transforms
+from urllib3.util.retry import Retry
+
+# identity of the model + preprocessing, used to key cached embeddings
+MODEL_ID = "facebookresearch/dino:main/dino_vits16@224"
+
+
+def load_dino(device="cpu"):
+    model = torch.hub.load("facebookresearch/dino:main", "dino_vits16")
+    model = model.to(device)
+    model.eval()
+
+    preprocess = transforms.Compose(
+        [
+            transforms.Resize((224, 224)),
+            transforms.ToTensor(),
+            transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
+        ]
+    )
+    return model, preprocess
+
+
+def make_session(pool_size, max_retries=3, backoff_factor=0.5):
+    # retries back off inside urllib3 instead of sleeping on the caller
+    retry = Retry(
+        total=max_retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=("GET",),
+    )
+    adapter = HTTPAdapter(
+        pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry
+    )
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def bounded_map(executor, fn, iterable, window):
+    """
+    Like executor.map, but lazy: at most `window` calls are in flight and
+    results come back in input order
+    """
+    pending = deque()
+    for item in iterable:
+        pending.append(executor.submit(fn, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+class ThroughputMeter:
+    def __init__(self, report_every=100, log=print):
+        self.report_every = report_every
+        self.log = log
+        self.started = time.perf_counter()
+        self.done = 0
+        self.failed = 0
+
+    def update(self, ok):
+        self.done += 1
+        if not ok:
+            self.failed += 1
+        if self.report_every and self.done % self.report_every == 0:
+            self.report()
+
+    @property
+    def rate(self):
+        elapsed = time.perf_counter() - self.started
+        return self.done / elapsed if elapsed > 0 else 0.0
+
+    def report(self):
+        self.log(
+            f"{self.done} images processed ({self.failed} failed), "
+            f"{self.rate:.1f} images/s"
+        )
+
+
+class EmbeddingPipeline:
+    def __init__(
+        self,
+        model,
+        preprocess,
+        device="cpu",
+        batch_size=32,
+        download_workers=16,
+        decode_workers=4,
+        timeout=10,
+        max_retries=3,
+        report_every=100,
+        session=None,
+        log=print,
+    ):
+        self.model = model
+        self.preprocess = preprocess
+        self.device = device
+        self.batch_size = batch_size
+        self.download_workers = download_workers
+        self.decode_workers = decode_workers
+        self.timeout = timeout
+        self.report_every = report_every
+        self.log = log
+        self.session = session or make_session(download_workers, max_retries)
+
+    def _download(self, item):
+        key, url = item
+        try:
+            response = self.session.get(url, timeout=self.timeout)
+            response.raise_for_status()
+            return key, response.content
+        except Exception as e:
+            self.log(f"Download failed for {url}: {e}")
+            return key, None
+
+    def _decode(self, item):
+        key, payload = item
+        if payload is None:
+            return key, None
+        try:
+            image = Image.open(io.BytesIO(payload)).convert("RGB")
+            return key, self.preprocess(image)
+        except Exception as e:
+            self.log(f"Decode failed for {key}: {e}")
+            return key, None
+
+    def _run_batch(self, keys, tensors):
+        with torch.no_grad():
+            batch = torch.stack(tensors).to(self.device)
+            embeddings = self.model(batch).cpu().numpy()
+        return zip(keys, embeddings)
+
+    def embed(self, items):
+        """
+        Yield (key, embedding) for each (key, image_url) in `items`, in input
+        order; embedding is None when the image could not be fetched or decoded
+        """
+        window = max(self.batch_size, self.download_workers) * 2
+        meter = ThroughputMeter(self.report_every, self.log)
+
+        with ThreadPoolExecutor(self.download_workers) as downloads, ThreadPoolExecutor(
+            self.decode_workers
+        ) as decodes:
+            downloaded = bounded_map(downloads, self._download, items, window)
+            decoded = bounded_map(decodes, self._decode, downloaded, window)
+
+            # failures are held back with the batch so output order is kept
+            pending = []
+            keys, tensors = [], []
+            for key, tensor in decoded:
+                pending.append(key)
+                if tensor is not None:
+                    keys.append(key)
+                    tensors.append(tensor)
+                if len(tensors) >= self.batch_size:
+                    yield from self._flush(pending, keys, tensors, meter)
+                    pending, keys, tensors = [], [], []
+
+            yield from self._flush(pending, keys, tensors, meter)
+
+        meter.report()
+
+    def _flush(self, pending, keys, tensors, meter):
+        embedded = dict(self._run_batch(keys, tensors)) if tensors else {}
+        for key in pending:
+            embedding = embedded.get(key)
+            meter.update(embedding is not None)
+            yield key, embedding
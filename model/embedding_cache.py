@@ -0,0 +1,106 @@
+"""
+On-disk embedding cache keyed by image URL and model identity
+
+Vectors live in one memory-mapped float32 matrix (vectors.f32) that grows by
+doubling; keys.json maps each key to its row. A cache belongs to one model:
+opening it with a different model id or dimension starts it over.
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+
+class EmbeddingCache:
+    def __init__(self, directory, model_id, dimension=384):
+        self.directory = directory
+        self.model_id = model_id
+        self.dimension = dimension
+        self.keys_path = os.path.join(directory, "keys.json")
+        self.vectors_path = os.path.join(directory, "vectors.f32")
+        os.makedirs(directory, exist_ok=True)
+
+        keys = []
+        if os.path.exists(self.keys_path):
+            with open(self.keys_path, "r") as f:
+                header = json.load(f)
+            if header["model_id"] == model_id and header["dimension"] == dimension:
+                keys = header["keys"]
+
+        self.keys = keys
+        self._rows = {key: row for row, key in enumerate(keys)}
+        self._vectors = None
+        self._capacity = 0
+        if keys:
+            existing = os.path.getsize(self.vectors_path) // (4 * dimension)
+            self._open(max(len(keys), existing))
+        elif os.path.exists(self.vectors_path):
+            os.remove(self.vectors_path)
+
+    def key(self, url):
+        return hashlib.sha256(f"{self.model_id}\n{url}".encode("utf-8")).hexdigest()
+
+    def _open(self, capacity):
+        row_bytes = 4 * self.dimension
+        with open(self.vectors_path, "ab") as f:
+            if f.tell() < capacity * row_bytes:
+                f.truncate(capacity * row_bytes)
+        if self._vectors is not None:
+            self._vectors.flush()
+        self._vectors = np.memmap(
+            self.vectors_path,
+            dtype=np.float32,
+            mode="r+",
+            shape=(capacity, self.dimension),
+        )
+        self._capacity = capacity
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, url):
+        return self.key(url) in self._rows
+
+    def get(self, url):
+        row = self._rows.get(self.key(url))
+        return None if row is None else np.array(self._vectors[row])
+
+    def get_many(self, urls):
+        """
+        Stacked vectors for `urls`, all of which must be cached
+        """
+        rows = [self._rows[self.key(url)] for url in urls]
+        if not rows:
+            return np.empty((0, self.dimension), dtype=np.float32)
+        return np.asarray(self._vectors[rows], dtype=np.float32)
+
+    def put(self, url, vector):
+        key = self.key(url)
+        row = self._rows.get(key)
+        if row is None:
+            row = len(self.keys)
+            if row >= self._capacity:
+                self._open(max(1024, 2 * self._capacity))
+            self.keys.append(key)
+            self._rows[key] = row
+        self._vectors[row] = vector
+
+    def flush(self):
+        if self._vectors is not None:
+            self._vectors.flush()
+
+        # write the key index last and atomically, so a crash never leaves
+        # keys pointing at rows that were not written
+        tmp_path = self.keys_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(
+                {
+                    "model_id": self.model_id,
+                    "dimension": self.dimension,
+                    "keys": self.keys,
+                },
+                f,
+            )
+        os.replace(tmp_path, self.keys_path)
@@ -7,98 +7,97 @@ torch.cuda.is_available()
 
 import torch
 import json
-import time
-import requests
-from PIL import Image
-from torchvision import transforms
 import numpy as np
+from build_index import save_embeddings, save_index
+from embed import MODEL_ID, EmbeddingPipeline, load_dino
+from embedding_cache import EmbeddingCache
+from reindex import (
+    cached_galleries,
+    embed_missing,
+    image_vectors,
+    load_metadata,
+    pooled_vectors,
+    product_images,
+)
 
 # Check and select GPU if available
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 print(f"Using device: {device}")
 
 # Load input data
-input_file = r"/home/espacio/projects/cinder/scraper/data/womens_processed_data.json"
-with open(input_file, "r") as file:
-    image_metadata = json.load(file)
-
-# Load the ViT Dino model and move to GPU
-model = torch.hub.load('facebookresearch/dino:main', 'dino_vits16')
-model = model.to(device)
-model.eval()
-
-# Preprocessing transformations
-preprocess = transforms.Compose([
-    transforms.Resize((224, 224)),
-    transforms.ToTensor(),
-    transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
-])
-
-# Function to embed images with GPU support
-def get_image_embedding(image_url):
-    max_retries = 5
-    for attempt in range(max_retries):
-        try:
-            response = requests.get(image_url, stream=True, timeout=10)
-            image = Image.open(response.raw).convert('RGB')
-
-            # Preprocess and move to GPU
-            input_tensor = preprocess(image).unsqueeze(0).to(device)
-
-            with torch.no_grad():
-                embedding = model(input_tensor)
-
-            # Move embedding back to CPU and convert to numpy
-            return embedding.squeeze().cpu().numpy()
-
-        except Exception as e:
-            print(f"Attempt {attempt + 1} failed for {image_url}: {e}")
-            time.sleep(5)
-
-# Embed images and store metadata
+input_file = r"/home/espacio/projects/cinder/scraper/data/womens_processed_data.jsonl"
+image_metadata = load_metadata(input_file)
+
+# Load the ViT Dino model (on the GPU) and its preprocessing; embed.MODEL_ID
+# names this pair for the embedding cache
+model, preprocess = load_dino(device)
+
+# Concurrent downloads, parallel decoding and mini-batched inference
+pipeline = EmbeddingPipeline(
+    model,
+    preprocess,
+    device=device,
+    batch_size=32,
+    download_workers=16,
+    decode_workers=4,
+)
+
+# Every gallery image of every variant; only images that are new since the
+# last run get downloaded and embedded
+cache = EmbeddingCache("embedding_cache", MODEL_ID)
+images = product_images(image_metadata)
+failed = embed_missing(images, cache, pipeline)
+print(f"{len(failed)} products without any embedded image")
+
+# One pooled vector per variant ("mean" or "attention", see pooling.py), so
+# the index still has one entry per product
+pooling = "mean"
+galleries = cached_galleries(images, cache)
+pooled = pooled_vectors(list(galleries.values()), cache, pooling)
+
 image_embeddings = {}
-i = 0
-for k,v in image_metadata.items():
-    try:
-        embedding = get_image_embedding(v['image_href'])
-        image_embeddings[k] = {'faiss-id': i,'embedding': embedding, **v}
-        i+=1
-
-        if (i + 1) % 100 == 0:
-            print(f"{i+1} images embedded")
-
-    except Exception as e:
-        print(f"Failed to process image {v['image_href']}: {e}")
-
-# Optional: Save embeddings to a file
-output_file = "image_embeddings.json"
-with open(output_file, "w") as f:
-    # Convert numpy arrays to lists for JSON serialization
-    serializable_embeddings = [
-        {**entry, 'embedding': entry['embedding'].tolist()}
-        for entry in image_embeddings
-    ]
-    json.dump(serializable_embeddings, f)
-
-output_file = "product_metadata.json"
-with open(output_file, "w") as f:
-    image_embeddings = {k:v for k,v in image_embeddings.items() if k != "embedding"}
-    json.dump(serializable_embeddings, f)
+for i, (k, embedding) in enumerate(zip(galleries, pooled)):
+    image_embeddings[k] = {'faiss-id': i, 'embedding': embedding, **image_metadata[k]}
+
+# Save embeddings as float32 .npy with the aligned FAISS labels next to it;
+# build_index.py and the backend memory-map these instead of parsing JSON
+output_file = "image_embeddings.npy"
+save_embeddings(
+    output_file,
+    np.stack([entry['embedding'] for entry in image_embeddings.values()]),
+    [int(k) for k in image_embeddings],
+)
+
+# The per-image vectors too, labelled by the variant they belong to, for
+# multi-vector retrieval
+save_embeddings("image_embeddings.images.npy", *image_vectors(galleries, cache))
+
+metadata_file = "product_metadata.json"
+with open(metadata_file, "w") as f:
+    json.dump(
+        {
+            k: {field: value for field, value in entry.items() if field != 'embedding'}
+            for k, entry in image_embeddings.items()
+        },
+        f,
+    )
 
 print(f"Saved {len(image_embeddings)} image embeddings to {output_file}")
 #|%%--%%| <xXKdY2Y1Va|0p1ZMMQG35>
 
+import os
 import faiss
-import numpy as np
-
-# Prepare FAISS index
-dimension = 384  # Dimension of embeddings
-index = faiss.IndexFlatL2(dimension)
-
-# Add embeddings to the index
-embeddings = np.array([item['embedding'] for item in image_embeddings])
-index.add(embeddings)
-
-# Save the index
-faiss.write_index(index, 'image_vectors.index')
-
+from reindex import load_manifest, save_manifest, update_index
+
+# Patch the existing index with only the added/changed/removed products; pass
+# index_type="ivf-flat"/"ivf-pq"/"hnsw" for an ANN index (see build_index.py
+# and bench_index.py for the knobs)
+index_file = 'image_vectors.index'
+index = faiss.read_index(index_file) if os.path.exists(index_file) else None
+index, indexed = update_index(
+    index, load_manifest(index_file), images, cache, {"index_type": "flat"}, pooling=pooling
+)
+
+# Save the index (renamed into place, a running backend may have it mapped)
+save_index(index, index_file)
+save_manifest(index_file, MODEL_ID, "flat", indexed, pooling=pooling)
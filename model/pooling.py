@@ -0,0 +1,48 @@
+"""
+One vector per product from the embeddings of all its images
+
+Images arrive grouped: a flat (n, d) matrix plus the number of rows that
+belong to each product, in order. "mean" averages a group. "attention"
+weights each image by a softmax over its cosine similarity to the group's
+mean direction, so the shots that agree on what the product looks like (the
+model photos) count more than the odd size chart or fabric close-up. Both are
+a handful of reduceat calls over the whole catalog, no Python loop per product.
+"""
+
+import numpy as np
+
+POOLING = ("mean", "attention")
+
+
+def _group_starts(counts):
+    counts = np.asarray(counts, dtype=np.int64)
+    if (counts <= 0).any():
+        raise ValueError("every group needs at least one vector")
+    return np.r_[0, np.cumsum(counts)[:-1]], counts
+
+
+def pool_groups(vectors, counts, method="mean", temperature=0.1):
+    """
+    (len(counts), d) float32 matrix, one pooled vector per group
+    """
+    if method not in POOLING:
+        raise ValueError(f"unknown pooling {method!r}, expected one of {POOLING}")
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if not len(counts):
+        return np.empty((0, vectors.shape[1]), dtype=np.float32)
+    starts, counts = _group_starts(counts)
+
+    mean = np.add.reduceat(vectors, starts, axis=0) / counts[:, None]
+    if method == "mean":
+        return mean.astype(np.float32)
+
+    unit = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    direction = mean / np.maximum(np.linalg.norm(mean, axis=1, keepdims=True), 1e-12)
+    owner = np.repeat(np.arange(len(counts)), counts)
+    similarity = np.einsum("ij,ij->i", unit, direction[owner])
+
+    # cosines are within [-1, 1], so exp(s / temperature) cannot overflow for
+    # any sensible temperature; no per-group max needs subtracting
+    weights = np.exp(similarity / temperature)
+    weights /= np.add.reduceat(weights, starts)[owner]
+    return np.add.reduceat(vectors * weights[:, None], starts, axis=0).astype(np.float32)
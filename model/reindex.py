@@ -0,0 +1,302 @@
+"""
+Incremental re-index: embed only new or changed product images and patch the
+FAISS index in place instead of rebuilding it from scratch
+
+    python reindex.py womens_processed_data.jsonl image_vectors.index --cache embedding_cache
+
+FAISS labels are the integer keys of the processed data, so they stay stable
+across runs. Every image of a variant's gallery is embedded (each URL once,
+through the cache) and pooled into the label's single vector (pooling.py), so
+the index holds one entry per product however many photos it has. A manifest
+next to the index (<index>.manifest.json) records which images each label was
+pooled from; labels whose gallery changed or whose product disappeared are
+removed, new or changed ones are added. Flat and IVF
+indexes are patched with remove_ids/add_with_ids, HNSW is rebuilt from the
+cache (no re-embedding either way). The pooled float32 vectors of exactly the
+indexed labels are saved alongside (--embeddings), since the backend's
+re-rank and interaction lookups read those rather than the index's codes.
+"""
+
+import argparse
+import json
+import os
+
+import faiss
+import numpy as np
+
+from build_index import (
+    add_index_arguments,
+    build_index,
+    index_description,
+    index_options,
+    load_embeddings,
+    save_embeddings,
+    save_index,
+    supports_remove,
+)
+from embed import MODEL_ID, EmbeddingPipeline, load_dino
+from embedding_cache import EmbeddingCache
+from pooling import POOLING, pool_groups
+
+
+def load_metadata(path):
+    """
+    {label: record} from processed_data.json (keyed by running id) or the
+    JSONL catalog scraper/process_data.py writes (label inline)
+    """
+    if not path.endswith(".jsonl"):
+        with open(path, "r") as f:
+            return {int(key): item for key, item in json.load(f).items()}
+
+    metadata = {}
+    with open(path, "r") as f:
+        for line in f:
+            if line.strip():
+                item = json.loads(line)
+                metadata[item.pop("label")] = item
+    return metadata
+
+
+def product_images(image_metadata, max_images=None):
+    """
+    {label: [image url]} for metadata keyed by running id: the variant's whole
+    gallery where the catalog has one ("images"), else its top image
+    """
+    galleries = {}
+    for key, item in image_metadata.items():
+        urls = item.get("images") or [item["image_href"]]
+        galleries[int(key)] = urls[:max_images] if max_images else urls
+    return galleries
+
+
+def embed_missing(images, cache, pipeline):
+    """
+    Embed every image that is not cached yet, each URL once however many
+    galleries share it; returns the labels none of whose images could be
+    embedded
+    """
+    urls = dict.fromkeys(url for gallery in images.values() for url in gallery)
+    todo = [url for url in urls if url not in cache]
+    print(f"{len(urls) - len(todo)} images cached, {len(todo)} to embed")
+
+    for url, embedding in pipeline.embed((url, url) for url in todo):
+        if embedding is not None:
+            cache.put(url, embedding)
+    cache.flush()
+    return [
+        label
+        for label, gallery in images.items()
+        if not any(url in cache for url in gallery)
+    ]
+
+
+def cached_galleries(images, cache):
+    """
+    {label: [cached image url]} for labels with at least one cached image
+    """
+    available = {}
+    for label, gallery in images.items():
+        cached = [url for url in gallery if url in cache]
+        if cached:
+            available[label] = cached
+    return available
+
+
+def pooled_vectors(galleries, cache, pooling="mean"):
+    """
+    One pooled vector per gallery (a list of cached URLs), stacked
+    """
+    vectors = cache.get_many([url for gallery in galleries for url in gallery])
+    return pool_groups(vectors, [len(gallery) for gallery in galleries], pooling)
+
+
+def image_vectors(galleries, cache):
+    """
+    (per-image vectors, the label each belongs to) for multi-vector retrieval
+    """
+    labels = np.array(
+        [label for label, gallery in galleries.items() for _ in gallery], dtype=np.int64
+    )
+    urls = [url for gallery in galleries.values() for url in gallery]
+    return cache.get_many(urls), labels
+
+
+def gallery_key(gallery):
+    # what the manifest records per label; a lone image keeps its plain URL
+    return "\n".join(gallery)
+
+
+def manifest_path(index_path):
+    return index_path + ".manifest.json"
+
+
+def load_manifest(index_path):
+    try:
+        with open(manifest_path(index_path), "r") as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return None
+    manifest["ids"] = {int(label): url for label, url in manifest["ids"].items()}
+    return manifest
+
+
+def save_manifest(index_path, model_id, index_type, indexed, pooling="mean"):
+    with open(manifest_path(index_path), "w") as f:
+        json.dump(
+            {
+                "model_id": model_id,
+                "index_type": index_type,
+                "pooling": pooling,
+                "ids": indexed,
+            },
+            f,
+        )
+
+
+def indexed_embeddings(path, labels, galleries, cache, pooling="mean"):
+    """
+    Pooled vectors for `labels`, as written to `path` by an earlier run where
+    it has them all, else pooled again from the cache
+    """
+    if os.path.exists(path):
+        embeddings, ids = load_embeddings(path)
+        if len(ids):
+            order = np.argsort(ids)
+            found = np.searchsorted(ids, labels, sorter=order)
+            rows = order[np.minimum(found, len(ids) - 1)]
+            if (ids[rows] == labels).all():
+                return np.asarray(embeddings[rows])
+    return pooled_vectors([galleries[label] for label in labels], cache, pooling)
+
+
+def update_index(
+    index,
+    manifest,
+    images,
+    cache,
+    options,
+    rebuild=False,
+    pooling="mean",
+    embeddings_path=None,
+):
+    """
+    Bring `index` in line with `images`; returns (index, {label: gallery key}
+    indexed). With `embeddings_path`, the pooled float32 vectors of exactly
+    the indexed labels are saved there too, for the backend's exact re-rank
+    and interaction lookups.
+    """
+    available = cached_galleries(images, cache)
+    keys = {label: gallery_key(gallery) for label, gallery in available.items()}
+
+    incremental = (
+        not rebuild
+        and index is not None
+        and manifest is not None
+        and manifest["model_id"] == cache.model_id
+        and manifest["index_type"] == index_description(options)
+        and manifest.get("pooling", "mean") == pooling
+        and supports_remove(index)
+    )
+
+    if not incremental:
+        labels = np.fromiter(available, dtype=np.int64, count=len(available))
+        vectors = pooled_vectors([available[label] for label in labels], cache, pooling)
+        print(f"Building {index_description(options)} index over {len(labels)} vectors")
+        index = build_index(vectors, ids=labels, **options)
+        if embeddings_path is not None:
+            save_embeddings(embeddings_path, vectors, labels)
+        return index, keys
+
+    indexed = manifest["ids"]
+    stale = [label for label, key in indexed.items() if keys.get(label) != key]
+    fresh = [label for label, key in keys.items() if indexed.get(label) != key]
+
+    fresh_labels = np.array(fresh, dtype=np.int64)
+    fresh_vectors = pooled_vectors([available[label] for label in fresh], cache, pooling)
+    if stale:
+        index.remove_ids(np.array(stale, dtype=np.int64))
+    if fresh:
+        index.add_with_ids(fresh_vectors, fresh_labels)
+    print(f"Removed {len(stale)} and added {len(fresh)} vectors, {index.ntotal} total")
+
+    if embeddings_path is not None:
+        # read before saving: the previous file is replaced, not rewritten
+        stale = set(stale)
+        kept = np.array([label for label in indexed if label not in stale], dtype=np.int64)
+        kept_vectors = indexed_embeddings(embeddings_path, kept, available, cache, pooling)
+        save_embeddings(
+            embeddings_path,
+            np.concatenate([kept_vectors, fresh_vectors]),
+            np.concatenate([kept, fresh_labels]),
+        )
+    return index, keys
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("metadata")
+    parser.add_argument("index")
+    parser.add_argument("--cache", default="embedding_cache")
+    parser.add_argument("--rebuild", action="store_true")
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--download-workers", type=int, default=16)
+    parser.add_argument("--max-images", type=int, default=None, help="per variant")
+    parser.add_argument("--pooling", choices=POOLING, default="mean")
+    parser.add_argument(
+        "--image-vectors",
+        default=None,
+        help="also save every image's vector with its label (.npy), for multi-vector retrieval",
+    )
+    parser.add_argument(
+        "--embeddings",
+        default=None,
+        help="where to save the indexed pooled vectors (.npy) the backend maps for "
+        "CINDER_EMBEDDINGS_PATH; defaults to image_embeddings.npy next to the index",
+    )
+    add_index_arguments(parser)
+    args = parser.parse_args()
+
+    images = product_images(load_metadata(args.metadata), args.max_images)
+
+    cache = EmbeddingCache(args.cache, MODEL_ID)
+
+    # the model is only loaded when something actually needs embedding
+    if any(url not in cache for gallery in images.values() for url in gallery):
+        model, preprocess = load_dino(args.device)
+        pipeline = EmbeddingPipeline(
+            model,
+            preprocess,
+            device=args.device,
+            batch_size=args.batch_size,
+            download_workers=args.download_workers,
+        )
+        failed = embed_missing(images, cache, pipeline)
+        if failed:
+            print(f"{len(failed)} products have no image that could be embedded and are left out")
+
+    index = faiss.read_index(args.index) if os.path.exists(args.index) else None
+    index, indexed = update_index(
+        index,
+        load_manifest(args.index),
+        images,
+        cache,
+        index_options(args),
+        rebuild=args.rebuild,
+        pooling=args.pooling,
+        embeddings_path=args.embeddings
+        or os.path.join(os.path.dirname(args.index), "image_embeddings.npy"),
+    )
+
+    save_index(index, args.index)
+    save_manifest(
+        args.index,
+        MODEL_ID,
+        index_description(index_options(args)),
+        indexed,
+        pooling=args.pooling,
+    )
+
+    if args.image_vectors is not None:
+        vectors, labels = image_vectors(cached_galleries(images, cache), cache)
+        save_embeddings(args.image_vectors, vectors, labels)
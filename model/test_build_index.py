@@ -0,0 +1,38 @@
+import faiss
+import numpy as np
+
+from build_index import load_embeddings, save_embeddings, save_index
+
+
+def test_saving_over_mapped_files_leaves_the_old_mappings_readable(tmp_path):
+    path = str(tmp_path / "image_embeddings.npy")
+    rng = np.random.default_rng(0)
+    old = rng.standard_normal((4096, 32)).astype(np.float32)
+    save_embeddings(path, old, np.arange(len(old)))
+    embeddings, ids = load_embeddings(path)
+
+    # a smaller rebuild; truncating the mapped files would SIGBUS below
+    save_embeddings(path, old[:10] + 1, np.arange(10) + 100)
+
+    np.testing.assert_array_equal(embeddings[-1], old[-1])
+    assert ids[-1] == len(old) - 1
+    new_embeddings, new_ids = load_embeddings(path)
+    assert new_ids.tolist() == list(range(100, 110))
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        "image_embeddings.ids.npy",
+        "image_embeddings.npy",
+    ]
+
+
+def test_save_index_over_a_mapped_index(tmp_path):
+    path = str(tmp_path / "image_vectors.index")
+    vectors = np.random.default_rng(0).standard_normal((4096, 32)).astype(np.float32)
+    index = faiss.IndexFlatL2(32)
+    index.add(vectors)
+    save_index(index, path)
+    mapped = faiss.read_index(path, faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY)
+
+    save_index(faiss.IndexFlatL2(32), path)
+
+    assert mapped.search(vectors[-1:], 1)[1][0, 0] == len(vectors) - 1
+    assert faiss.read_index(path).ntotal == 0
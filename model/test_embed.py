@@ -0,0 +1,69 @@
+import functools
+import http.server
+import threading
+
+import numpy as np
+import pytest
+import torch
+from PIL import Image
+from torchvision import transforms
+
+from embed import EmbeddingPipeline
+
+
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+class MeanColor(torch.nn.Module):
+    # stands in for DINO: one 3-d "embedding" per image, its mean RGB
+    def forward(self, batch):
+        return batch.mean(dim=(2, 3))
+
+
+@pytest.fixture
+def image_server(tmp_path):
+    colors = [(255, 0, 0), (0, 255, 0), (0, 0, 255), (255, 255, 0), (0, 255, 255)]
+    for i, color in enumerate(colors):
+        Image.new("RGB", (12 + i, 10), color).save(tmp_path / f"{i}.png")
+    (tmp_path / "broken.jpg").write_bytes(b"not an image")
+
+    server = http.server.ThreadingHTTPServer(
+        ("127.0.0.1", 0), functools.partial(QuietHandler, directory=str(tmp_path))
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}", colors
+    server.shutdown()
+    server.server_close()
+
+
+def test_embed_keeps_order_and_reports_failures(image_server):
+    base, colors = image_server
+    pipeline = EmbeddingPipeline(
+        MeanColor(),
+        transforms.Compose([transforms.Resize((8, 8)), transforms.ToTensor()]),
+        batch_size=2,
+        download_workers=4,
+        decode_workers=2,
+        max_retries=0,
+        log=lambda message: None,
+    )
+
+    items = [
+        ("a", f"{base}/0.png"),
+        ("missing", f"{base}/missing.png"),
+        ("b", f"{base}/1.png"),
+        ("broken", f"{base}/broken.jpg"),
+        ("c", f"{base}/2.png"),
+        ("d", f"{base}/3.png"),
+        ("e", f"{base}/4.png"),
+    ]
+    results = list(pipeline.embed(items))
+
+    assert [key for key, _ in results] == [key for key, _ in items]
+    embeddings = dict(results)
+    assert embeddings["missing"] is None
+    assert embeddings["broken"] is None
+    for key, color in zip("abcde", colors):
+        np.testing.assert_allclose(embeddings[key], np.array(color) / 255, atol=1e-6)
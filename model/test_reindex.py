@@ -0,0 +1,64 @@
+import numpy as np
+
+from build_index import load_embeddings
+from embedding_cache import EmbeddingCache
+from reindex import index_description, update_index
+
+DIMENSION = 8
+OPTIONS = {"index_type": "flat", "compression": "sq8"}
+
+
+def cached_images(cache, galleries, rng):
+    for gallery in galleries.values():
+        for url in gallery:
+            if url not in cache:
+                cache.put(url, rng.standard_normal(DIMENSION).astype(np.float32))
+    return galleries
+
+
+def assert_embeddings_match_index(path, index, galleries, cache):
+    embeddings, ids = load_embeddings(path)
+    indexed = faiss_ids(index)
+    assert sorted(ids.tolist()) == sorted(indexed)
+    for label, vector in zip(ids, embeddings):
+        expected = cache.get_many(galleries[label]).mean(axis=0)
+        np.testing.assert_allclose(vector, expected, rtol=1e-6)
+
+
+def faiss_ids(index):
+    import faiss
+
+    return faiss.vector_to_array(faiss.downcast_index(index).id_map).tolist()
+
+
+def test_incremental_reindex_saves_the_indexed_vectors(tmp_path):
+    rng = np.random.default_rng(0)
+    cache = EmbeddingCache(str(tmp_path / "cache"), "test-model", dimension=DIMENSION)
+    embeddings_path = str(tmp_path / "image_embeddings.npy")
+    galleries = cached_images(
+        cache, {label: [f"u{label}a", f"u{label}b"] for label in range(1, 301)}, rng
+    )
+
+    index, indexed = update_index(
+        None, None, galleries, cache, OPTIONS, embeddings_path=embeddings_path
+    )
+    assert_embeddings_match_index(embeddings_path, index, galleries, cache)
+
+    # one product gone, one with a new photo, one new
+    galleries = dict(galleries)
+    del galleries[7]
+    galleries[8] = ["u8a", "u8c"]
+    galleries[301] = ["u301a"]
+    cached_images(cache, galleries, rng)
+    manifest = {
+        "model_id": cache.model_id,
+        "index_type": index_description(OPTIONS),
+        "pooling": "mean",
+        "ids": indexed,
+    }
+    index, indexed = update_index(
+        index, manifest, galleries, cache, OPTIONS, embeddings_path=embeddings_path
+    )
+
+    assert index.ntotal == 300
+    assert_embeddings_match_index(embeddings_path, index, galleries, cache)
@@ -0,0 +1,176 @@
+"""
+Pages per second for the browser and the HTTP fetch paths
+
+    python bench_fetch.py --fixtures ./fixtures --workers 8
+    python bench_fetch.py --synthetic 200
+
+Serves saved product pages (or generated pages with the same markup) from a
+local HTTP server, so only fetch and extraction are measured, not Amazon's
+latency. Reports lxml parsing alone, HtmlFetcher through its pooled session
+with `--workers` threads, and one headless Chrome through SeleniumFetcher
+when selenium and chromedriver are available.
+"""
+
+import argparse
+import functools
+import http.server
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from html_fetcher import HEADERS, HtmlFetcher, parse_product
+from scrape_common import make_session
+
+FIXTURE_PAGE = """<!DOCTYPE html>
+<html><head><title>{title}</title></head><body>
+<span id="productTitle">  {title}  </span>
+<span class="a-price"><span class="a-price-whole">{price:,}.</span></span>
+<div id="productFactsDesktopExpander">
+  <div class="a-fixed-left-grid product-facts-detail">
+    <div class="a-col-left"><span>Material</span></div>
+    <div class="a-col-right"><span>Cotton</span></div>
+  </div>
+  <div class="a-fixed-left-grid product-facts-detail">
+    <div class="a-col-left"><span>Fit</span></div>
+    <div class="a-col-right"><span>Regular</span></div>
+  </div>
+  <ul><li>Machine wash</li><li>Regular fit</li><li>Made in India</li></ul>
+</div>
+<div id="variation_color_name"><div><span class="selection">{color}</span></div></div>
+<ul>{thumbnails}</ul>
+<div id="main-image-container"><ul><li><span><span><div>
+  <img id="landingImage" src="{image}0.jpg" alt="{title}">
+</div></span></span></li></ul></div>
+<script>
+P.when('A').register("ImageBlockATF", function(A){{
+var data = {{
+'colorImages': {{ 'initial': [{gallery}]}},
+'colorToAsin': {{'initial': {{}}}},
+}};
+}});
+</script>
+{padding}
+</body></html>
+"""
+
+
+def write_synthetic_fixtures(out_dir, count, images=5):
+    """
+    `count` pages with the markup both fetchers read, padded to the size of
+    a real product page
+    """
+    colors = ["Black", "Navy Blue", "Maroon", "Beige"]
+    for i in range(count):
+        image = f"https://m.media-amazon.com/images/I/{i}-"
+        gallery = ",".join(
+            f'{{"hiRes":"{image}{j}.hires.jpg","large":"{image}{j}.jpg","variant":"MAIN"}}'
+            for j in range(images)
+        )
+        page = FIXTURE_PAGE.format(
+            title=f"Fixture dress {i}",
+            price=400 + i,
+            color=colors[i % len(colors)],
+            image=image,
+            thumbnails="".join(
+                f'<li class="imageThumbnail"><img src="{image}{j}._SS40_.jpg"></li>'
+                for j in range(images)
+            ),
+            gallery=gallery,
+            padding="<div>" + "x" * 500_000 + "</div>",
+        )
+        with open(os.path.join(out_dir, f"product_{i}.html"), "w") as file:
+            file.write(page)
+
+
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def serve(directory):
+    handler = functools.partial(QuietHandler, directory=directory)
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def report(name, count, elapsed, failed=0):
+    print(f"{name:<28} {count / elapsed:>10.1f} {failed:>7}")
+
+
+def run(fixtures, workers, selenium_pages):
+    names = sorted(name for name in os.listdir(fixtures) if name.endswith(".html"))
+    server = serve(fixtures)
+    base = f"http://127.0.0.1:{server.server_address[1]}/"
+    hrefs = [base + name for name in names]
+
+    print(f"{len(names)} pages from {fixtures}")
+    print(f"{'fetcher':<28} {'pages/s':>10} {'failed':>7}")
+
+    pages = []
+    for name in names:
+        with open(os.path.join(fixtures, name), "rb") as file:
+            pages.append(file.read())
+    start = time.perf_counter()
+    failed = 0
+    for href, page in zip(hrefs, pages):
+        try:
+            parse_product(page, href)
+        except ValueError:
+            failed += 1
+    report("lxml parse only", len(pages), time.perf_counter() - start, failed)
+
+    fetcher = HtmlFetcher(make_session(workers, headers=HEADERS))
+
+    def scrape(href):
+        try:
+            fetcher.scrape(href)
+            return 0
+        except Exception:
+            return 1
+
+    fetcher.scrape(hrefs[0])  # open the pooled connection outside the timing
+    start = time.perf_counter()
+    with ThreadPoolExecutor(workers) as executor:
+        failed = sum(executor.map(scrape, hrefs))
+    report(f"http + lxml, {workers} workers", len(hrefs), time.perf_counter() - start, failed)
+
+    try:
+        from get_products import SeleniumFetcher
+
+        browser = SeleniumFetcher(headless=True)
+    except Exception as e:
+        print(f"selenium skipped: {e}")
+    else:
+        try:
+            sample = hrefs[:selenium_pages]
+            start = time.perf_counter()
+            failed = 0
+            for href in sample:
+                try:
+                    browser.scrape(href)
+                except Exception:
+                    failed += 1
+            report("selenium, 1 browser", len(sample), time.perf_counter() - start, failed)
+        finally:
+            browser.close()
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--fixtures", default=None, help="directory of saved product pages (*.html)")
+    parser.add_argument("--synthetic", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--selenium-pages", type=int, default=20)
+    args = parser.parse_args()
+
+    if args.fixtures is not None:
+        run(args.fixtures, args.workers, args.selenium_pages)
+    else:
+        with tempfile.TemporaryDirectory() as tmp:
+            write_synthetic_fixtures(tmp, args.synthetic)
+            run(tmp, args.workers, args.selenium_pages)
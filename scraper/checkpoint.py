@@ -0,0 +1,106 @@
+"""
+Append-only JSONL record of scraped products
+
+One line per product and category, the product's fields plus
+"main_category" and "category". Lines are flushed as they are written, so a
+crash loses at most the product being written. Opening a checkpoint loads the
+(main_category, category, href) of every complete line into a set, which is
+all a resumed run needs to skip finished work.
+"""
+
+import json
+import os
+import threading
+
+PLACEMENT_KEYS = ("main_category", "category")
+
+
+def _complete_lines(file):
+    # a torn last line (no trailing newline, or not valid JSON) ends the file
+    for line in file:
+        if not line.endswith(b"\n"):
+            return
+        try:
+            record = json.loads(line)
+        except ValueError:
+            return
+        yield line, record
+
+
+def read_records(path):
+    with open(path, "rb") as file:
+        for _, record in _complete_lines(file):
+            yield record
+
+
+class Checkpoint:
+    def __init__(self, path):
+        self.path = path
+        self.completed = set()
+        self._lock = threading.Lock()
+
+        if os.path.exists(path):
+            valid_bytes = 0
+            with open(path, "rb") as file:
+                for line, record in _complete_lines(file):
+                    self.completed.add(self.key(record))
+                    valid_bytes += len(line)
+            # drop a torn tail so the next append starts on a fresh line
+            if valid_bytes != os.path.getsize(path):
+                os.truncate(path, valid_bytes)
+
+        self._file = open(path, "a", encoding="utf-8")
+
+    @staticmethod
+    def key(record):
+        return record["main_category"], record["category"], record["href"]
+
+    def __contains__(self, key):
+        return key in self.completed
+
+    def __len__(self):
+        return len(self.completed)
+
+    def append(self, main_category, category, product):
+        record = {"main_category": main_category, "category": category, **product}
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            key = self.key(record)
+            if key in self.completed:
+                return
+            self._file.write(line)
+            self._file.flush()
+            self.completed.add(key)
+
+    def import_nested(self, path):
+        """
+        Seed the checkpoint from a product_data.json written by the old
+        single-file scraper
+        """
+        with open(path, "r") as file:
+            product_data = json.load(file)
+        for main_category, categories in product_data.items():
+            for category, products in categories.items():
+                for product in products:
+                    self.append(main_category, category, product)
+
+    def export(self, path):
+        """
+        Write the nested {main_category: {category: [product]}} layout that
+        process_data.py reads
+        """
+        self._file.flush()
+        product_data = {}
+        for record in read_records(self.path):
+            main_category, category = (record.pop(key) for key in PLACEMENT_KEYS)
+            product_data.setdefault(main_category, {}).setdefault(category, []).append(
+                record
+            )
+
+        temporary = path + ".tmp"
+        with open(temporary, "w") as file:
+            json.dump(product_data, file)
+        os.replace(temporary, path)
+
+    def close(self):
+        self._file.close()
@@ -1,183 +1,345 @@
+"""
+Scrape the product pages listed in href_data.json
+
+    python get_products.py --workers 4 --profile "/home/espacio/.config/chromium/Profile {worker}"
+
+Hrefs go on one shared queue and `--workers` fetchers pull from it. The
+default fetcher is a browser with its own Chrome profile; `--fetcher html`
+reads pages over HTTP instead (see html_fetcher.py). Every finished product
+is appended to a JSONL checkpoint (data/product_data.jsonl), so an
+interrupted run picks up where it stopped: finished hrefs are loaded into a
+set on start and skipped. The nested product_data.json that process_data.py
+reads is written from the checkpoint when the run ends.
+"""
+
+import argparse
 import json
+import os
+import queue
+import threading
 import time
+
 from selenium import webdriver
-from selenium.webdriver.common.by import By
 from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.support.ui import WebDriverWait
+from selenium.webdriver.common.by import By
 from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.support.ui import WebDriverWait
 
-# Initialize WebDriver
-options = Options()
-options.add_argument("user-data-dir=/home/espacio/.config/chromium/Profile 1")
-driver = webdriver.Chrome(options=options)
+from checkpoint import Checkpoint
+from html_fetcher import HEADERS, HtmlFetcher
+from scrape_common import make_session, process_price
 
-# Load href_data.json
-href_file = "./data/href_data.json"
-output_file = "./data/product_data.json"
+DEFAULT_PROFILE = "/home/espacio/.config/chromium/Profile 1"
 
-def get_color():
-    try:
-        WebDriverWait(driver, 2).until(
-            EC.presence_of_element_located((By.ID, "variation_color_name"))
-        )
-        color_name = driver.find_element(By.XPATH, "//*[@id=\"variation_color_name\"]/div/span").text.strip()
-    except:
-        color_name = "unknown"
-    print(color_name)
-
-    # Extract images for this color
-    images = []
-    WebDriverWait(driver, 10).until(
-        EC.presence_of_element_located((By.CLASS_NAME, "imageThumbnail"))
-    )
-    thumbnails = driver.find_elements(By.CLASS_NAME, "imageThumbnail")
-    for thumbnail in thumbnails:
-        try: thumbnail.click()
-        except: pass
+
+class SeleniumFetcher:
+    """
+    One Chrome instance; scrape(href) returns the product record
+    """
+
+    def __init__(self, profile_dir=None, headless=False):
+        options = Options()
+        if profile_dir:
+            options.add_argument(f"user-data-dir={profile_dir}")
+        if headless:
+            options.add_argument("--headless=new")
+        self.driver = webdriver.Chrome(options=options)
+
+    def get_color(self):
+        driver = self.driver
+        try:
+            WebDriverWait(driver, 2).until(
+                EC.presence_of_element_located((By.ID, "variation_color_name"))
+            )
+            color_name = driver.find_element(By.XPATH, "//*[@id=\"variation_color_name\"]/div/span").text.strip()
+        except:
+            color_name = "unknown"
+
+        # Extract images for this color
+        images = []
         WebDriverWait(driver, 10).until(
-            EC.presence_of_element_located((By.XPATH, "//*[@id=\"main-image-container\"]/ul"))
+            EC.presence_of_element_located((By.CLASS_NAME, "imageThumbnail"))
         )
+        thumbnails = driver.find_elements(By.CLASS_NAME, "imageThumbnail")
+        for thumbnail in thumbnails:
+            try: thumbnail.click()
+            except: pass
+            WebDriverWait(driver, 10).until(
+                EC.presence_of_element_located((By.XPATH, "//*[@id=\"main-image-container\"]/ul"))
+            )
+            try:
+                img_element = driver.find_element(By.XPATH, "//*[@id=\"main-image-container\"]/ul/li[1]/span/span/div/img")
+            except:
+                img_element = driver.find_element(By.XPATH, "//*[@id=\"main-image-container\"]/ul/li[4]/span/span/div/img")
+            images.append({
+                "href": img_element.get_attribute("src"),
+                "alt": img_element.get_attribute("alt"),
+            })
+
+        # Extract affiliate link
+        affiliate_href = ""
         try:
-            img_element = driver.find_element(By.XPATH, "//*[@id=\"main-image-container\"]/ul/li[1]/span/span/div/img")
-        except:
-            img_element = driver.find_element(By.XPATH, "//*[@id=\"main-image-container\"]/ul/li[4]/span/span/div/img")
-        images.append({
-            "href": img_element.get_attribute("src"),
-            "alt": img_element.get_attribute("alt"),
-        })
-
-    # Extract affiliate link
-    affiliate_href = ""
-    try:
-        for _ in range(2):
-            affiliate_button = driver.find_element(By.ID, "amzn-ss-get-link-button")
-            affiliate_button.click()
-            WebDriverWait(driver, 10).until(EC.presence_of_element_located((By.ID, "amzn-ss-text-shortlink-textarea")))
-            affiliate_href = driver.find_element(By.ID, "amzn-ss-text-shortlink-textarea").text.strip()
-            st_time = time.time()
-            while (affiliate_href == "" and time.time() - st_time < 10):
+            for _ in range(2):
+                affiliate_button = driver.find_element(By.ID, "amzn-ss-get-link-button")
+                affiliate_button.click()
+                WebDriverWait(driver, 10).until(EC.presence_of_element_located((By.ID, "amzn-ss-text-shortlink-textarea")))
                 affiliate_href = driver.find_element(By.ID, "amzn-ss-text-shortlink-textarea").text.strip()
-            if (affiliate_href != ""): break
-    except Exception as e:
-        pass
-    return color_name, {"images": images, "affiliate_href": affiliate_href}
-
-def process_price(price):
-    res = 0
-    i = 0
-    for p in price[::-1]:
-        if (p.isnumeric()):
-            res += (int(p)*(10**i))
-            i += 1
-    return res
-
-try:
+                st_time = time.time()
+                while (affiliate_href == "" and time.time() - st_time < 10):
+                    affiliate_href = driver.find_element(By.ID, "amzn-ss-text-shortlink-textarea").text.strip()
+                if (affiliate_href != ""): break
+        except Exception as e:
+            pass
+        return color_name, {"images": images, "affiliate_href": affiliate_href}
+
+    def load(self, href):
+        self.driver.get(href)
+        WebDriverWait(self.driver, 10).until(
+            EC.presence_of_element_located((By.ID, "productTitle"))
+        )
+
+    def colors(self, href=None):
+        """
+        Color name -> images and affiliate link, clicking through every
+        variant of the loaded page (of `href`, if given)
+        """
+        driver = self.driver
+        if href is not None:
+            self.load(href)
+
+        colors = {}
+        color_elements = []
+        try:
+            color_elements = driver.find_elements(By.XPATH, "//li[contains(@id, 'color_name_')]")
+        except:
+            pass
+
+        for i in range(max(1, len(color_elements))):
+            try:
+                if (len(color_elements)):
+                    color_elements[i].click()
+                color_name, color_data = self.get_color()
+                colors[color_name] = color_data
+            except Exception as e:
+                print(e)
+        return colors
+
+    def scrape(self, href):
+        driver = self.driver
+        self.load(href)
+
+        # Extract product details
+        title = driver.find_element(By.ID, "productTitle").text.strip()
+
+        try:
+            price = driver.find_element(By.CSS_SELECTOR, "span.a-price-whole").text.strip()
+            price = process_price(price)
+        except:
+            price = None
+
+        # Extract product information
+        product_information = []
+        try:
+            facts = driver.find_elements(By.CLASS_NAME, "product-facts-detail")
+            for fact in facts:
+                left = fact.find_element(By.CLASS_NAME, "a-col-left").text.strip()
+                right = fact.find_element(By.CLASS_NAME, "a-col-right").text.strip()
+                if (left != "" and right != ""):
+                    product_information.append({left: right})
+        except:
+            pass
+
+        # Extract "About Item" details
+        about_item = []
+        try:
+            facts_expander = driver.find_element(By.ID, "productFactsDesktopExpander")
+            li_tags = facts_expander.find_elements(By.TAG_NAME, "li")
+            about_item = [li.text.strip() for li in li_tags]
+        except:
+            pass
+
+        return {
+            "href": href,
+            "title": title,
+            "price": price,
+            "product_information": product_information,
+            "about_item": about_item,
+            "colors": self.colors(),
+        }
+
+    def close(self):
+        self.driver.quit()
+
+
+def load_hrefs(href_file, main_category="Women's Clothing"):
+    """
+    {main_category: {category: [href]}}; the flat {category: [href]} files
+    get_hrefs.py writes are placed under `main_category`
+    """
     with open(href_file, "r") as file:
         href_data = json.load(file)
-except FileNotFoundError:
-    print(f"{href_file} not found.")
-    exit(1)
-
-# Initialize or load product data
-try:
-    with open(output_file, "r") as file:
-        product_data = json.load(file)
-except FileNotFoundError:
-    product_data = {}
-
-try:
+    if all(isinstance(hrefs, list) for hrefs in href_data.values()):
+        href_data = {main_category: href_data}
+    return href_data
+
+
+def pending_work(href_data, checkpoint):
+    """
+    href -> [(main_category, category)] still missing from the checkpoint, in
+    file order. A product listed under several categories is fetched once.
+    """
+    work = {}
     for main_category, categories in href_data.items():
-        if main_category not in product_data:
-            product_data[main_category] = {}
-
-        duplicate_list = []
-        for category_name, href_list in categories.items():
-            if category_name in product_data[main_category]:
-                for item in product_data[main_category][category_name]:
-                    duplicate_list.append(item["href"])
-                present = True
-            else:
-                present = False
-                product_data[main_category][category_name] = []
-
-            for href in href_list:
-                if (present and href in duplicate_list):
-                    print(f"{href} found, continuing...")
+        for category, hrefs in categories.items():
+            for href in hrefs:
+                if (main_category, category, href) in checkpoint:
                     continue
+                places = work.setdefault(href, [])
+                if (main_category, category) not in places:
+                    places.append((main_category, category))
+    return work
+
+
+def run(
+    href_data,
+    checkpoint_path,
+    output_file,
+    make_fetcher,
+    workers=1,
+    retries=2,
+):
+    """
+    Scrape every pending href with `workers` threads, each owning the fetcher
+    `make_fetcher(worker_number)` returns
+    """
+    checkpoint = Checkpoint(checkpoint_path)
+    if not len(checkpoint) and os.path.exists(output_file):
+        checkpoint.import_nested(output_file)
+
+    work = pending_work(href_data, checkpoint)
+    total = len(work)
+    print(f"{len(checkpoint)} done, {total} to scrape")
+
+    tasks = queue.Queue()
+    for href, places in work.items():
+        tasks.put((href, places, 0))
+
+    stop = threading.Event()
+    counts = {"done": 0, "failed": 0}
+    counts_lock = threading.Lock()
+
+    def worker(number):
+        try:
+            fetcher = make_fetcher(number)
+        except Exception as e:
+            print(f"Worker {number} could not start: {e}")
+            return
+
+        try:
+            while not stop.is_set():
                 try:
-                    driver.get(href)
-                    WebDriverWait(driver, 10).until(
-                        EC.presence_of_element_located((By.ID, "productTitle"))
-                    )
-
-                    # Extract product details
-                    title = driver.find_element(By.ID, "productTitle").text.strip()
-
-                    try:
-                        price = driver.find_element(By.CSS_SELECTOR, "span.a-price-whole").text.strip()
-                        price = process_price(price)
-                    except:
-                        price = None
-
-                    # Extract product information
-                    product_information = []
-                    try:
-                        facts = driver.find_elements(By.CLASS_NAME, "product-facts-detail")
-                        for fact in facts:
-                            left = fact.find_element(By.CLASS_NAME, "a-col-left").text.strip()
-                            right = fact.find_element(By.CLASS_NAME, "a-col-right").text.strip()
-                            if (left != "" and right != ""):
-                                product_information.append({left: right})
-                    except:
-                        pass
-
-                    # Extract "About Item" details
-                    about_item = []
-                    try:
-                        facts_expander = driver.find_element(By.ID, "productFactsDesktopExpander")
-                        li_tags = facts_expander.find_elements(By.TAG_NAME, "li")
-                        about_item = [li.text.strip() for li in li_tags]
-                    except:
-                        pass
-
-                    # Extract colors and images
-                    colors = {}
-                    color_elements = []
-                    try:
-                        color_elements = driver.find_elements(By.XPATH, "//li[contains(@id, 'color_name_')]")
-                    except:
-                        pass
-
-                    for i in range(max(1, len(color_elements))):
-                        try:
-                            if (len(color_elements)):
-                                color_elements[i].click()
-                            color_name, color_data = get_color()
-                            colors[color_name] = color_data
-                        except Exception as e:
-                            print(e)
-                            pass
-
-
-                    # Add product details to category
-                    product_data[main_category][category_name].append({
-                        "href": href,
-                        "title": title,
-                        "price": price,
-                        # "discounted_price": discounted_price,
-                        "product_information": product_information,
-                        "about_item": about_item,
-                        "colors": colors,
-                    })
-
-                    # Save after processing each product
-                    with open(output_file, "w") as file:
-                        json.dump(product_data, file, indent=4)
-
-                    print(f"Processed product: {title}")
+                    href, places, attempt = tasks.get_nowait()
+                except queue.Empty:
+                    return
 
+                try:
+                    product = fetcher.scrape(href)
                 except Exception as e:
-                    print(f"Error processing product at {href}: {e}")
+                    if attempt < retries:
+                        tasks.put((href, places, attempt + 1))
+                    else:
+                        print(f"Error processing product at {href}: {e}")
+                        with counts_lock:
+                            counts["failed"] += 1
+                    continue
+
+                for main_category, category in places:
+                    checkpoint.append(main_category, category, product)
+                with counts_lock:
+                    counts["done"] += 1
+                    done = counts["done"]
+                print(f"[{done}/{total}] Processed product: {product['title']}")
+        finally:
+            fetcher.close()
+
+    threads = [
+        threading.Thread(target=worker, args=(number,), name=f"scraper-{number}")
+        for number in range(workers)
+    ]
+    start = time.time()
+    try:
+        for thread in threads:
+            thread.start()
+        # join with a timeout so Ctrl-C reaches this thread
+        while any(thread.is_alive() for thread in threads):
+            for thread in threads:
+                thread.join(0.5)
+    except KeyboardInterrupt:
+        print("Stopping after the products in progress...")
+        stop.set()
+        for thread in threads:
+            thread.join()
+    finally:
+        checkpoint.export(output_file)
+        checkpoint.close()
 
-finally:
-    driver.quit()
+    elapsed = time.time() - start
+    print(
+        f"Scraped {counts['done']} products in {elapsed:.0f}s "
+        f"({counts['done'] / max(elapsed, 1e-9):.2f}/s), {counts['failed']} failed"
+    )
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--hrefs", default="./data/href_data.json")
+    parser.add_argument("--checkpoint", default="./data/product_data.jsonl")
+    parser.add_argument("--output", default="./data/product_data.json")
+    parser.add_argument("--main-category", default="Women's Clothing")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--retries", type=int, default=2)
+    parser.add_argument(
+        "--fetcher",
+        choices=["selenium", "html", "html+selenium"],
+        default="selenium",
+        help="html reads pages over HTTP without a browser (no affiliate links, "
+        "only the page's own color); html+selenium uses the browser just for colors "
+        "and affiliate links",
+    )
+    parser.add_argument(
+        "--profile",
+        default=DEFAULT_PROFILE,
+        help="Chrome user-data-dir; with several workers it must contain {worker}, "
+        "since Chrome locks a profile to one instance",
+    )
+    args = parser.parse_args()
+
+    uses_browser = args.fetcher != "html"
+    if uses_browser and args.workers > 1 and args.profile and "{worker}" not in args.profile:
+        parser.error("--profile needs a {worker} placeholder when --workers > 1")
+
+    try:
+        href_data = load_hrefs(args.hrefs, args.main_category)
+    except FileNotFoundError:
+        print(f"{args.hrefs} not found.")
+        exit(1)
+
+    session = make_session(args.workers, headers=HEADERS)
+
+    def make_fetcher(number):
+        browser = None
+        if uses_browser:
+            browser = SeleniumFetcher(args.profile.format(worker=number))
+        if args.fetcher == "selenium":
+            return browser
+        return HtmlFetcher(session, fallback=browser)
+
+    run(
+        href_data,
+        args.checkpoint,
+        args.output,
+        make_fetcher,
+        workers=args.workers,
+        retries=args.retries,
+    )
@@ -0,0 +1,141 @@
+"""
+Product pages over plain HTTP
+
+The static fields (title, price, product facts, about-item) come straight
+out of the served HTML with lxml, over one pooled keep-alive session, without
+a browser round trip per field. Colors and affiliate links need clicks on
+the live page, so with a `fallback` SeleniumFetcher only that flow runs in
+the browser. Without one, the page's own variant is recorded from its
+embedded image data and affiliate links are left empty.
+"""
+
+import json
+import re
+
+from lxml import html as lxml_html
+
+from scrape_common import make_session, process_price
+
+# sent with every page request, so pages are served as they are to Chrome
+HEADERS = {
+    "User-Agent": (
+        "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 "
+        "(KHTML, like Gecko) Chrome/126.0 Safari/537.36"
+    ),
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+    "Accept-Language": "en-IN,en;q=0.9",
+}
+
+# the image gallery the page script starts with: 'colorImages': { 'initial': [...] }
+COLOR_IMAGES = re.compile(rb"'colorImages'\s*:\s*\{\s*'initial'\s*:\s*(?=\[)")
+
+
+def _has_class(name):
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+
+def _text(element):
+    return element.text_content().strip()
+
+
+def parse_images(page, tree):
+    """
+    The current variant's gallery from the page's embedded image data, or the
+    landing image alone if the script is missing
+    """
+    alt = tree.xpath("//*[@id='landingImage']/@alt")
+    alt = alt[0] if alt else ""
+
+    match = COLOR_IMAGES.search(page)
+    if match is not None:
+        # the array nests objects and arrays of its own, so let the JSON
+        # decoder find where it ends
+        try:
+            gallery, _ = json.JSONDecoder().raw_decode(
+                page[match.end() :].decode("utf-8", "replace")
+            )
+        except ValueError:
+            gallery = []
+        images = [
+            {"href": image.get("large") or image.get("hiRes"), "alt": alt}
+            for image in gallery
+            if image.get("large") or image.get("hiRes")
+        ]
+        if images:
+            return images
+
+    return [
+        {"href": img.get("src"), "alt": img.get("alt") or alt}
+        for img in tree.xpath("//*[@id='main-image-container']//img[@src]")[:1]
+    ]
+
+
+def parse_product(page, href):
+    """
+    The product record get_products.SeleniumFetcher.scrape builds, from raw
+    page bytes. Raises ValueError for pages without a product title (e.g. a
+    captcha interstitial), so the caller can retry.
+    """
+    tree = lxml_html.fromstring(page)
+
+    title = tree.xpath("//*[@id='productTitle']")
+    if not title:
+        raise ValueError(f"no product title at {href}")
+    title = _text(title[0])
+
+    price = tree.xpath(f"//span[{_has_class('a-price-whole')}]")
+    price = process_price(_text(price[0])) if price else None
+
+    product_information = []
+    for fact in tree.xpath(f"//*[{_has_class('product-facts-detail')}]"):
+        left = fact.xpath(f".//*[{_has_class('a-col-left')}]")
+        right = fact.xpath(f".//*[{_has_class('a-col-right')}]")
+        if left and right:
+            left, right = _text(left[0]), _text(right[0])
+            if (left != "" and right != ""):
+                product_information.append({left: right})
+
+    about_item = [
+        _text(li) for li in tree.xpath("//*[@id='productFactsDesktopExpander']//li")
+    ]
+
+    color_name = tree.xpath("//*[@id='variation_color_name']/div/span")
+    color_name = _text(color_name[0]) if color_name else "unknown"
+
+    return {
+        "href": href,
+        "title": title,
+        "price": price,
+        "product_information": product_information,
+        "about_item": about_item,
+        "colors": {
+            color_name: {"images": parse_images(page, tree), "affiliate_href": ""}
+        },
+    }
+
+
+class HtmlFetcher:
+    """
+    scrape(href) with one GET and an lxml parse; `fallback` (a
+    SeleniumFetcher) fills in every color variant and its affiliate link
+    """
+
+    def __init__(self, session=None, fallback=None, timeout=10):
+        self.session = session or make_session(1, headers=HEADERS)
+        self.fallback = fallback
+        self.timeout = timeout
+
+    def fetch(self, href):
+        response = self.session.get(href, timeout=self.timeout)
+        response.raise_for_status()
+        return response.content
+
+    def scrape(self, href):
+        product = parse_product(self.fetch(href), href)
+        if self.fallback is not None:
+            product["colors"] = self.fallback.colors(href)
+        return product
+
+    def close(self):
+        if self.fallback is not None:
+            self.fallback.close()
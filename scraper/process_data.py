@@ -1,38 +1,290 @@
+"""
+Normalize scraped products into the catalog the model and backend load
+
+    python process_data.py ./data/product_data.jsonl ./data/processed_data.jsonl
+    python process_data.py ./data/womens_product_data.json ./data/womens_processed_data.json --format json
+
+Products are read one at a time and written out as they go, one record per
+color variant with its top image and whole gallery: from the scraper's JSONL
+checkpoint, or streamed with ijson from an older nested product_data.json.
+Colors and categories are canonicalized through lookup tables, so "Navy",
+"navy-blue" and "NAVY BLUE" all become "navy blue".
+
+Labels (and the "product_<label>" ids derived from them) come from an id
+registry next to the output, keyed by ASIN and color. A variant keeps its
+label across runs, new variants take the next free one, and labels of
+variants that disappeared are not reused. The model and backend therefore
+see the same product under the same label after every rescrape.
+
+--format jsonl writes one record per line with its "label" inline; --format
+json writes the dict keyed by label that older tools expect. For the
+memory-mappable columnar store, run backend/product_store.py on either.
+"""
+
+import argparse
+import collections
 import json
+import os
+import re
+from urllib.parse import unquote
+
+import ijson
+
+from checkpoint import read_records
+
+# canonical color names; anything that does not map to one becomes "unknown"
+COLORS = frozenset([
+    "off white", "pink", "unknown", "yellow", "black", "white", "wine", "brown",
+    "multicolour", "olive", "purple", "green", "red", "beige", "grey", "maroon",
+    "peach", "navy blue", "magenta", "rust", "mustard", "orange", "blue",
+    "dark blue", "sky blue", "teal",
+])
+
+COLOR_SYNONYMS = {
+    "navy": "navy blue",
+    "gray": "grey",
+    "offwhite": "off white",
+    "cream": "off white",
+    "ivory": "off white",
+    "multi": "multicolour",
+    "multicolor": "multicolour",
+    "multi color": "multicolour",
+    "multi colour": "multicolour",
+    "multicoloured": "multicolour",
+    "multicolored": "multicolour",
+    "burgundy": "maroon",
+    "light blue": "sky blue",
+    "baby blue": "sky blue",
+    "royal blue": "blue",
+    "dark navy": "navy blue",
+    "olive green": "olive",
+    "mustard yellow": "mustard",
+    "lavender": "purple",
+    "violet": "purple",
+    "fuchsia": "magenta",
+    "coffee": "brown",
+    "tan": "beige",
+    "khaki": "beige",
+    "wine red": "wine",
+}
+
+# canonical category names, as the href data and the frontend spell them
+CATEGORIES = {
+    "above the knee": "Above the Knee",
+    "below the knee": "Below the Knee",
+    "knee length": "Knee-Length",
+    "high low": "High-Low",
+    "floor length": "Floor Length",
+    "calf length": "Calf Length",
+    "ankle length": "Ankle Length",
+}
+
+CATEGORY_SYNONYMS = {
+    "hi low": "high low",
+    "mini": "above the knee",
+    "midi": "calf length",
+    "maxi": "floor length",
+    "knee": "knee length",
+}
+
+ASIN = re.compile(r"/dp/([A-Z0-9]{10})")
+
+
+def lookup_key(value):
+    """
+    Case, hyphens, underscores, repeated spaces and variant suffixes such as
+    "-2" do not matter
+    """
+    value = re.sub(r"[-_/]+", " ", (value or "").lower())
+    value = re.sub(r"\s+\d+$", "", value)
+    return " ".join(value.split())
+
+
+def canonical_color(raw):
+    key = lookup_key(raw)
+    key = COLOR_SYNONYMS.get(key, key)
+    return key if key in COLORS else "unknown"
+
+
+def canonical_category(raw):
+    key = lookup_key(raw)
+    key = CATEGORY_SYNONYMS.get(key, key)
+    # categories come from our own href lists, so unknown ones pass through
+    return CATEGORIES.get(key, raw)
+
+
+def asin_of(href):
+    """
+    The product's ASIN, also inside sponsored redirect links; the href itself
+    when there is none
+    """
+    match = ASIN.search(unquote(href))
+    return match.group(1) if match else href
+
 
-# Load the product data
-with open('./data/womens_product_data.json', 'r') as file:
-    data = json.load(file)
-
-# Extract necessary data
-image_metadata = {}  # To store extracted image URLs and metadata
-id = 1
-for category, products in data["Women's Clothing"].items():
-    for product in products:
-        title = product['title']
-        price = product['price']
-        product_info = product['product_information']
-        about_item = product['about_item']
-
-        for color, color_data in product['colors'].items():
-            # Get the top image (assuming it's the first one)
-            color = color.lower()
-            if color not in ['off white', 'pink', 'unknown', 'yellow', 'black', 'white', 'wine', 'brown', 'multicolour', 'olive', 'purple', 'green', 'red', 'beige', 'grey', 'maroon', 'peach', 'navy blue', 'magenta', 'rust', 'mustard', 'navy', 'orange', 'blue', 'dark blue', 'sky blue', 'teal']:
-                color = "unknown"
-            top_image = color_data['images'][0]
-            image_metadata[id] = {
-                'id': f"product_{id}",
-                'affiliate_href': color_data["affiliate_href"],
-                'category': category,
-                'title': title,
-                'price': price,
-                'product_information': product_info,
-                'about_item': about_item,
-                'color': color,
-                'image_href': top_image['href'],
-                'image_alt': top_image['alt']
+def _stream_nested(file):
+    # {main_category: {category: [product]}}, one product built at a time
+    depth = 0
+    builder = None
+    keys = [None, None]
+    for _, event, value in ijson.parse(file, use_float=True):
+        if builder is not None:
+            builder.event(event, value)
+            if event in ("start_map", "start_array"):
+                nesting += 1
+            elif event in ("end_map", "end_array"):
+                nesting -= 1
+                if nesting == 0:
+                    yield keys[0], keys[1], builder.value
+                    builder = None
+            continue
+
+        if event == "map_key" and depth in (1, 2):
+            keys[depth - 1] = value
+        elif event == "start_map" and depth == 3:
+            builder = ijson.ObjectBuilder()
+            builder.event(event, value)
+            nesting = 1
+        elif event in ("start_map", "start_array"):
+            depth += 1
+        elif event in ("end_map", "end_array"):
+            depth -= 1
+
+
+def iter_products(path):
+    """
+    (main_category, category, product) from a JSONL checkpoint or a nested
+    product_data.json
+    """
+    if path.endswith(".jsonl"):
+        for record in read_records(path):
+            yield record.pop("main_category"), record.pop("category"), record
+        return
+
+    with open(path, "rb") as file:
+        yield from _stream_nested(file)
+
+
+class IdRegistry:
+    """
+    Persistent variant key -> label map; labels are handed out in order and
+    never reused
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.labels = {}
+        self.next_label = 1
+        if os.path.exists(path):
+            with open(path, "r") as file:
+                registry = json.load(file)
+            self.labels = registry["labels"]
+            self.next_label = registry["next_label"]
+
+    def label(self, key):
+        label = self.labels.get(key)
+        if label is None:
+            label = self.labels[key] = self.next_label
+            self.next_label += 1
+        return label
+
+    def save(self):
+        temporary = self.path + ".tmp"
+        with open(temporary, "w") as file:
+            json.dump({"next_label": self.next_label, "labels": self.labels}, file)
+        os.replace(temporary, self.path)
+
+
+def normalize(products, registry, main_category=None, stats=None):
+    """
+    (label, record) per color variant with at least one image; a variant
+    listed under several categories is kept once, under the first
+    """
+    emitted = set()
+    for product_main_category, category, product in products:
+        if main_category is not None and product_main_category != main_category:
+            continue
+        asin = asin_of(product["href"])
+        category = canonical_category(category)
+
+        for raw_color, color_data in product["colors"].items():
+            if not color_data["images"]:
+                continue
+            key = f"{asin}/{lookup_key(raw_color)}"
+            if key in emitted:
+                continue
+            emitted.add(key)
+
+            color = canonical_color(raw_color)
+            if stats is not None and color == "unknown" and color != lookup_key(raw_color):
+                stats[lookup_key(raw_color)] += 1
+
+            # the top image stands for the variant on the card; the model
+            # embeds the whole gallery
+            top_image = color_data["images"][0]
+            label = registry.label(key)
+            yield label, {
+                "id": f"product_{label}",
+                "affiliate_href": color_data["affiliate_href"],
+                "category": category,
+                "title": product["title"],
+                "price": product["price"],
+                "product_information": product["product_information"],
+                "about_item": product["about_item"],
+                "color": color,
+                "image_href": top_image["href"],
+                "image_alt": top_image["alt"],
+                "images": list(
+                    dict.fromkeys(image["href"] for image in color_data["images"])
+                ),
             }
-            id += 1
 
-with open("./data/womens_processed_data.json", "w") as file:
-    json.dump(image_metadata, file)
+
+def write_catalog(variants, path, output_format="jsonl"):
+    """
+    Stream (label, record) pairs to `path`; returns how many were written
+    """
+    count = 0
+    temporary = path + ".tmp"
+    with open(temporary, "w") as file:
+        if output_format == "json":
+            file.write("{")
+        for label, record in variants:
+            if output_format == "json":
+                file.write(f'{"," if count else ""}"{label}": {json.dumps(record)}')
+            else:
+                file.write(json.dumps({"label": label, **record}) + "\n")
+            count += 1
+        if output_format == "json":
+            file.write("}")
+    os.replace(temporary, path)
+    return count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("input", nargs="?", default="./data/product_data.jsonl")
+    parser.add_argument("output", nargs="?", default="./data/processed_data.jsonl")
+    parser.add_argument("--format", choices=["jsonl", "json"], default=None)
+    parser.add_argument("--registry", default=None, help="defaults to <output dir>/id_registry.json")
+    parser.add_argument("--main-category", default="Women's Clothing")
+    args = parser.parse_args()
+
+    output_format = args.format or ("jsonl" if args.output.endswith(".jsonl") else "json")
+    registry = IdRegistry(
+        args.registry or os.path.join(os.path.dirname(args.output) or ".", "id_registry.json")
+    )
+
+    unknown_colors = collections.Counter()
+    count = write_catalog(
+        normalize(iter_products(args.input), registry, args.main_category, unknown_colors),
+        args.output,
+        output_format,
+    )
+    registry.save()
+
+    print(f"Wrote {count} variants to {args.output}")
+    if unknown_colors:
+        print(f"{sum(unknown_colors.values())} variants with unmapped colors, most common:")
+        for color, seen in unknown_colors.most_common(10):
+            print(f"  {color!r}: {seen}")
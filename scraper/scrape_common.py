@@ -0,0 +1,36 @@
+"""
+Helpers shared by the product fetchers
+"""
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+def make_session(pool_size, max_retries=3, backoff_factor=0.5, headers=None):
+    # retries back off inside urllib3 instead of sleeping on the caller
+    retry = Retry(
+        total=max_retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=("GET",),
+    )
+    adapter = HTTPAdapter(
+        pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry
+    )
+    session = requests.Session()
+    if headers:
+        session.headers.update(headers)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def process_price(price):
+    res = 0
+    i = 0
+    for p in price[::-1]:
+        if (p.isnumeric()):
+            res += (int(p)*(10**i))
+            i += 1
+    return res
@@ -0,0 +1,128 @@
+import collections
+import functools
+import http.server
+import json
+import threading
+
+import pytest
+
+from bench_fetch import QuietHandler, write_synthetic_fixtures
+from checkpoint import read_records
+from get_products import run
+from html_fetcher import HEADERS, HtmlFetcher
+from scrape_common import make_session
+
+CAPTCHA_PAGE = b"<html><body><form action='/errors/validateCaptcha'></form></body></html>"
+
+
+class StandInHandler(QuietHandler):
+    """
+    Serves the fixture pages, counting requests per path; `flaky` paths get
+    a captcha interstitial for their first few requests
+    """
+
+    requests = None
+    flaky = None
+    lock = threading.Lock()
+
+    def do_GET(self):
+        with self.lock:
+            self.requests[self.path] += 1
+            captcha = self.requests[self.path] <= self.flaky.get(self.path, 0)
+        if captcha:
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html")
+            self.send_header("Content-Length", str(len(CAPTCHA_PAGE)))
+            self.end_headers()
+            self.wfile.write(CAPTCHA_PAGE)
+            return
+        super().do_GET()
+
+
+@pytest.fixture
+def site(tmp_path):
+    pages = tmp_path / "site"
+    pages.mkdir()
+    write_synthetic_fixtures(str(pages), 5, images=2)
+
+    handler = type(
+        "Handler",
+        (StandInHandler,),
+        {"requests": collections.Counter(), "flaky": {"/product_1.html": 2}},
+    )
+    server = http.server.ThreadingHTTPServer(
+        ("127.0.0.1", 0), functools.partial(handler, directory=str(pages))
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}", handler.requests
+    server.shutdown()
+    server.server_close()
+
+
+def scrape(href_data, tmp_path, workers=3):
+    session = make_session(workers, headers=HEADERS)
+    return run(
+        href_data,
+        str(tmp_path / "product_data.jsonl"),
+        str(tmp_path / "product_data.json"),
+        lambda number: HtmlFetcher(session),
+        workers=workers,
+        retries=2,
+    )
+
+
+def test_concurrent_run_retries_and_resumes(site, tmp_path):
+    base, requests = site
+    page = lambda i: f"{base}/product_{i}.html"
+    href_data = {
+        "Women's Clothing": {
+            "Mini": [page(0), page(1), page(2), f"{base}/missing.html"],
+            "Maxi": [page(2), page(3)],
+        }
+    }
+
+    counts = scrape(href_data, tmp_path)
+    assert counts == {"done": 4, "failed": 1}
+    # a product listed under two categories is fetched once
+    assert requests["/product_2.html"] == 1
+    # two captcha pages, then the product, within the two retries
+    assert requests["/product_1.html"] == 3
+    assert requests["/missing.html"] == 3
+
+    with open(tmp_path / "product_data.json") as file:
+        nested = json.load(file)["Women's Clothing"]
+    assert sorted(product["href"] for product in nested["Mini"]) == [
+        page(0),
+        page(1),
+        page(2),
+    ]
+    assert sorted(product["href"] for product in nested["Maxi"]) == [page(2), page(3)]
+
+    # the process dies while writing the last line
+    checkpoint = tmp_path / "product_data.jsonl"
+    lines = checkpoint.read_bytes().splitlines(keepends=True)
+    torn = json.loads(lines[-1])
+    checkpoint.write_bytes(b"".join(lines[:-1]) + lines[-1][: len(lines[-1]) // 2])
+
+    requests.clear()
+    href_data["Women's Clothing"]["Mini"].append(page(4))
+    counts = scrape(href_data, tmp_path)
+
+    # only the torn product, the new one and the earlier failure are fetched
+    assert counts == {"done": 2, "failed": 1}
+    assert set(requests) == {
+        torn["href"][len(base) :],
+        "/product_4.html",
+        "/missing.html",
+    }
+    records = list(read_records(str(checkpoint)))
+    assert len(records) == len(lines) + 1
+    assert checkpoint.read_bytes().count(b"\n") == len(records)
+    assert {(record["category"], record["href"]) for record in records} == {
+        ("Mini", page(0)),
+        ("Mini", page(1)),
+        ("Mini", page(2)),
+        ("Mini", page(4)),
+        ("Maxi", page(2)),
+        ("Maxi", page(3)),
+    }
@@ -10,12 +10,16 @@ in pkgs.mkShell {
       python-pkgs.setuptools
       python-pkgs.urllib3
       python-pkgs.selenium
+      python-pkgs.lxml
+      python-pkgs.ijson
       python-pkgs.faiss
       python-pkgs.fastapi
+      python-pkgs.orjson
       python-pkgs.pydantic
       python-pkgs.uvicorn
       python-pkgs.pynvim
       python-pkgs.black
+      python-pkgs.pytest
     ]))
     pkgs.chromedriver
   ];